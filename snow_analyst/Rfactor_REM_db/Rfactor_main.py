@@ -9,8 +9,10 @@ It receives input monthly precipitation rasters, in .tif format, and calculates
 each input file. The resulting file is in .tif format with th same raster properties as the input files.
 """
 
+import checkpoints
 import config_input
 import file_management
+import instrumentation
 from Rfactor_REM_db import Rfactor_data_management as data_management
 from Rfactor_REM_db import Rfactor_raster_calculations as raster_calc
 from package_handling import *
@@ -28,35 +30,101 @@ def monthly_factor(m):
     return fm
 
 
-def rfactor(m, p_array, f_el_array):
+def rfactor(m, p_array, f_el_array, out=None, a=0.207, b=1.561):
     """Receives the month corresponding to the file (and calculates the monthly factor with the corresponding
     function),the monthly precipitation array and the f(E,L) array and calculates the RFactor using the REM(DB) from
     Diodato & Bellocchi (2007)
-    :param f_el_array: f_EL raster data as np.array
+    :param f_el_array: f_EL raster data as np.array, with np.nan in no data cells
     :param m: month (in number format)
-    :param p_array: monthly precipitation raster data as np.array
-    :return: array of R factor values for each cell
+    :param p_array: monthly precipitation raster data as np.array, with np.nan in no data cells
+    :param out: (optional) preallocated np.float32 array in which to save the results. If None, a new array is created
+    :param a: (optional) coefficient of the REM(DB) equation (0.207). It can be an array which is broadcast with the
+    input arrays, e.g. with one value per row of a (samples, cells) precipitation array (see monte_carlo.py)
+    :param b: (optional) exponent of the REM(DB) equation (1.561), which can be an array as 'a'
+    :return: array of R factor values for each cell (np.nan in no data cells)
+
+    Note: no data cells are marked with np.nan instead of using masked arrays, so all operations are done in place in
+    the 'out' array. Cells with np.nan in any of the inputs (or with an invalid result) are np.nan in the result.
     """
+    # Masked arrays (previous input type) are converted to np.nan arrays
+    if np.ma.isMaskedArray(p_array):
+        p_array = p_array.astype(np.float32).filled(np.nan)
+    if np.ma.isMaskedArray(f_el_array):
+        f_el_array = f_el_array.astype(np.float32).filled(np.nan)
+    if out is None:
+        out = np.empty(np.shape(p_array), dtype=np.float32)
+
     # Calculate the monthly factor f(m):
     fm = monthly_factor(m)
 
-    # Calculate the RFactor with the Diodato and Belocchi equation:
-    # Ignore float-induced errors, to avoid error printing in the command window
-    np.seterr(all='ignore')
-    r_factor = 0.207 * np.power(p_array * (fm + f_el_array), 1.561)
-    # Convert all masked cells to np.nan values
-    r_factor = np.where(r_factor.mask == True, np.nan, r_factor)
-
-    return r_factor
+    # Calculate the RFactor with the Diodato and Belocchi equation: 0.207 * (p * (fm + f_el)) ^ 1.561
+    # Ignore float-induced errors (e.g. np.nan values), to avoid error printing in the command window
+    with np.errstate(all='ignore'):
+        np.add(f_el_array, fm, out=out)
+        np.multiply(out, p_array, out=out)
+        np.power(out, b, out=out)
+        np.multiply(out, a, out=out)
 
+    return out
 
-def calculate_REM_db():
-    # 1. Save all monthly precipitation rasters, with .tif extension, in a list, to iterate over them
-    filenames = glob.glob(file_management.rain_raster_path + "/*.tif")
 
-    # 2. Filter precipitation raster list to only include rasters corresponding to the analysis date range
+def rfactor_windowed(m, p_path, f_el_path, output_path, gt, proj, block_size):
+    """Calculates the RFactor (see 'rfactor') for a monthly precipitation raster window by window, reading the same
+    window from the precipitation and f(E,L) rasters and writing it to the output raster. Only one window of each
+    raster is in memory at a time.
+    :param m: month (in number format)
+    :param p_path: path of monthly precipitation raster (.tif)
+    :param f_el_path: path of f(E,L) raster (.tif), with the same size as the precipitation raster
+    :param output_path: path (with name and .tif extension) of the resulting R factor raster
+    :param gt: geotransform of resulting raster
+    :param proj: projection of resulting raster
+    :param block_size: int, approximate number of rows and columns in each window
+    :return: ---
+    """
+    p_raster = gdal.Open(p_path)
+    p_band = p_raster.GetRasterBand(1)
+    f_el_raster = gdal.Open(f_el_path)
+    f_el_band = f_el_raster.GetRasterBand(1)
+
+    windows = raster_calc.block_windows(p_path, block_size)
+    out_raster = raster_calc.create_raster(output_path, p_raster.RasterXSize, p_raster.RasterYSize, gt, proj)
+    out_band = out_raster.GetRasterBand(1)
+
+    # Allocate buffers for the largest window once. Each window uses a (contiguous) view of the buffers
+    n_cells = max(w[2] * w[3] for w in windows)
+    p_buffer = np.empty(n_cells, dtype=np.float32)
+    f_el_buffer = np.empty(n_cells, dtype=np.float32)
+    r_buffer = np.empty(n_cells, dtype=np.float32)
+
+    for window in windows:
+        shape = (window[3], window[2])  # (rows, columns)
+        p_array = raster_calc.band_to_nan_array(p_band, window, out=p_buffer[:shape[0] * shape[1]].reshape(shape))
+        f_el_array = raster_calc.band_to_nan_array(f_el_band, window,
+                                                   out=f_el_buffer[:shape[0] * shape[1]].reshape(shape))
+        r_array = rfactor(m, p_array, f_el_array, out=r_buffer[:shape[0] * shape[1]].reshape(shape))
+        out_band.WriteArray(r_array, window[0], window[1])
+
+    out_band = None
+    raster_calc.close_raster(out_raster, output_path)
+
+
+def calculate_REM_db(date_list=None):
+    """Calculates the monthly REM(DB) R factor rasters from the monthly precipitation (rain) rasters. Each month is
+    recorded in the run report (see instrumentation.py) and gets its completion marker (see checkpoints.py) when it is
+    saved.
+    :param date_list: (optional) list with the months (in datetime format) to calculate. If None, the R factor is
+    calculated for all months in the analysis date range.
+    :return: ---
+    """
+    # 1-2. Save all monthly precipitation rasters, with .tif extension, corresponding to the analysis date range in a
+    # list, to iterate over them
     filenames = data_management.filter_raster_lists(
-        filenames, config_input.start_date, config_input.end_date)
+        file_management.rain_raster_path, config_input.start_date, config_input.end_date)
+    if date_list is not None:
+        months = [d.strftime('%Y%m') for d in date_list]
+        filenames = [f for f in filenames if data_management.get_date(f).strftime('%Y%m') in months]
+        if len(filenames) == 0:
+            return
 
     # 3. Compare one of the Monthly precipitation files with the input f(EL) raster to make sure they have the
     # same properties
@@ -66,8 +134,14 @@ def calculate_REM_db():
     # and assume the rest have the same information
     gt, proj = raster_calc.get_raster_data(filenames[0])
 
-    # 4. Save the f(E,L) raster to a masked array, since it remains constant for each iteration
-    f_el_array = raster_calc.raster_to_array(config_input.fEL_path)
+    # 4. Save the f(E,L) raster to an array (np.nan in no data cells), since it remains constant for each iteration,
+    # and allocate the precipitation and R factor arrays once, to reuse them for each month. In windowed mode, only
+    # one window of each raster is read at a time (see 'rfactor_windowed')
+    block_size = config_input.r_factor_block_size
+    if not block_size:
+        f_el_array = raster_calc.raster_to_nan_array(config_input.fEL_path)
+        precip_array = np.empty_like(f_el_array)
+        r_factor_array = np.empty_like(f_el_array)
 
     for file in filenames:  # Iterate through each monthly precipitation file
         # 1. Get complete name of raster being analyzed (including extension)
@@ -77,17 +151,23 @@ def calculate_REM_db():
         # 2. Get the date and them month for the corresponding file
         date = data_management.get_date(name)
         month = float(date.month)
+        output_name = os.path.join(
+            file_management.r_factor_path, f"RFactor_REM_db_{str(date.strftime('%Y%m'))}.tif")
 
-        # 3. Save the precipitation raster as a masked array
-        precip_array = raster_calc.raster_to_array(file)
+        with instrumentation.stage("r_factor", date):
+            if block_size:
+                # 3. Calculate the RFactor window by window and save it to a .tif raster
+                rfactor_windowed(month, file, config_input.fEL_path, output_name, gt, proj, block_size)
+            else:
+                # 3. Read the precipitation raster into the preallocated array
+                raster_calc.raster_to_nan_array(file, out=precip_array)
 
-        # 4. Calculate RFactor raster
-        r_factor_array = rfactor(month, precip_array, f_el_array)
+                # 4. Calculate RFactor raster
+                rfactor(month, precip_array, f_el_array, out=r_factor_array)
 
-        # 5. Save RFactor array to a .tif raster
-        output_name = os.path.join(
-            file_management.r_factor_path, f"RFactor_REM_db_{str(date.strftime('%Y%m'))}.tif")
-        raster_calc.save_raster(r_factor_array, output_name, gt, proj)
+                # 5. Save RFactor array to a .tif raster
+                raster_calc.save_raster(r_factor_array, output_name, gt, proj)
+        checkpoints.mark_complete("r_factor", date)
 
 
 if __name__ == '__main__':
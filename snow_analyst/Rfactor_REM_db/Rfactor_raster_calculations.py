@@ -2,7 +2,9 @@
 deal directly with gdal commands, such as reading, extracting data and saving gdal raster files.
 """
 
+import raster_metadata
 from package_handling import *
+from raster_calculations import band_to_nan_array, block_windows, raster_to_nan_array
 
 
 def check_input_rasters(raster1, raster2):
@@ -16,22 +18,22 @@ def check_input_rasters(raster1, raster2):
     :param raster2: raster path (in .tif format)
     :return: ---
     """
-    # Get data  for each input raster
-    raster = gdal.Open(raster1)  # Extract raster from path
+    # Get data  for each input raster (from the raster metadata cache, so each raster is only opened once per run)
+    raster = raster_metadata.get_metadata(raster1)
     # Get Geotransform Data: (Top left corner X, cell size, 0, Top left corner Y, 0,
-    gt_1 = raster.GetGeoTransform()
+    gt_1 = raster.gt
     # -cell size)
-    proj_1 = raster.GetProjection()  # Get projection of raster
-    x_size_1 = raster.RasterXSize  # Number of columns
-    y_size_1 = raster.RasterYSize  # Number of rows
+    proj_1 = raster.proj  # Get projection of raster
+    x_size_1 = raster.x_size  # Number of columns
+    y_size_1 = raster.y_size  # Number of rows
 
-    raster = gdal.Open(raster2)  # Extract raster from path
+    raster = raster_metadata.get_metadata(raster2)
     # Get Geotransform Data: (Top left corner X, cell size, 0, Top left corner Y, 0,
-    gt_2 = raster.GetGeoTransform()
+    gt_2 = raster.gt
     # -cell size)
-    proj_2 = raster.GetProjection()  # Get projection of raster
-    x_size_2 = raster.RasterXSize  # Number of columns
-    y_size_2 = raster.RasterYSize  # Number of rows
+    proj_2 = raster.proj  # Get projection of raster
+    x_size_2 = raster.x_size  # Number of columns
+    y_size_2 = raster.y_size  # Number of rows
 
     # 1. Check resolution: check if they have the same cell resolution
     if not np.float32(gt_1[1]) == np.float32(gt_2[1]):
@@ -74,11 +76,11 @@ def get_raster_data(raster_path):
     :param raster_path: raster file path
     :return: geotransform and projection
     """
-    raster = gdal.Open(raster_path)  # Extract raster from path
+    raster = raster_metadata.get_metadata(raster_path)  # Raster metadata (only read once per raster)
     # Get Geotransform Data: Coordinate upper left X, cell size, 0, Coord. upper left Y,
-    gt = raster.GetGeoTransform()
+    gt = raster.gt
     #                                   0, -cell size
-    proj = raster.GetProjection()  # Get projection of raster
+    proj = raster.proj  # Get projection of raster
 
     return gt, proj  # Return both variables
 
@@ -125,6 +127,44 @@ def raster_to_array(raster_path, mask=True):
         return array
 
 
+def create_raster(output_path, x_size, y_size, gt, proj):
+    """
+        Function creates an empty, single band float32 .tif raster file, into which data can be written window by
+        window (see 'close_raster').
+
+        :param output_path: file name (with path and extension) with which to save the raster
+        :param x_size: int, number of columns
+        :param y_size: int, number of rows
+        :param gt: geotransform of resulting raster
+        :param proj: projection for resulting raster
+        :return: gdal dataset of the created raster
+        """
+    driver = gdal.GetDriverByName("GTiff")
+    driver.Register()
+    outrs = driver.Create(output_path, xsize=x_size, ysize=y_size, bands=1, eType=gdal.GDT_Float32)
+    outrs.SetGeoTransform(gt)
+    outrs.SetProjection(proj)
+    outrs.GetRasterBand(1).SetNoDataValue(np.nan)  # Set no data value as Numpy nan
+    return outrs
+
+
+def close_raster(outrs, output_path):
+    """
+        Function computes the statistics of a raster created with 'create_raster' and saves it to file.
+
+        :param outrs: gdal dataset created with 'create_raster'
+        :param output_path: file name of the raster (for printing)
+        :return: ---
+        """
+    outband = outrs.GetRasterBand(1)
+    outband.ComputeStatistics(0)
+    outband.FlushCache()
+    outband = None
+    outrs = None
+
+    print("Saved raster: ", os.path.basename(output_path))
+
+
 def save_raster(array, output_path, gt, proj):
     """
         Function saves an array into a .tif raster file.
@@ -0,0 +1,83 @@
+"""
+Import time benchmark: measures how long it takes to import a module of the snow_analyst package (default:
+'total_R_factor') and which of the heavy third party packages are imported with it.
+
+The import is run in a new python process with 'python -X importtime', so nothing is cached from previous imports.
+Since the heavy packages (gdal, matplotlib, pandas, rasterstats, scipy, geo_utils) are imported lazily by
+package_handling.py, they should not appear in the list of imported packages.
+
+Run from the 'snow_analyst' folder:
+    python benchmarks/bench_import_time.py [module] [repetitions]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+snow_analyst_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# packages which should only be imported when they are used
+heavy_packages = ["gdal", "osgeo", "matplotlib", "pandas", "rasterstats", "scipy", "geo_utils", "shapely", "fiona"]
+
+# code run in the new process: disable all modules, so importing the modules does not check or create any input/output
+# folders (other than a temporary results folder)
+import_code = """
+import config_input
+config_input.results_path = {results_path!r}
+for run_flag in ["run_pt_manipulation", "run_rain_snow_rasters", "run_snow_cover", "run_wasim_snow", "run_snow_melt",
+                 "run_r_factor", "run_total_factor"]:
+    setattr(config_input, run_flag, False)
+import {module}
+"""
+
+
+def measure_import(module, results_path):
+    """
+    Imports a module in a new python process with '-X importtime' and parses the import times from stderr.
+    :param module: STR with name of the module to import
+    :param results_path: STR with path of the (temporary) results folder
+    :return: DICT with the cumulative import time of each imported module (in microseconds)
+    """
+    code = import_code.format(results_path=results_path, module=module)
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=snow_analyst_path,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        sys.exit("Importing {} failed:\n{}".format(module, process.stderr[-2000:]))
+
+    # lines: 'import time:      self [us] |      cumulative | imported package'
+    import_times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        name = fields[2].strip()
+        import_times[name] = max(int(fields[1]), import_times.get(name, 0))
+    return import_times
+
+
+def main(module="total_R_factor", repetitions=3):
+    results_path = tempfile.mkdtemp(prefix="bench_import_time_")
+    print("Importing {} ({} repetitions)".format(module, repetitions))
+    runs = [measure_import(module, results_path) for _ in range(repetitions)]
+
+    # cumulative time of the module itself (the best of all repetitions)
+    best = min(runs, key=lambda times: times.get(module, 0))
+    print("Import time of {}: {:.3f} s (best of {})".format(module, best.get(module, 0) / 1e6, repetitions))
+
+    heavy_imported = sorted(set(name.split(".")[0] for name in best if name.split(".")[0] in heavy_packages))
+    if heavy_imported:
+        print("Heavy packages imported: {}".format(", ".join(heavy_imported)))
+    else:
+        print("Heavy packages imported: none")
+
+    print("\n{:<40}{:>15}".format("Slowest imports", "cumulative [s]"))
+    for name, cumulative in sorted(best.items(), key=lambda item: item[1], reverse=True)[:15]:
+        print("{:<40}{:>15.3f}".format(name, cumulative / 1e6))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(args[0] if len(args) > 0 else "total_R_factor", int(args[1]) if len(args) > 1 else 3)
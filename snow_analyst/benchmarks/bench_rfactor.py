@@ -0,0 +1,105 @@
+"""
+Micro-benchmark for the R factor calculations: compares the previous masked array implementation (np.ma) of the REM(DB)
+R factor and the total R factor with the current np.nan based, in-place implementation ('Rfactor_main.rfactor' and
+'total_R_factor.total_factor').
+
+The benchmark uses random arrays with the size of a realistic 25x25 m raster (default: 4000 rows x 3000 columns, i.e. a
+100 km x 75 km area), where ~30 % of the cells are no data cells (outside of the catchment).
+
+Run from the 'snow_analyst' folder:
+    python benchmarks/bench_rfactor.py [rows] [columns] [repetitions]
+"""
+
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config_input
+
+# Only the calculation functions are benchmarked: disable all modules, so importing the modules does not check or create
+# any input/output folders (other than a temporary results folder)
+config_input.results_path = tempfile.mkdtemp(prefix="bench_rfactor_")
+for run_flag in ["run_pt_manipulation", "run_rain_snow_rasters", "run_snow_cover", "run_wasim_snow", "run_snow_melt",
+                 "run_r_factor", "run_total_factor"]:
+    setattr(config_input, run_flag, False)
+
+import total_R_factor
+from Rfactor_REM_db import Rfactor_main
+from package_handling import *
+
+
+def masked_rfactor(m, p_array, f_el_array):
+    """Previous implementation of 'Rfactor_main.rfactor', with masked arrays (reference for the benchmark)"""
+    fm = Rfactor_main.monthly_factor(m)
+    np.seterr(all='ignore')
+    r_factor = 0.207 * np.power(p_array * (fm + f_el_array), 1.561)
+    r_factor = np.where(r_factor.mask == True, np.nan, r_factor)
+    return r_factor
+
+
+def masked_total_factor(s_array, r_array, snow_factor):
+    """Previous implementation of the total R factor calculation, with masked arrays (reference for the benchmark)"""
+    s_array = np.multiply(s_array, snow_factor)
+    total_factor = np.add(s_array, r_array)
+    total_factor = np.where(total_factor.mask, np.nan, total_factor)
+    return total_factor
+
+
+def generate_arrays(rows, columns, no_data=-9999.0, seed=0):
+    """
+    Generates random precipitation, f(E,L) and snow melt arrays, with the no data cells (no_data value) in a band
+    around the raster.
+
+    :param rows: int, number of rows
+    :param columns: int, number of columns
+    :param no_data: float, no data value
+    :param seed: int, seed for the random number generator
+    :return: np.arrays (float32) with precipitation, f(E,L) and snow melt values
+    """
+    rng = np.random.default_rng(seed)
+    precip = rng.gamma(2., 40., size=(rows, columns)).astype(np.float32)
+    f_el = rng.uniform(0.1, 0.6, size=(rows, columns)).astype(np.float32)
+    melt = rng.gamma(0.5, 20., size=(rows, columns)).astype(np.float32)
+
+    # ~30 % of no data cells, outside of an elliptic catchment
+    y, x = np.ogrid[-1:1:rows * 1j, -1:1:columns * 1j]
+    outside = (x ** 2 + y ** 2) > 0.7
+    for array in (precip, f_el, melt):
+        array[outside] = no_data
+    return precip, f_el, melt
+
+
+def run(rows=4000, columns=3000, repetitions=5):
+    precip, f_el, melt = generate_arrays(rows, columns)
+    no_data = np.float32(-9999.0)
+
+    # Masked arrays (previous input) and np.nan arrays (current input)
+    precip_ma, f_el_ma, melt_ma = [np.ma.array(a, mask=(a == no_data)) for a in (precip, f_el, melt)]
+    precip_nan, f_el_nan, melt_nan = [np.where(a == no_data, np.float32(np.nan), a) for a in (precip, f_el, melt)]
+    r_factor = np.empty_like(precip_nan)
+    total = np.empty_like(precip_nan)
+
+    # Both implementations must give the same results
+    np.testing.assert_allclose(masked_rfactor(1., precip_ma, f_el_ma),
+                               Rfactor_main.rfactor(1., precip_nan, f_el_nan), rtol=1e-6)
+    np.testing.assert_allclose(masked_total_factor(melt_ma, precip_ma, 2),
+                               total_R_factor.total_factor(melt_nan, precip_nan, 2), rtol=1e-6)
+
+    benchmarks = {
+        "rfactor (masked array)": lambda: masked_rfactor(1., precip_ma, f_el_ma),
+        "rfactor (nan, out=)": lambda: Rfactor_main.rfactor(1., precip_nan, f_el_nan, out=r_factor),
+        "total factor (masked array)": lambda: masked_total_factor(melt_ma, precip_ma, 2),
+        "total factor (nan, out=)": lambda: total_R_factor.total_factor(melt_nan, precip_nan, 2, out=total),
+    }
+    print("Grid: {} rows x {} columns ({:.1f} million cells), best of {} runs".format(
+        rows, columns, rows * columns / 1e6, repetitions))
+    for name, function in benchmarks.items():
+        best = min(timeit.repeat(function, number=1, repeat=repetitions))
+        print("    {:<30}{:>10.1f} ms".format(name, best * 1000))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:4]])
@@ -0,0 +1,252 @@
+"""
+Benchmark harness for the pipeline stages: generates a synthetic input data set (see synthetic_data.py), runs each
+stage on it and saves the timings to a .json file, to track performance regressions over time. It does not need any
+network access or real input data.
+
+Scenarios (run in this order, since each stage uses the results of the previous ones):
+    generate_csv                (pt_raster_manipulation)  all months
+    generate_rain_snow_rasters  (rain_snow_rasters)       all months
+    resampling.main             (resampling)              one coarse raster to the snap raster grid
+    calculate_snow_cover        (snow_cover)              all months
+    process_snow_melt           (snow_melt_main)          all months
+    calculate_REM_db            (Rfactor_main)            all months
+    calculate_tot_R             (total_R_factor)          all months
+
+Sizes (coarse grid rows x columns, coarse cell size, snap raster cell size):
+    small:  20 x 30, 1000 m, 200 m  (100 x 150 result rasters)
+    medium: 40 x 60, 1000 m, 100 m  (400 x 600 result rasters)
+    large:  115 x 170, 1000 m, 50 m  (2300 x 3400 result rasters, the size of the original study area)
+
+Run from the 'snow_analyst' folder:
+    python benchmarks/run_benchmarks.py [--size small|medium|large] [--months 3] [--repeat 1] [--output file.json]
+                                        [--baseline previous.json] [--scenario name ...] [--keep]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+snow_analyst_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, snow_analyst_path)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# The snow_melt and Rfactor_REM_db folders are added to the path relative to the working directory (config_input)
+os.chdir(snow_analyst_path)
+
+import config_input
+import synthetic_data
+
+sizes = {"small": dict(rows=20, columns=30, cell_size=1000., snap_cell_size=200.),
+         "medium": dict(rows=40, columns=60, cell_size=1000., snap_cell_size=100.),
+         "large": dict(rows=115, columns=170, cell_size=1000., snap_cell_size=50.)}
+
+scenario_names = ["generate_csv", "generate_rain_snow_rasters", "resampling.main", "calculate_snow_cover",
+                  "process_snow_melt", "calculate_REM_db", "calculate_tot_R"]
+
+
+def configure(paths, results_path):
+    """
+    Sets the config_input variables to run all stages with the synthetic data. Must be called before importing any
+    other module, since file_management creates the result folders when it is imported.
+
+    :param paths: dictionary returned by synthetic_data.generate_dataset
+    :param results_path: folder in which to save the results
+    :return: ---
+    """
+    for name in ["precipitation_path", "temperature_path", "snapraster_path", "fEL_path", "shape_path",
+                 "si_folder_path", "start_date", "end_date"]:
+        setattr(config_input, name, paths[name])
+    config_input.shape_zone = paths["shape_path"]
+    config_input.results_path = results_path
+    config_input.plot_result = os.path.join(results_path, 'Plots')
+    config_input.plot_statistic = False
+
+    config_input.run_pt_manipulation = True
+    config_input.run_rain_snow_rasters = True
+    config_input.run_snow_cover = True
+    config_input.run_satellite_image_clip_merge = False
+    config_input.run_wasim_snow = False
+    config_input.run_snow_melt = True
+    config_input.run_r_factor = True
+    config_input.run_total_factor = True
+    config_input.input_si_dates = False
+    config_input.snow_cover_composite = False
+    config_input.persist_file_catalog = False
+    config_input.initialize_ascii()
+
+
+def get_scenarios(date_list, resampling_input, resampling_folder):
+    """
+    Gets the function to run for each scenario.
+
+    :param date_list: list with analysis dates (in datetime format)
+    :param resampling_input: path of the coarse raster to resample in the 'resampling.main' scenario
+    :param resampling_folder: folder in which to save the resampled raster
+    :return: dictionary with the scenario name as key and a function without arguments as value
+    """
+    import file_management
+    import pt_raster_manipulation
+    import rain_snow_rasters
+    import resampling
+    import snow_cover
+    import total_R_factor
+    from Rfactor_REM_db import Rfactor_main
+    from snow_melt import snow_melt_main
+
+    def run_snow_cover():
+        si_list = file_management.get_satellite_image_folders(date_list)
+        for f, d in zip(si_list, date_list):
+            snow_cover.calculate_snow_cover(os.path.join(config_input.si_folder_path, str(f)), d)
+
+    return {
+        "generate_csv": lambda: [pt_raster_manipulation.generate_csv(d) for d in date_list],
+        "generate_rain_snow_rasters": lambda: [rain_snow_rasters.generate_rain_snow_rasters(
+            os.path.join(config_input.PT_path, d.strftime('%Y%m'))) for d in date_list],
+        "resampling.main": lambda: resampling.main(resampling_input, config_input.snapraster_path,
+                                                   config_input.shape_path,
+                                                   os.path.join(resampling_folder, "Resampled.tif")),
+        "calculate_snow_cover": run_snow_cover,
+        "process_snow_melt": snow_melt_main.process_snow_melt,
+        "calculate_REM_db": Rfactor_main.calculate_REM_db,
+        "calculate_tot_R": total_R_factor.calculate_tot_R,
+    }
+
+
+def count_rasters(folder):
+    """
+    Counts the .tif rasters in a folder and its sub-folders.
+
+    :param folder: folder path
+    :return: int, number of .tif files
+    """
+    return sum(len([f for f in files if f.endswith(".tif")]) for root, dirs, files in os.walk(folder))
+
+
+def time_scenario(function, repeat):
+    """
+    Runs a scenario 'repeat' times and measures the wall and CPU time of each run.
+
+    :param function: function to run
+    :param repeat: int, number of runs
+    :return: [list with the wall time of each run (s), list with the CPU time of each run (s)]
+    """
+    wall, cpu = [], []
+    for _ in range(repeat):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        function()
+        wall.append(time.perf_counter() - wall_start)
+        cpu.append(time.process_time() - cpu_start)
+    return wall, cpu
+
+
+def compare(results, baseline_path):
+    """
+    Prints the change of the best wall time of each scenario with respect to a previous benchmark report.
+
+    :param results: dictionary with the current benchmark report
+    :param baseline_path: path of the previous benchmark report (.json)
+    :return: ---
+    """
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+    previous = {s["scenario"]: s["best_wall_s"] for s in baseline.get("scenarios", [])}
+    print("\nComparison with {} ({}, size {}):".format(os.path.basename(baseline_path), baseline.get("timestamp"),
+                                                       baseline.get("size")))
+    for s in results["scenarios"]:
+        if s["scenario"] in previous and previous[s["scenario"]] > 0:
+            change = s["best_wall_s"] / previous[s["scenario"]] - 1
+            print("    {:<30}{:>10.3f} s -> {:>10.3f} s ({:+.1%})".format(s["scenario"], previous[s["scenario"]],
+                                                                         s["best_wall_s"], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages with synthetic input data.")
+    parser.add_argument("--size", choices=sorted(sizes), default="small", help="size of the synthetic data")
+    parser.add_argument("--months", type=int, default=3, help="number of months (at least 2, for the snow melt)")
+    parser.add_argument("--repeat", type=int, default=1, help="number of runs of each scenario")
+    parser.add_argument("--output", help="path of the .json report (default: benchmarks/results/<date>.json)")
+    parser.add_argument("--baseline", help="previous .json report to compare the results with")
+    parser.add_argument("--scenario", nargs="*", choices=scenario_names,
+                        help="scenarios to time (default: all). All stages are run, since each one needs the results "
+                             "of the previous ones")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic data and results")
+    args = parser.parse_args()
+    if args.months < 2:
+        sys.exit("The snow melt needs at least 2 months. Set --months to 2 or more.")
+
+    root = tempfile.mkdtemp(prefix="snow_analyst_bench_")
+    try:
+        print("Generating synthetic '{}' data set in {}".format(args.size, root))
+        generate_start = time.perf_counter()
+        paths = synthetic_data.generate_dataset(os.path.join(root, "input"), months=args.months, **sizes[args.size])
+        generate_time = time.perf_counter() - generate_start
+
+        configure(paths, os.path.join(root, "results"))
+        # Importing the modules creates the result folders and converts the dates in config_input
+        import file_management
+        from package_handling import gdal, np
+        import raster_calculations as rc
+        date_list = file_management.get_date_list(config_input.start_date, config_input.end_date)
+
+        # Coarse raster for the resampling scenario (first precipitation file, saved as .tif)
+        resampling_folder = os.path.join(root, "results", "resampling")
+        file_management.create_folder(resampling_folder)
+        first_precip = file_management.get_PT_datefiles(config_input.precipitation_path, date_list[0])[0]
+        header = rc.get_ascii_data(first_precip)
+        proj = rc.get_raster_data(config_input.snapraster_path)[1]
+        resampling_input = os.path.join(resampling_folder, "Original.tif")
+        rc.save_raster(rc.ascii_to_array(first_precip), resampling_input, rc.get_ascii_gt(header), proj,
+                       synthetic_data.no_data)
+
+        scenarios = get_scenarios(date_list, resampling_input, resampling_folder)
+        selected = args.scenario or scenario_names
+        results = []
+        for name in scenario_names:
+            repeat = args.repeat if name in selected else 1
+            print("\n--- Running {} ({} run(s)) ---".format(name, repeat))
+            wall, cpu = time_scenario(scenarios[name], repeat)
+            if name in selected:
+                results.append({"scenario": name, "runs": repeat, "wall_s": wall, "cpu_s": cpu,
+                                "best_wall_s": min(wall), "best_cpu_s": min(cpu)})
+
+        report = {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "size": args.size,
+            "grid": sizes[args.size],
+            "months": args.months,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "gdal": gdal.__version__,
+            "data_generation_s": generate_time,
+            "result_rasters": count_rasters(os.path.join(root, "results")),
+            "scenarios": results,
+        }
+    finally:
+        if args.keep:
+            print("Synthetic data and results kept in {}".format(root))
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    output = args.output or os.path.join(snow_analyst_path, "benchmarks", "results",
+                                         "bench_{}.json".format(datetime.datetime.now().strftime("%Y%m%d_%H%M%S")))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print("\n{:<30}{:>12}{:>12}".format("Scenario", "wall [s]", "cpu [s]"))
+    for s in results:
+        print("{:<30}{:>12.3f}{:>12.3f}".format(s["scenario"], s["best_wall_s"], s["best_cpu_s"]))
+    print("Report saved in {}".format(output))
+
+    if args.baseline:
+        compare(report, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
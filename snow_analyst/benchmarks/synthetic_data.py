@@ -0,0 +1,231 @@
+"""
+Generator of synthetic input data for the benchmarks (see run_benchmarks.py). All data is generated locally (no
+downloads), in the projected coordinate system of the original input data (EPSG:32634):
+
+    <root>/
+        Precipitation/YYYYMMDD.txt      daily precipitation ASCII rasters (coarse grid, tab delimited)
+        Temperature/YYYYMMDD.txt        daily temperature ASCII rasters (coarse grid, tab delimited)
+        DEM/snap_dem.tif                snap raster (DEM) with the fine resolution of the results
+        DEM/f_L_E.tif                   f(E,L) raster, on the snap raster grid
+        Shapes/boundary.shp             boundary shapefile (snap raster extent)
+        SatelliteImages/YYYYMMDD/       pre-processed Sentinel 2 like bands (B02, B03, B11, '_r' rasters on the snap
+                                        raster grid) and a 60 m scene classification layer (SCL), for 2 sensing dates
+                                        around the end of each month
+
+The size of the data is set with the number of rows and columns of the coarse (ASCII) grid, its cell size and the cell
+size of the snap raster (e.g. a 40 x 60 grid of 1000 m cells with a 100 m snap raster gives 400 x 600 result rasters).
+
+Run from the 'snow_analyst' folder:
+    python benchmarks/synthetic_data.py <output folder> [rows] [columns] [months]
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from package_handling import *
+
+# Imported (with gdal) the first time they are used, as gdal (see package_handling.py)
+ogr = LazyModule('ogr', package_message)
+osr = LazyModule('osr', package_message)
+
+epsg = 32634
+x_ll = 350000.0  # lower left corner of the coarse grid (as in the original input data)
+y_ll = 4445000.0
+no_data = -9999.0
+
+# Reflectance values (B02, B03, B11) for snow and snow free cells
+snow_reflectance = (4500., 5000., 900.)
+ground_reflectance = (800., 1200., 1800.)
+
+
+def spatial_reference():
+    """
+    Gets the spatial reference of the synthetic data.
+
+    :return: osr.SpatialReference
+    """
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    return srs
+
+
+def write_ascii(path, array, cell_size):
+    """
+    Saves an array as a tab delimited .txt ASCII raster, with the same header as the original input data.
+
+    :param path: file path (.txt)
+    :param array: np.array with the raster values (no_data in no data cells)
+    :param cell_size: float, cell size of the raster
+    :return: ---
+    """
+    header = [("ncols", array.shape[1]), ("nrows", array.shape[0]), ("xllcorner", x_ll), ("yllcorner", y_ll),
+              ("cellsize", cell_size), ("NODATA_value", no_data)]
+    with open(path, "w") as f:
+        for name, value in header:
+            f.write("{}\t{}\n".format(name, value))
+        np.savetxt(f, array, fmt="%.2f", delimiter="\t")
+
+
+def write_tif(path, array, gt, data_type=None, nodata=no_data):
+    """
+    Saves an array as a .tif raster.
+
+    :param path: file path (.tif)
+    :param array: np.array with the raster values
+    :param gt: geotransform of the raster
+    :param data_type: gdal data type of the raster (optional, default: gdal.GDT_Float32)
+    :param nodata: no data value of the raster (None for no no data value)
+    :return: ---
+    """
+    if data_type is None:
+        data_type = gdal.GDT_Float32
+    driver = gdal.GetDriverByName("GTiff")
+    raster = driver.Create(path, xsize=array.shape[1], ysize=array.shape[0], bands=1, eType=data_type,
+                           options=["TILED=YES"])
+    raster.SetGeoTransform(gt)
+    raster.SetProjection(spatial_reference().ExportToWkt())
+    band = raster.GetRasterBand(1)
+    band.WriteArray(array)
+    if nodata is not None:
+        band.SetNoDataValue(nodata)
+    band.FlushCache()
+    band = None
+    raster = None
+
+
+def write_boundary(path, extent):
+    """
+    Saves a rectangular boundary shapefile.
+
+    :param path: file path (.shp)
+    :param extent: list with [ulx, uly, lrx, lry] of the boundary
+    :return: ---
+    """
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+    if os.path.exists(path):
+        driver.DeleteDataSource(path)
+    data_source = driver.CreateDataSource(path)
+    layer = data_source.CreateLayer("boundary", spatial_reference(), ogr.wkbPolygon)
+    layer.CreateField(ogr.FieldDefn("id", ogr.OFTInteger))
+
+    ulx, uly, lrx, lry = extent
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for x, y in [(ulx, uly), (lrx, uly), (lrx, lry), (ulx, lry), (ulx, uly)]:
+        ring.AddPoint(x, y)
+    polygon = ogr.Geometry(ogr.wkbPolygon)
+    polygon.AddGeometry(ring)
+
+    feature = ogr.Feature(layer.GetLayerDefn())
+    feature.SetField("id", 1)
+    feature.SetGeometry(polygon)
+    layer.CreateFeature(feature)
+    feature = None
+    data_source = None
+
+
+def elevation(rows, columns):
+    """
+    Generates a synthetic DEM: a mountain in the centre of the area (between 400 and 2500 m).
+
+    :param rows: int, number of rows
+    :param columns: int, number of columns
+    :return: np.array (float32) with the elevation of each cell
+    """
+    y, x = np.ogrid[-1:1:rows * 1j, -1:1:columns * 1j]
+    return (400. + 2100. * np.exp(-(x ** 2 + y ** 2) / 0.3)).astype(np.float32)
+
+
+def generate_dataset(root, rows=40, columns=60, cell_size=1000., snap_cell_size=100., start=(2017, 12), months=3,
+                     seed=0):
+    """
+    Generates all synthetic input data in the root folder.
+
+    :param root: folder in which to save the data
+    :param rows: int, number of rows of the coarse (ASCII) grid
+    :param columns: int, number of columns of the coarse (ASCII) grid
+    :param cell_size: float, cell size of the coarse grid (m)
+    :param snap_cell_size: float, cell size of the snap raster and results (m)
+    :param start: (year, month) of the first month
+    :param months: int, number of months
+    :param seed: int, seed for the random number generator
+    :return: dictionary with the paths of the input data (config_input variable name as key) and the start and end
+    dates (YYYYMM)
+    """
+    rng = np.random.default_rng(seed)
+    paths = {"precipitation_path": os.path.join(root, "Precipitation"),
+             "temperature_path": os.path.join(root, "Temperature"),
+             "snapraster_path": os.path.join(root, "DEM", "snap_dem.tif"),
+             "fEL_path": os.path.join(root, "DEM", "f_L_E.tif"),
+             "shape_path": os.path.join(root, "Shapes", "boundary.shp"),
+             "si_folder_path": os.path.join(root, "SatelliteImages")}
+    for folder in [paths["precipitation_path"], paths["temperature_path"], os.path.dirname(paths["snapraster_path"]),
+                   os.path.dirname(paths["shape_path"]), paths["si_folder_path"]]:
+        os.makedirs(folder, exist_ok=True)
+
+    # Coarse grid: no data cells in the corners
+    y, x = np.ogrid[-1:1:rows * 1j, -1:1:columns * 1j]
+    coarse_no_data = (x ** 2 + y ** 2) > 1.6
+    coarse_elevation = elevation(rows, columns)
+
+    # Snap grid (same extent as the coarse grid)
+    snap_rows = int(rows * cell_size / snap_cell_size)
+    snap_columns = int(columns * cell_size / snap_cell_size)
+    y_ul = y_ll + rows * cell_size
+    snap_gt = (x_ll, snap_cell_size, 0.0, y_ul, 0.0, -snap_cell_size)
+    dem = elevation(snap_rows, snap_columns)
+    write_tif(paths["snapraster_path"], dem, snap_gt)
+    write_tif(paths["fEL_path"], rng.uniform(0.1, 0.6, size=dem.shape).astype(np.float32), snap_gt)
+    write_boundary(paths["shape_path"], [x_ll, y_ul, x_ll + columns * cell_size, y_ll])
+
+    month_dates = [datetime.datetime(start[0] + (start[1] - 1 + i) // 12, (start[1] - 1 + i) % 12 + 1, 1)
+                   for i in range(months)]
+    for month in month_dates:
+        n_days = calendar.monthrange(month.year, month.month)[1]
+        # Winter temperatures: colder at higher elevations, so there is snow and rain in every month
+        base_temperature = rng.uniform(-2., 4.)
+        for day in range(1, n_days + 1):
+            date = month.replace(day=day)
+            precipitation = rng.gamma(0.6, 6., size=(rows, columns))
+            temperature = base_temperature - 0.0065 * (coarse_elevation - 400.) + rng.normal(0., 2., (rows, columns))
+            precipitation[coarse_no_data] = no_data
+            temperature[coarse_no_data] = no_data
+            write_ascii(os.path.join(paths["precipitation_path"], date.strftime("%Y%m%d") + ".txt"), precipitation,
+                        cell_size)
+            write_ascii(os.path.join(paths["temperature_path"], date.strftime("%Y%m%d") + ".txt"), temperature,
+                        cell_size)
+
+        # Satellite images: 2 sensing dates around the end of the month, snow above a (random) snow line
+        month_end = month.replace(day=n_days)
+        for days in (-3, 2):
+            sensing_date = month_end + datetime.timedelta(days=days)
+            folder = os.path.join(paths["si_folder_path"], sensing_date.strftime("%Y%m%d"))
+            os.makedirs(folder, exist_ok=True)
+            snow = dem > rng.uniform(900., 1500.)
+            for band, snow_value, ground_value in zip(["B02", "B03", "B11"], snow_reflectance, ground_reflectance):
+                values = np.where(snow, snow_value, ground_value) + rng.normal(0., 150., dem.shape)
+                write_tif(os.path.join(folder, "{}_{}_r.tif".format(band, sensing_date.strftime("%Y%m%d"))),
+                          values.astype(np.float32), snap_gt)
+
+            # Scene classification layer (60 m or the snap cell size, if larger): clouds in a random part of the area
+            scl_size = max(60., snap_cell_size)
+            scl_rows = int(rows * cell_size / scl_size)
+            scl_columns = int(columns * cell_size / scl_size)
+            scl = np.full((scl_rows, scl_columns), 4, dtype=np.uint8)  # vegetation
+            scl[elevation(scl_rows, scl_columns) > 1200.] = 11  # snow
+            scl[rng.random((scl_rows, scl_columns)) < rng.uniform(0., 0.5)] = 9  # clouds (high probability)
+            write_tif(os.path.join(folder, "T34TDL_{}_SCL_60m.tif".format(sensing_date.strftime("%Y%m%d"))), scl,
+                      (x_ll, scl_size, 0.0, y_ul, 0.0, -scl_size), data_type=gdal.GDT_Byte, nodata=0)
+
+    paths["start_date"] = month_dates[0].strftime("%Y%m")
+    paths["end_date"] = month_dates[-1].strftime("%Y%m")
+    return paths
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python benchmarks/synthetic_data.py <output folder> [rows] [columns] [months]")
+    args = [int(arg) for arg in sys.argv[2:5]]
+    kwargs = dict(zip(["rows", "columns", "months"], args))
+    print(json.dumps(generate_dataset(sys.argv[1], **kwargs), indent=2))
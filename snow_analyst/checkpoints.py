@@ -0,0 +1,252 @@
+"""
+Checkpoints of long runs: when a module (stage) finishes a month, a completion marker with the checksum (SHA-256) of
+each output file of the month is saved in the 'checkpoints' folder in the results folder. The snow melt stage also saves
+the snow at the end of each month (the snow carried over to the start of the next month) as a .npy file, which is the
+state of the snow melt recursion.
+
+With '--resume' (python main_snow_codes.py --resume, or 'resume_run' = True in config_input), each stage skips the
+months whose marker exists and whose output files still have the saved checksums, and the snow melt continues from the
+saved snow state of the last completed month instead of starting again from the first month.
+
+Checkpoint files (in <results_path>/checkpoints):
+    <stage>_<YYYYMM>.json           completion marker: output file paths, sizes and checksums
+    snow_state_<YYYYMM>.npy         snow at the end of the month (snow melt stage)
+
+NOTES:
+- Markers are only written if 'checkpoint_run' (or 'resume_run') in config_input is True.
+- The output files of each stage are defined by the pipeline stages (see 'stage_outputs' in pipeline.py).
+- Each marker is only verified (its output files hashed) once per run.
+- A resumed run does not check if the inputs or parameters changed since the months were calculated (use
+'incremental_run' for that, see pipeline.py).
+"""
+
+import config_input
+from package_handling import *
+
+# Size of the chunks in which the output files are read to calculate their checksum (bytes)
+chunk_size = 2 ** 20
+
+# Markers verified (or saved) in this run: {(stage, YYYYMM): True}, so the output files of a month are only hashed once
+verified = {}
+
+
+def checkpoint_folder():
+    """
+    Gets the folder with the checkpoint files (and creates it, if it does not exist).
+
+    :return: path of the 'checkpoints' folder in the results folder
+    """
+    folder = os.path.join(config_input.results_path, "checkpoints")
+    if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def stage_outputs(stage, date):
+    """
+    Gets the output files of a stage for a month, as defined by the pipeline stages (see 'stage_outputs' in
+    pipeline.py).
+
+    :param stage: string, name of the stage ('pt_manipulation', 'rain_snow_rasters', 'snow_cover', 'wasim_snow',
+    'snow_melt', 'r_factor' or 'total_factor')
+    :param date: date (in datetime format) of the month
+    :return: list with the output file (or folder) paths
+    """
+    import pipeline  # imported here, since pipeline imports the modules which import this module
+
+    return pipeline.stage_outputs(stage, date)
+
+
+def checkpoints_enabled():
+    """
+    Checks if checkpoints are saved: if 'checkpoint_run' or 'resume_run' in config_input is True.
+
+    :return: boolean
+    """
+    return config_input.checkpoint_run or config_input.resume_run
+
+
+def file_checksum(path):
+    """
+    Calculates the SHA-256 checksum of a file, reading it in chunks. For a folder, the checksum includes the name and
+    content of all files in it (e.g. the .csv files of a month in the PT folder).
+
+    :param path: file or folder path
+    :return: string with the hexadecimal checksum
+    """
+    checksum = hashlib.sha256()
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, f) for root, dirs, names in os.walk(path) for f in names)
+    else:
+        files = [path]
+    for file in files:
+        if file != path:
+            checksum.update(os.path.relpath(file, path).encode("utf-8"))
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def path_size(path):
+    """
+    Gets the size of a file or of all files in a folder.
+
+    :param path: file or folder path
+    :return: int, size in bytes
+    """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f)) for root, dirs, names in os.walk(path) for f in names)
+    return os.path.getsize(path)
+
+
+def marker_path(stage, date):
+    """
+    Gets the path of the completion marker of a stage and month.
+
+    :param stage: string, name of the stage
+    :param date: date (in datetime format) of the month
+    :return: path of the marker .json file
+    """
+    return os.path.join(checkpoint_folder(), "{}_{}.json".format(stage, date.strftime('%Y%m')))
+
+
+def mark_complete(stage, date):
+    """
+    Saves the completion marker of a stage and month, with the size and checksum of each output file. The marker is
+    first saved to a temporary file, which then replaces the marker file, so an interrupted run never leaves an
+    incomplete marker. Nothing is saved if 'checkpoint_run' and 'resume_run' in config_input are False.
+
+    :param stage: string, name of the stage
+    :param date: date (in datetime format) of the month
+    :return: ---
+    """
+    if not checkpoints_enabled():
+        return
+    outputs = {}
+    for path in stage_outputs(stage, date):
+        if not os.path.exists(path):
+            return  # the month was not calculated (e.g. no input data for the month)
+        outputs[path] = {"size": path_size(path), "sha256": file_checksum(path)}
+    marker = {"stage": stage, "month": date.strftime('%Y%m'), "outputs": outputs,
+              "finished": datetime.datetime.now().isoformat(timespec="seconds")}
+
+    path = marker_path(stage, date)
+    with open(path + ".tmp", "w") as f:
+        json.dump(marker, f, indent=2)
+    os.replace(path + ".tmp", path)
+    verified[(stage, date.strftime('%Y%m'))] = True
+
+
+def is_complete(stage, date):
+    """
+    Checks if a stage was completed for a month: the marker exists and all output files exist and have the saved size
+    and checksum.
+
+    :param stage: string, name of the stage
+    :param date: date (in datetime format) of the month
+    :return: boolean, True if the month does not need to be calculated again
+
+    Note: a month verified (or saved) in this run is not checked again (see 'verified').
+    """
+    if verified.get((stage, date.strftime('%Y%m'))):
+        return True
+    path = marker_path(stage, date)
+    if not os.path.exists(path):
+        return False
+    try:
+        with open(path, "r") as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return False
+    outputs = marker.get("outputs", {})
+    if sorted(outputs) != sorted(stage_outputs(stage, date)):
+        return False
+    for output, saved in outputs.items():
+        if not os.path.exists(output) or path_size(output) != saved["size"]:
+            return False
+        if file_checksum(output) != saved["sha256"]:
+            return False
+    verified[(stage, date.strftime('%Y%m'))] = True
+    return True
+
+
+def pending_months(stage, date_list, chained=False):
+    """
+    Gets the months which a stage must calculate: all months or, if 'resume_run' in config_input is True, only the
+    months which were not completed in a previous run.
+
+    :param stage: string, name of the stage
+    :param date_list: list with analysis dates (in datetime format)
+    :param chained: boolean, True if each month depends on the results of the previous month (snow melt): all months
+    after the first month which was not completed are calculated again
+    :return: list with the dates (in datetime format) of the months to calculate
+    """
+    if not config_input.resume_run:
+        return list(date_list)
+    if chained:
+        pending = []
+        for i, d in enumerate(date_list):
+            if not is_complete(stage, d):
+                pending = list(date_list[i:])
+                break
+    else:
+        pending = [d for d in date_list if not is_complete(stage, d)]
+    if len(pending) < len(date_list):
+        print("Resuming '{}': {} of {} months were already completed.".format(stage, len(date_list) - len(pending),
+                                                                            len(date_list)))
+    return pending
+
+
+def snow_state_path(date):
+    """
+    Gets the path of the saved snow state (snow at the end of the month) of a month.
+
+    :param date: date (in datetime format) of the month
+    :return: path of the .npy file
+    """
+    return os.path.join(checkpoint_folder(), "snow_state_{}.npy".format(date.strftime('%Y%m')))
+
+
+def save_snow_state(date, snow_end):
+    """
+    Saves the snow at the end of a month, which is carried over to the start of the next month in the snow melt
+    recursion. Nothing is saved if 'checkpoint_run' and 'resume_run' in config_input are False.
+
+    :param date: date (in datetime format) of the month
+    :param snow_end: np.array with the snow at the end of the month
+    :return: ---
+    """
+    if not checkpoints_enabled():
+        return
+    path = snow_state_path(date)
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, snow_end)
+    os.replace(path + ".tmp", path)
+
+
+def discard_snow_state(date):
+    """
+    Deletes the saved snow state of a month, e.g. when the snow melt of the month is calculated again without saving
+    the snow state (tiled snow melt calculation), so an older state is never used.
+
+    :param date: date (in datetime format) of the month
+    :return: ---
+    """
+    path = snow_state_path(date)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def load_snow_state(date):
+    """
+    Loads the snow at the end of a month saved by 'save_snow_state', if the snow melt stage was completed for the month
+    (so the saved state corresponds to the snow melt results of the month).
+
+    :param date: date (in datetime format) of the month
+    :return: np.array with the snow at the end of the month, or None if there is no valid saved state
+    """
+    path = snow_state_path(date)
+    if not os.path.exists(path) or not is_complete("snow_melt", date):
+        return None
+    return np.load(path)
@@ -0,0 +1,320 @@
+"""
+Long-term climatology and anomalies of the total R factor: the per-cell mean and variance of the total R factor of
+each calendar month (e.g. all Januaries) and of the annual total R factor (sum of the 12 months of a year) are updated
+with Welford's algorithm each time a month is calculated (total_R_factor.calculate_tot_R), so the monthly rasters are
+never loaded all at once.
+
+The running statistics are saved in the 'climatology/state' folder in the results folder, so they are continued in the
+next run:
+    month_MM.npz:   number of values, mean and sum of squared differences from the mean (M2) of calendar month MM
+    year_YYYY.npz:  sum of the months of year YYYY added so far
+    annual.npz:     number of values, mean and M2 of the annual total R factor (complete years only)
+    state.json:     months (and the signature and checksum of their raster) and complete years added to the statistics
+A month is only added once. If the raster of a month that was already added changes (e.g. it is calculated again with
+another snow factor), the statistics are calculated again at the end of the run from the rasters of all added months,
+one after the other. A raster which is written again with the same content (e.g. a resumed or repeated run) only
+changes its signature (size and modification time), not its checksum, so it does not trigger a recalculation.
+
+At the end of the run (see 'save_climatology'), the climatology and anomaly rasters are saved in the 'climatology'
+folder in the results folder:
+    RFactor_total_mean_MM.tif, RFactor_total_std_MM.tif:            climatology of each calendar month
+    RFactor_total_annual_mean.tif, RFactor_total_annual_std.tif:    climatology of the annual total R factor
+    RFactor_total_anomaly_YYYYMM.tif:                               month minus the mean of its calendar month
+    RFactor_total_annual_anomaly_YYYY.tif:                          (complete) year minus the annual mean
+"""
+
+import checkpoints
+import config_input
+import file_management
+import raster_calculations
+from package_handling import *
+
+
+def climatology_folder(state=False):
+    """
+    Gets the climatology folder, or its state folder (and creates it, if it does not exist).
+
+    :param state: boolean, True to get the state folder
+    :return: folder path
+    """
+    folder = os.path.join(config_input.results_path, "climatology")
+    if state:
+        folder = os.path.join(folder, "state")
+    file_management.create_folder(folder)
+    return folder
+
+
+def state_path(name):
+    """
+    Gets the path of a state file.
+
+    :param name: string with the file name (e.g. 'month_01.npz')
+    :return: path of the file in the state folder
+    """
+    return os.path.join(climatology_folder(state=True), name)
+
+
+def raster_signature(path):
+    """
+    Gets a signature of a raster file (size and modification time), to check if it changed after it was added.
+
+    :param path: raster file path
+    :return: string with the signature
+    """
+    stat = os.stat(path)
+    return "{}|{}".format(stat.st_size, stat.st_mtime_ns)
+
+
+def load_state():
+    """
+    Loads the state of the running statistics.
+
+    :return: dictionary with 'months' ({YYYYMM: raster signature}), 'checksums' ({YYYYMM: raster checksum}), 'years'
+    ({YYYY: list with the months added to the year sum}), 'annual' (list with the complete years added to the annual
+    statistics), 'gt' and 'proj' (raster data)
+    """
+    path = state_path("state.json")
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            state = json.load(f)
+        state.setdefault("checksums", {})
+        return state
+    return {"months": {}, "checksums": {}, "years": {}, "annual": [], "gt": None, "proj": None}
+
+
+def save_state(state):
+    """
+    Saves the state of the running statistics (to a temporary file which then replaces the state file).
+
+    :param state: dictionary with the state (see 'load_state')
+    :return: ---
+    """
+    path = state_path("state.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def load_arrays(name, shape, keys):
+    """
+    Loads the arrays of a state .npz file or, if it does not exist, creates them (filled with zeros).
+
+    :param name: string with the file name
+    :param shape: tuple with the raster shape (rows, columns)
+    :param keys: list with the array names
+    :return: dictionary with the arrays (float64, 'count' as int32)
+    """
+    path = state_path(name)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            return {key: data[key] for key in keys}
+    return {key: np.zeros(shape, dtype=np.int32 if key == "count" else np.float64) for key in keys}
+
+
+def save_arrays(name, arrays):
+    """
+    Saves the arrays of a state .npz file (to a temporary file which then replaces the state file).
+
+    :param name: string with the file name
+    :param arrays: dictionary with the arrays
+    :return: ---
+    """
+    path = state_path(name)
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(path + ".tmp", path)
+
+
+def welford_update(statistics, values):
+    """
+    Adds one value per cell to the running statistics (Welford's algorithm), in place. Cells in which the value is
+    np.nan are not updated.
+
+    :param statistics: dictionary with the 'count', 'mean' and 'm2' arrays
+    :param values: np.array with the values (same shape)
+    :return: ---
+    """
+    valid = np.isfinite(values)
+    count = statistics["count"]
+    running_mean = statistics["mean"]
+    count += valid
+    delta = np.where(valid, values - running_mean, 0.)
+    running_mean += np.divide(delta, count, out=np.zeros_like(delta), where=valid)
+    statistics["m2"] += delta * np.where(valid, values - running_mean, 0.)
+
+
+def std(statistics):
+    """
+    Gets the (sample) standard deviation from the running statistics.
+
+    :param statistics: dictionary with the 'count', 'mean' and 'm2' arrays
+    :return: np.float32 array with the standard deviation (np.nan in cells with less than 2 values)
+    """
+    with np.errstate(all='ignore'):
+        return np.where(statistics["count"] > 1, np.sqrt(statistics["m2"] / (statistics["count"] - 1)),
+                        np.nan).astype(np.float32)
+
+
+def mean(statistics):
+    """
+    Gets the mean from the running statistics.
+
+    :param statistics: dictionary with the 'count', 'mean' and 'm2' arrays
+    :return: np.float32 array with the mean (np.nan in cells without values)
+    """
+    return np.where(statistics["count"] > 0, statistics["mean"], np.nan).astype(np.float32)
+
+
+def add_values(state, date, total, path):
+    """
+    Adds the total R factor of a month to the statistics of its calendar month and to the sum of its year, and the sum
+    of the year to the annual statistics once the 12 months of the year were added.
+
+    :param state: dictionary with the state (see 'load_state'), updated in place
+    :param date: date (in datetime format) of the month
+    :param total: np.array with the total R factor of the month (np.nan in no data cells)
+    :param path: path of the total R factor raster of the month
+    :return: ---
+    """
+    month = date.strftime('%Y%m')
+    year = date.strftime('%Y')
+    if state["gt"] is None:
+        state["gt"], state["proj"] = raster_calculations.get_raster_data(path)
+
+    statistics = load_arrays("month_{:02d}.npz".format(date.month), total.shape, ["count", "mean", "m2"])
+    welford_update(statistics, total)
+    save_arrays("month_{:02d}.npz".format(date.month), statistics)
+
+    year_sum = load_arrays("year_{}.npz".format(year), total.shape, ["sum"])
+    year_sum["sum"] += total
+    save_arrays("year_{}.npz".format(year), year_sum)
+    year_months = state["years"].setdefault(year, [])
+    year_months.append(month)
+
+    if len(year_months) == 12 and year not in state["annual"]:
+        annual = load_arrays("annual.npz", total.shape, ["count", "mean", "m2"])
+        welford_update(annual, year_sum["sum"])
+        save_arrays("annual.npz", annual)
+        state["annual"].append(year)
+    state["months"][month] = raster_signature(path)
+    state["checksums"][month] = checkpoints.file_checksum(path)
+
+
+def rebuild(state):
+    """
+    Calculates the statistics again from the rasters of all months in the state (after a raster of an added month
+    changed), reading one raster after the other. The current rasters of the months are added, so the new state is not
+    stale.
+
+    :param state: dictionary with the state (see 'load_state')
+    :return: dictionary with the new state
+    """
+    print("The total R factor of a month in the climatology changed. Calculating the climatology again.")
+    months = sorted(state["months"])
+    for file in glob.glob(os.path.join(climatology_folder(state=True), "*.npz")):
+        os.remove(file)
+    new_state = {"months": {}, "checksums": {}, "years": {}, "annual": [], "gt": None, "proj": None}
+    for month in months:
+        date = datetime.datetime.strptime(month, '%Y%m')
+        path = total_factor_raster(date)
+        if os.path.exists(path):
+            add_values(new_state, date, raster_calculations.raster_to_nan_array(path), path)
+    save_state(new_state)
+    return new_state
+
+
+def total_factor_raster(date):
+    """
+    Gets the path of the total R factor raster of a month.
+
+    :param date: date (in datetime format) of the month
+    :return: raster path
+    """
+    return os.path.join(file_management.total_factor_path, f"RFactor_total_{date.strftime('%Y%m')}.tif")
+
+
+def add_month(date, total=None):
+    """
+    Adds the total R factor of a month to the running statistics, if it was not added yet. If the month was added, but
+    its raster changed since, the statistics are marked as stale, and are calculated again at the end of the run (see
+    'rebuild' and 'save_climatology'). The checksum of the raster is only calculated if its signature changed, and if
+    the content is the same, only the signature is updated.
+
+    :param date: date (in datetime format) of the month
+    :param total: np.array with the total R factor of the month (optional, read from its raster if None)
+    :return: ---
+    """
+    path = total_factor_raster(date)
+    month = date.strftime('%Y%m')
+    state = load_state()
+    if month in state["months"]:
+        signature = raster_signature(path)
+        if state["months"][month] != signature and not state.get("stale"):
+            if state["checksums"].get(month) == checkpoints.file_checksum(path):
+                state["months"][month] = signature
+            else:
+                state["stale"] = True
+            save_state(state)
+        return
+    if total is None:
+        total = raster_calculations.raster_to_nan_array(path)
+    add_values(state, date, total, path)
+    save_state(state)
+
+
+def save_climatology(date_list):
+    """
+    Adds the months in date_list which are not in the statistics yet (e.g. months calculated in a parallel run, see
+    'add_month') and saves the climatology rasters and the anomaly rasters of the months (and complete years) in
+    date_list. Only one raster (and the statistics of one calendar month) is in memory at a time.
+
+    :param date_list: list with analysis dates (in datetime format)
+    :return: ---
+    """
+    for d in date_list:
+        if os.path.exists(total_factor_raster(d)):
+            add_month(d)
+    state = load_state()
+    if state.get("stale"):
+        state = rebuild(state)
+    if not state["months"]:
+        print("No total R factor rasters in the climatology.")
+        return
+    folder = climatology_folder()
+    gt, proj = tuple(state["gt"]), state["proj"]
+
+    # Climatology of each calendar month and anomalies of its months in date_list
+    for m in sorted({int(month[4:]) for month in state["months"]}):
+        statistics = load_arrays("month_{:02d}.npz".format(m), None, ["count", "mean", "m2"])
+        month_mean = mean(statistics)
+        raster_calculations.save_raster(month_mean, os.path.join(folder, "RFactor_total_mean_{:02d}.tif".format(m)),
+                                        gt, proj, no_data=np.nan)
+        raster_calculations.save_raster(std(statistics),
+                                        os.path.join(folder, "RFactor_total_std_{:02d}.tif".format(m)), gt, proj,
+                                        no_data=np.nan)
+        statistics = None
+        for d in [d for d in date_list if d.month == m and d.strftime('%Y%m') in state["months"]]:
+            total = raster_calculations.raster_to_nan_array(total_factor_raster(d))
+            np.subtract(total, month_mean, out=total)
+            raster_calculations.save_raster(
+                total, os.path.join(folder, f"RFactor_total_anomaly_{d.strftime('%Y%m')}.tif"), gt, proj,
+                no_data=np.nan)
+
+    # Annual climatology and anomalies of the complete years in date_list
+    if state["annual"]:
+        annual = load_arrays("annual.npz", None, ["count", "mean", "m2"])
+        annual_mean = mean(annual)
+        raster_calculations.save_raster(annual_mean, os.path.join(folder, "RFactor_total_annual_mean.tif"), gt, proj,
+                                        no_data=np.nan)
+        raster_calculations.save_raster(std(annual), os.path.join(folder, "RFactor_total_annual_std.tif"), gt, proj,
+                                        no_data=np.nan)
+        annual = None
+        for year in sorted({d.strftime('%Y') for d in date_list} & set(state["annual"])):
+            year_sum = load_arrays("year_{}.npz".format(year), None, ["sum"])["sum"]
+            raster_calculations.save_raster((year_sum - annual_mean).astype(np.float32),
+                                            os.path.join(folder, f"RFactor_total_annual_anomaly_{year}.tif"), gt,
+                                            proj, no_data=np.nan)
+
+
+if __name__ == '__main__':
+    save_climatology(file_management.get_date_list(config_input.start_date, config_input.end_date))
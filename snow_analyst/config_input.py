@@ -95,6 +95,24 @@ rain_raster_input = r''
 - si_image_dates: LIST with sensing dates to use (in YYYYMMDD format) when input_si_dates is 'True'. The program
     determines to which month the input date corresponds. The user can set a sensing date for each month or just
     for some. For the months not set in the list, the program uses the date closest to the end of the month.
+- si_max_days: int, maximum number of days between the end of each month and the sensing date closest to it. If there
+    is no sensing date within this range for any month, the program stops.
+- si_cloud_selection: Boolean. If 'True', the cloud fraction of each sensing date within the 'shape_path' area is read
+    from the low resolution cloud mask of the satellite images (scene classification layer SCL, or the cloud
+    probability mask for images without SCL) and saved in 'si_cloud_index.json' in the results folder (see
+    si_cloud_index.py). The sensing date for each month (not set in si_image_dates) is then the one with the lowest
+    score = days from the end of the month + si_cloud_weight * cloud fraction, within 'si_max_days'.
+- si_cloud_weight: float, days from the end of the month equivalent to a fully cloudy sensing date.
+- si_max_cloud_fraction: float (0-1), sensing dates with a higher cloud fraction are not used.
+- snow_cover_composite: Boolean. If 'True', the snow cover of each month is a composite of all sensing dates within
+    'composite_window_days' of the end of the month, instead of only one sensing date: cloudy cells (from the cloud mask
+    of each scene) are ignored and each cell gets the weighted majority snow flag of the clear scenes, where closer
+    scenes to the end of the month have a higher weight (see 'calculate_snow_cover_composite' in snow_cover.py).
+    'input_si_dates' and 'si_image_dates' are not used.
+- composite_window_days: int, maximum number of days (before or after) between the end of the month and the sensing
+    dates used in the composite.
+- composite_decay_days: float, the weight of each scene is exp(-days from the end of the month / composite_decay_days)
+- composite_block_size: int, number of rows and columns of the blocks in which the scenes are read.
 - image_list: LIST with Name of bands to merge, clip and resample. The name in the list must correspond to the final
     suffix of the satellite image name. They must be in the following order: band02, band03, band04, band11, TCI.
 - image_location_folder_name: String with name of the folder in which the raw satellite images are directly located.
@@ -108,6 +126,15 @@ si_folder_path = r''
 
 input_si_dates = False
 si_image_dates = [20161223]
+si_max_days = 15
+si_cloud_selection = False
+si_cloud_weight = 30
+si_max_cloud_fraction = 1.0
+
+snow_cover_composite = False
+composite_window_days = 15
+composite_decay_days = 10
+composite_block_size = 1024
 
 image_list = ['B02', 'B03', 'B11', 'TCI']
 image_location_folder_name = "IMG_DATA"
@@ -118,8 +145,16 @@ blue_min = 1800
 
 """ If "run_wasim_snow" = True:
 - snow_wasim_path: string, folder path where snow storage rasters are stored (YYYYMMDD or YYYYMMDD_0HH format).
+- wasim_in_memory: Boolean. If 'True', each snow storage raster is resampled in memory (with the same interpolation
+    parameters as resampling.py, but evaluated directly at the snap raster cell centers and without intermediate files)
+    and the binary snow cover raster is generated from the same array. The results are close to, but not the same as,
+    the results of resampling.py. If 'False' (default), each raster is resampled with gdal_grid and gdalwarp
+    (resampling.py).
+- wasim_workers: int, number of processes with which to process the months (if wasim_in_memory is True).
 """
 snow_wasim_path = r'' + os.path.abspath('../input/snow_storage')
+wasim_in_memory = False
+wasim_workers = 1
 
 """
 If "run_snow_cover" = False (and run_snow_melt is True)
@@ -143,6 +178,31 @@ statistical_param = 'coverage'
 # Output folder for plots (DO NOT MODIFY)
 plot_result = os.path.join(results_path, 'Plots')
 
+"""If "run_snow_melt" is True (optional):
+- snow_melt_model: string, 'monthly' to calculate the snow melt with the monthly snow balance from the snow rasters and
+    the binary snow cover rasters (snow_melt_main.py), or 'degree_day' to calculate it with a degree-day model from the
+    precipitation and temperature rasters in 'precipitation_path' and 'temperature_path' (snow_melt/degree_day.py). The
+    degree-day model does not need the snow cover rasters.
+- T_melt: float, temperature above which snow melts (degree-day model).
+- degree_day_factor: float, snow melt per degree above T_melt and day, in mm/C/day (degree-day model).
+- degree_day_numba: Boolean. If 'True' and numba is installed, the degree-day model is compiled with numba and run in
+    parallel for all cells.
+- snow_melt_memmap: Boolean. If 'True', the snow rasters, snow cover rasters and results of all months are kept in
+    memory-mapped files in the results folder instead of in memory during the monthly snow balance (for long date
+    ranges or large rasters, see snow_melt/snowpack.py).
+- snow_melt_tile_size: int or None. If an int is given, the monthly snow balance is calculated tile by tile, with tiles
+    of approximately snow_melt_tile_size x snow_melt_tile_size cells read for all months at once, so memory use depends
+    on the tile size and the number of months, not on the raster size. Results are the same for both options.
+- snow_melt_tile_workers: int, number of processes with which to calculate the tiles (if snow_melt_tile_size is set).
+"""
+snow_melt_model = 'monthly'
+T_melt = 0
+degree_day_factor = 3.0
+degree_day_numba = True
+snow_melt_memmap = False
+snow_melt_tile_size = None
+snow_melt_tile_workers = 1
+
 """If run_snow_melt = False (AND run_total_factor = True)
 - snow_melt_input: string, folder path where .tif snow melt rasters are located (each file name must contain the date)
 """
@@ -154,6 +214,14 @@ snow_melt_input = r''
 """
 fEL_path = r'' + os.path.abspath('../input/DEM/f_L_E.tif')
 
+"""If run_Rfactor = True (optional):
+- r_factor_block_size: int or None. If None, each precipitation raster and the f(E,L) raster are read completely into
+    memory. If an int is given, the R factor is calculated window by window, with windows of approximately
+    r_factor_block_size x r_factor_block_size cells, so memory use does not depend on the raster size (e.g. for large
+    basins with a 10 m resolution). Results are the same for both options.
+"""
+r_factor_block_size = None
+
 """ If run_Rfactor is False (AND run_total_factor is True)
 - r_factor_input: string, folder path with .tif R factor rasters (with the raster name including the date).
 """
@@ -164,6 +232,132 @@ r_factor_input = r''
 """
 snow_factor = 2
 
+"""Pipeline (optional):
+- incremental_run: Boolean. If 'True', main_snow_codes runs the modules through the pipeline runner (pipeline.py), in
+    which each module is a stage with input and output files per month. Each stage saves a fingerprint of its input
+    files and parameters for each month (in 'pipeline_state.json' in the results folder), and only the months whose
+    input files or parameters changed since the last run are calculated again (e.g. changing 'snow_factor' only
+    recalculates the total R factor). If 'False', all modules are run for all months.
+"""
+incremental_run = False
+
+"""Parallel run (optional):
+- parallel_workers: int, number of processes with which to run the modules. If more than 1, main_snow_codes runs the
+    modules as a graph of tasks (one per module and month) in a process pool (see 'run_parallel' in pipeline.py): each
+    task starts as soon as the tasks it depends on are finished (the snow melt of each month also waits for the snow
+    melt of the previous month). If 'incremental_run' is also 'True', only the tasks whose inputs or parameters changed
+    are run.
+"""
+parallel_workers = 1
+
+"""Precipitation index (optional):
+- precip_index: Boolean. If 'True', rain_snow_rasters.py gets the rain and snow of each month from a temperature-binned
+    precipitation index (see precip_index.py), which is built once per month from the .csv files of the month, so runs
+    with a different T_snow do not read the .csv files again. T_snow is rounded to the closest bin edge.
+- precip_index_range: list with the lowest and highest temperature bin edges of the index (C).
+- precip_index_step: float, width of the temperature bins of the index (C).
+"""
+precip_index = False
+precip_index_range = [-10, 10]
+precip_index_step = 0.1
+
+"""Parameter sweep (optional, python parameter_sweep.py):
+- sweep_T_snow, sweep_NDSI_min, sweep_blue_min, sweep_snow_factor: lists with the values of T_snow, NDSI_min, blue_min
+    and snow_factor to evaluate. All combinations are calculated in one run, reading the inputs of each month once (see
+    parameter_sweep.py). An empty list uses the value set above.
+- sweep_save_rasters: Boolean. If 'True', the total R factor rasters of each combination are saved. If 'False', only the
+    zonal summary (in 'shape_zone') of each month and combination is saved.
+"""
+sweep_T_snow = []
+sweep_NDSI_min = []
+sweep_blue_min = []
+sweep_snow_factor = []
+sweep_save_rasters = False
+
+"""Monte Carlo uncertainty (optional):
+- run_monte_carlo: Boolean. If 'True', main_snow_codes propagates the uncertainty of the REM(DB) coefficients, the snow
+    factor and the precipitation to the total R factor of each month (see monte_carlo.py), after the other modules.
+- mc_samples: int, number of samples.
+- mc_seed: int, seed of the random number generator (None for a different result in each run).
+- mc_a_sd, mc_b_sd: standard deviations of the REM(DB) coefficient (0.207) and exponent (1.561).
+- mc_snow_factor_sd: standard deviation of the snow factor ('snow_factor' is the mean).
+- mc_precip_sd: standard deviation of the logarithm of the (log-normal) precipitation error of each month.
+- mc_quantiles: list with the quantiles of the total R factor to save (besides the mean and standard deviation).
+- mc_chunk_size: int, number of samples calculated at once for each tile.
+- mc_block_size: int, approximate number of rows and columns of each tile.
+- mc_histogram_bins: int, number of histogram bins per cell with which the quantiles are estimated.
+"""
+run_monte_carlo = False
+mc_samples = 1000
+mc_seed = 42
+mc_a_sd = 0.02
+mc_b_sd = 0.05
+mc_snow_factor_sd = 0.2
+mc_precip_sd = 0.1
+mc_quantiles = [0.05, 0.5, 0.95]
+mc_chunk_size = 100
+mc_block_size = 256
+mc_histogram_bins = 64
+
+"""Time series output (optional):
+- time_series_output: Boolean. If 'True', main_snow_codes also saves the monthly results of each product as one tiled,
+    multi-band GeoTIFF per year, with one band per month (see time_series_output.py), in the 'time_series' folder in the
+    results folder. The monthly rasters are kept.
+- time_series_products: list with the products to save: 'Snow', 'Rain', 'SnowCover', 'snowmelt', 'RFactor_REM_db' and
+    'RFactor_total'. Products without monthly rasters are skipped.
+- time_series_block_size: int, number of rows and columns of each tile (multiple of 16).
+- time_series_compress: string with the GeoTIFF compression (e.g. 'DEFLATE', 'LZW'), or None for no compression.
+"""
+time_series_output = False
+time_series_products = ['Snow', 'Rain', 'SnowCover', 'snowmelt', 'RFactor_REM_db', 'RFactor_total']
+time_series_block_size = 256
+time_series_compress = 'DEFLATE'
+
+"""Climatology (optional):
+- run_climatology: Boolean. If 'True', the total R factor of each month is added to running (Welford) statistics of
+    its calendar month and year as soon as it is calculated, and the climatology (mean and standard deviation of each
+    calendar month and of the annual total R factor) and anomaly rasters are saved at the end of the run (see
+    climatology.py), in the 'climatology' folder in the results folder. The statistics are kept between runs.
+"""
+run_climatology = False
+
+"""File catalog (optional):
+- persist_file_catalog: Boolean. The input and output folders are only scanned once per run, and the date in each file
+    name is only parsed once (see 'FileCatalog' in file_management.py). If 'True', the file catalog is also saved in
+    'file_catalog.json' in the results folder, so the next run does not scan the folders that were not modified.
+"""
+persist_file_catalog = False
+
+"""Run report (optional):
+- run_report: Boolean. If 'True', the wall time, CPU time, peak memory use, bytes read/written and number of rasters
+    written are recorded for each module (stage) and month, and saved in 'run_report.json' in the results folder at the
+    end of the run (see instrumentation.py).
+- profile_stages: Boolean. If 'True' (and run_report is 'True'), each stage is also run with cProfile, and the profiles
+    are saved in the 'profiles' folder in the results folder (one .prof file per stage and month).
+"""
+run_report = False
+profile_stages = False
+
+"""Snow melt profiling (optional):
+- profile_snow_melt: Boolean. If 'True', the number of calls and the cumulative and self time of the snow melt functions
+    (decorated with 'wrapper' in snow_melt/log.py) are accumulated in memory, and printed as a table at the end of the
+    run (the calls in the worker processes of a parallel pipeline run are added to the table). Profiling can also be
+    switched on or off at runtime with 'log.set_profiling'.
+"""
+profile_snow_melt = False
+
+"""Checkpoints (optional):
+- checkpoint_run: Boolean. If 'True', each module saves a completion marker (with the checksum of its output files) for
+    each month it finishes, and the snow melt saves the snow at the end of each month, in the 'checkpoints' folder in
+    the results folder (see checkpoints.py). Checkpoints are also saved if 'resume_run' is 'True', so a run which is
+    resumed can be resumed again.
+- resume_run: Boolean. If 'True' (or if main_snow_codes is run with '--resume'), each module skips the months completed
+    in a previous run (with checkpoints), and the snow melt continues from the saved snow state of the last completed
+    month. Only used when the modules are run one after the other (incremental_run = False and parallel_workers = 1).
+"""
+checkpoint_run = False
+resume_run = False
+
 # Import snow_melt codes:
 sys.path.append('./snow_melt')  # Add folder for snow melt
 
@@ -172,6 +366,7 @@ sys.path.append('./Rfactor_REM_db')  # Add folder for snow melt
 
 
 def initialize_ascii():
+    global ascii_data
     if run_pt_manipulation:
         ascii_data = []
     else:
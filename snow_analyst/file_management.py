@@ -1,4 +1,7 @@
 import config_input
+import raster_metadata
+import si_cloud_index
+import si_date_selection
 from package_handling import *
 
 """ Functions related to input file/folders, file names, dates and reading/saving
@@ -43,21 +46,18 @@ def has_number(string):
     return any(i.isdigit() for i in string)
 
 
-def get_PT_datefiles(paths, date):
+def get_PT_datefiles(folder, date, ext=".txt"):
     """
-    Function receives a list with file paths and saves, to another list, those files whose dates are within the input
-    dates month. It also checks if the list is empty, in which case it returns an error.
+    Function gets, from the file catalog of the input folder, the files whose dates are within the input dates month.
+    It also checks if the list is empty, in which case it returns an error.
 
-    :param paths: list with file paths
+    :param folder: folder path with files whose names contain the date
     :param date: start date (in datetime format)
-    :return: list with file paths which correspond to dates within the input date's month
+    :param ext: string, extension of the files to look for (default: '.txt')
+    :return: list with file paths which correspond to dates within the input date's month, sorted by date
     """
 
-    filenames = []
-    for text in paths:
-        f_date = get_date(text)
-        if f_date.year == date.year and f_date.month == date.month:
-            filenames.append(text)
+    filenames = get_catalog(folder, ext).month_files(date)
     if len(filenames) == 0:
         message = "The input precipitation and/or temperature files do not contain files for ", str(
             date.strftime('%Y%m'))
@@ -74,10 +74,11 @@ def get_PT_datefiles(paths, date):
     return filenames
 
 
+@functools.lru_cache(maxsize=None)
 def get_date(file_path, end=False):
     """
     Function extracts the date from the input file/folder name. The date should be in YYYYMM, YYYYMMDD, or YYYYMMDD0HH
-    format
+    format. The dates are cached, so the date of each file name is only parsed once.
 
     :param file_path: file or folder path
     :param end: boolean that is True if the date is needed at the end of the month. It is "False" by default
@@ -148,28 +149,213 @@ def get_date_list(date1, date2):
     return date_list
 
 
-def filter_raster_lists(raster_list, date1, date2, file_name):
+class FileCatalog:
     """
-    Filters input list to only include dates in between 2 dates (date1-date2) (analysis range). If there are
-    no files for the given date range (new_list is empty) or any month is missing, function throws an error.
+    Class with an index of the files in a folder whose names contain a date (e.g. 'Snow_YYYYMM.tif'). The folder is
+    scanned, and the date of each file parsed, only once: the folder is only scanned again if it was modified (a file
+    was added, removed or renamed) since the last scan.
+
+    Attributes:
+        folder: STR with the folder path
+        ext: STR with the extension of the files to index (e.g. '.tif'). If empty, all files and sub-folders are indexed
+        mtime: INT with the modification time (in ns) of the folder when it was scanned
+        dates: LIST with the date (in datetime format) of each file, sorted
+        paths: LIST with the file paths, in the same order as 'dates'
+        months: DICT with the month ('YYYYMM') as key and the list with the file paths of said month as value
+
+    Methods:
+        scan(): Method lists the folder and parses the date of each file name.
+        set_entries(entries): Method sorts the (date, path) entries by date and builds the month index.
+        refresh(): Method scans the folder again if it was modified since the last scan.
+        month_files(date): Method returns the files of the input date's month.
+        range_files(date1, date2): Method returns the files whose dates are in between 2 dates.
+        to_dict(): Method returns the index as a dictionary, to save it in a .json file.
+        from_dict(folder, ext, data): Static method which creates a catalog from a dictionary saved with to_dict().
+    """
+
+    def __init__(self, folder, ext=".tif"):
+        """
+        Assign values to class attributes when a new instance is initiated.
+        :param folder: STR with the folder path
+        :param ext: STR with the extension of the files to index (default: '.tif')
+        """
+        self.folder = folder
+        self.ext = ext
+        self.mtime = None
+        self.dates = []
+        self.paths = []
+        self.months = {}
+
+    def scan(self):
+        """
+        Method lists the folder and parses the date of each file name. Files whose names do not contain a date (less
+        than 4 digits) are ignored.
+        :return: None
+        """
+        self.mtime = os.stat(self.folder).st_mtime_ns
+        entries = []
+        for name in os.listdir(self.folder):
+            if self.ext and not name.lower().endswith(self.ext.lower()):
+                continue
+            if not has_number(name) or sum(c.isdigit() for c in name) < 4:
+                continue
+            path = os.path.join(self.folder, name)
+            entries.append((get_date(path), path))
+        self.set_entries(entries)
+
+    def set_entries(self, entries):
+        """
+        Method sorts the (date, path) entries by date and builds the month index.
+        :param entries: LIST with a (date, path) tuple for each indexed file
+        :return: None
+        """
+        entries.sort()
+        self.dates = [date for date, path in entries]
+        self.paths = [path for date, path in entries]
+        self.months = {}
+        for date, path in entries:
+            self.months.setdefault(date.strftime('%Y%m'), []).append(path)
+
+    def refresh(self):
+        """
+        Method scans the folder again if it was modified since the last scan (or if it was never scanned).
+        :return: True if the folder was scanned, False if the index was up to date
+        """
+        if self.mtime is not None and os.stat(self.folder).st_mtime_ns == self.mtime:
+            return False
+        self.scan()
+        return True
+
+    def month_files(self, date):
+        """
+        Method returns the files of the input date's month.
+        :param date: date (in datetime format) corresponding to the month to get
+        :return: LIST with the file paths of the month, sorted by date
+        """
+        return list(self.months.get(date.strftime('%Y%m'), []))
+
+    def range_files(self, date1, date2):
+        """
+        Method returns the files whose dates are in between 2 dates (both included).
+        :param date1: start date (in datetime format)
+        :param date2: end date (in datetime format)
+        :return: LIST with the file paths, sorted by date
+        """
+        start = bisect.bisect_left(self.dates, date1)
+        end = bisect.bisect_right(self.dates, date2)
+        return self.paths[start:end]
+
+    def to_dict(self):
+        """
+        Method returns the index as a dictionary, to save it in a .json file.
+        :return: DICT with the folder modification time and the file names with their dates (in ISO format)
+        """
+        return {"mtime": self.mtime,
+                "files": [[os.path.basename(path), date.isoformat()] for date, path in zip(self.dates, self.paths)]}
+
+    @staticmethod
+    def from_dict(folder, ext, data):
+        """
+        Static method which creates a catalog from a dictionary saved with to_dict().
+        :param folder: STR with the folder path
+        :param ext: STR with the extension of the indexed files
+        :param data: DICT saved with to_dict()
+        :return: FileCatalog
+        """
+        catalog = FileCatalog(folder, ext)
+        catalog.mtime = data["mtime"]
+        catalog.set_entries([(datetime.datetime.fromisoformat(date), os.path.join(folder, name))
+                             for name, date in data["files"]])
+        return catalog
+
+
+# Catalogs of the folders used in the current run: {(folder path, extension): FileCatalog}
+catalogs = {}
+
+
+def catalog_path():
+    """
+    Gets the path of the .json file in which the file catalogs are saved (if 'persist_file_catalog' is True).
+
+    :return: path of the file catalog .json file, in the results folder
+    """
+    return os.path.join(config_input.results_path, "file_catalog.json")
+
+
+def load_catalogs(path):
+    """
+    Loads the file catalogs saved in a .json file. Catalogs of folders that were modified since they were saved are
+    scanned again the first time they are used.
 
-    :param raster_list: list with file paths, whose names contain the date in either YYYYMM or YYMM format
+    :param path: path of the .json file
+    :return: ---
+    """
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        print("Could not read the file catalog in {}. The input folders will be scanned again.".format(path))
+        return
+    for key, catalog_data in data.items():
+        folder, ext = key.rsplit("|", 1)
+        catalogs[(folder, ext)] = FileCatalog.from_dict(folder, ext, catalog_data)
+
+
+def save_catalogs(path):
+    """
+    Saves all file catalogs in a .json file. The file is first written to a temporary file, which then replaces the
+    .json file, so an interrupted run does not leave a corrupt catalog.
+
+    :param path: path of the .json file
+    :return: ---
+    """
+    data = {"{}|{}".format(folder, ext): catalog.to_dict() for (folder, ext), catalog in catalogs.items()
+            if catalog.mtime is not None}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def get_catalog(folder, ext=".tif"):
+    """
+    Gets the file catalog of the input folder. The folder is only scanned the first time, or if it was modified since
+    the last scan. If 'persist_file_catalog' is True, the catalogs are saved in the results folder after each scan.
+
+    :param folder: folder path
+    :param ext: string, extension of the files to index (default: '.tif'). If empty, all files and sub-folders are
+    indexed
+    :return: FileCatalog of the folder
+    """
+    key = (os.path.abspath(folder), ext)
+    if key not in catalogs:
+        catalogs[key] = FileCatalog(key[0], ext)
+    catalog = catalogs[key]
+    if catalog.refresh() and config_input.persist_file_catalog:
+        save_catalogs(catalog_path())
+    return catalog
+
+
+def filter_raster_lists(folder, date1, date2, file_name, ext=".tif"):
+    """
+    Gets, from the file catalog of the input folder, the files whose dates are in between 2 dates (date1-date2)
+    (analysis range). If there are no files for the given date range (new_list is empty) or any month is missing,
+    function throws an error.
+
+    :param folder: folder path with files whose names contain the date in either YYYYMM or YYMM format
     :param date1: analysis start date (in datetime format)
     :param date2: analysis end date (in datetime format)
     :param file_name: string with the name of the input raster file type generating the error
+    :param ext: string, extension of the files to look for (default: '.tif'). If empty, all files and sub-folders are
+    considered
 
-    :return: filtered list, without the files that are not within the analysis date range.
+    :return: list with the file paths within the analysis date range, sorted by date
     """
-    new_list = []
-    for elem in raster_list:
-        if not has_number(elem) or sum(c.isdigit() for c in elem) < 4:
-            continue
-        else:
-            date = get_date(elem)
-            # timedelta is added because Wasim are from 9 PM
-            date2_end = date2 + datetime.timedelta(hours=23)
-            if date1 <= date <= date2_end:
-                new_list.append(elem)
+    # timedelta is added because Wasim are from 9 PM
+    date2_end = date2 + datetime.timedelta(hours=23)
+    new_list = get_catalog(folder, ext).range_files(date1, date2_end)
 
     if len(new_list) == 0:
         message = "ERROR: There are no {} input raster files corresponding to input date range. Check input.".format(
@@ -190,6 +376,31 @@ def filter_raster_lists(raster_list, date1, date2, file_name):
     return new_list
 
 
+def get_month_file(folder, date, file_name, ext=".tif"):
+    """
+    Gets the file, from the file catalog of the input folder, whose name contains a date corresponding to the input
+    date's month. If there is no file, or more than one file, for the given month, function throws an error.
+
+    :param folder: folder path with files whose names contain the date in either YYYYMM or YYMM format
+    :param date: date (in datetime format) corresponding to the month to get
+    :param file_name: string with the name of the input raster file type generating the error
+    :param ext: string, extension of the files to look for (default: '.tif')
+
+    :return: path of the file corresponding to the input month
+    """
+    matches = get_catalog(folder, ext).month_files(date)
+
+    if len(matches) == 0:
+        message = "ERROR: There is no {} input raster file for {} in '{}'. Check input.".format(
+            file_name, str(date.strftime('%Y%m')), folder)
+        sys.exit(message)
+    if len(matches) > 1:
+        message = "ERROR: There is more than one {} input raster file for {} in '{}'. Check input.".format(
+            file_name, str(date.strftime('%Y%m')), folder)
+        sys.exit(message)
+    return matches[0]
+
+
 def compare_dates(list1, list2, name1, name2):
     """
     Checks if the files in 2 different input folders have the same number of files corresponding to the given
@@ -223,50 +434,39 @@ def compare_dates(list1, list2, name1, name2):
             sys.exit(message)
 
 
-def generate_satellite_image_date_list(folders, date_list):
+def generate_satellite_image_date_list(folders, date_list, cloud_fractions=None):
     """
     Receives a list with folders, which correspond to a given satellite image sensing date. The folder name
     must be in YYYYMMDD format (otherwise function will erase said folder from the list). Then, for each analysis date
     (in date_list), the function determines which satellite image sensing date is closest to the end of each analysis
-    month
+    month (see si_date_selection.py). If the cloud fraction of each sensing date is given, the sensing date is chosen
+    by closeness to the end of the month and clearness.
 
     :param folders: list with folder names (string format)
     :param date_list: list with analysis date (in datetime format)
+    :param cloud_fractions: (optional) dictionary with the folder name as key and the cloud fraction (0-1) as value
 
     :return: cropped folder list containing the satellite images to analyze
     """
-    folder_date_list = []  # list to save the folder names as dates
-    # list to save folder name of those folders whose name corresponds to a date
-    mod_folder_list = []
-    for f in folders:
-        if sum(c.isdigit() for c in f) == 8:  # If folder name is a YYYYMMDD date
-            folder_date_list.append(get_date(f))  # convert folder name to date
-            # copy folder name, which corresponds to a date, to a new list
-            mod_folder_list.append(f)
-
-    # convert folder name (as dates) to a numpy array
-    folder_date_list = np.array(folder_date_list)
-
-    return_folder_list = []
-    for date in date_list:
-        # get last day of the given month in "date"
-        date = date.replace(day=calendar.monthrange(date.year, date.month)[1])
-        # subtract the analysis date from all folder dates to get day difference between each folder and "date"
-        sub = np.abs(np.subtract(date, folder_date_list))
-        index = np.argmin(sub)  # get index of min value
+    if cloud_fractions is None:
+        return_folder_list = si_date_selection.select_sensing_dates(folders, date_list,
+                                                                    max_days=config_input.si_max_days)
+    else:
+        return_folder_list = si_date_selection.select_sensing_dates(
+            folders, date_list, max_days=config_input.si_max_days, cloud_fractions=cloud_fractions,
+            max_cloud_fraction=config_input.si_max_cloud_fraction, cloud_weight=config_input.si_cloud_weight)
 
-        # if time difference is more than 15 days, it is no longer considered the end of the month.
-        if sub[index] > datetime.timedelta(days=15):
+    # if time difference is more than 'si_max_days' days, it is no longer considered the end of the month.
+    for date, folder in zip(date_list, return_folder_list):
+        if folder is None:
             message = "There are no available satellite images for the analysis date: " + \
                       str(date.strftime('%Y%m'))
             sys.exit(message)
-        else:
-            return_folder_list.append(mod_folder_list[index])
 
     return return_folder_list
 
 
-def check_input_si_dates(folders, date_list, si_image_dates):
+def check_input_si_dates(folders, date_list, si_image_dates, cloud_fractions=None):
     """
     Called if the user sets which satellite image dates to use. There are 2 possibilities:
 
@@ -283,35 +483,26 @@ def check_input_si_dates(folders, date_list, si_image_dates):
     :param folders: list of available sensing dates
     :param date_list: list with the dates to analyze (in datetime format)
     :param si_image_dates: the user input variable with the sensing dates to use
+    :param cloud_fractions: (optional) dictionary with the folder name as key and the cloud fraction (0-1) as value,
+    used to choose the sensing date of the months not set by the user
 
     :return: list of satellite image sensing dates to analyze.
     """
     # Step 1: # Check if the input dates exist in the input satellite image folder:
+    folder_set = set(folders)
     for s_date in si_image_dates:
-        if str(s_date) not in folders:
+        if str(s_date) not in folder_set:
             message = "There is no satellite image for {} in input satellite image folder. Check user input".format(
                 str(s_date))
             sys.exit(message)
     # Get list of available satellite images for each date in analysis range, calculated automatically
-    last_of_month_list = generate_satellite_image_date_list(folders, date_list)
-    folder_date_list = []  # list to save the folder names as dates
-    # convert each last_of_month_list folder name to datetime format
-    for f in last_of_month_list:
-        if sum(c.isdigit() for c in f) == 8:  # If folder name is a YYYYMMDD date
-            folder_date_list.append(get_date(f))  # convert folder name to date
-
-    # convert folder name (as dates) to a numpy array
-    folder_date_list = np.array(folder_date_list)
-    # compare each input si date with the end_of_the_month folder names (in date time format)
-    for si_date in si_image_dates:
-        # convert input si dae to datetime format
-        si_date_format = get_date(str(si_date))
-        sub = np.abs(
-            np.subtract(si_date_format, folder_date_list))  # subtract the date from each last of the month SI date
-        index = np.argmin(sub)  # get index of min value
-        # if time difference is less than 30 days, folder_date_list[index] corresponds to the same month as the
-        # si_input_Date and thus will be substituted
-        if sub[index] < datetime.timedelta(days=30):
+    last_of_month_list = generate_satellite_image_date_list(folders, date_list, cloud_fractions)
+
+    # compare each input si date with the end_of_the_month folder names: if the time difference is less than 30 days,
+    # the end of the month folder corresponds to the same month as the si_input_Date and thus will be substituted
+    month_index = si_date_selection.match_input_dates(si_image_dates, last_of_month_list, max_days=30)
+    for si_date, index in zip(si_image_dates, month_index):
+        if index is not None:
             last_of_month_list[index] = si_date
 
     folders_to_analyze = last_of_month_list
@@ -319,11 +510,94 @@ def check_input_si_dates(folders, date_list, si_image_dates):
     return folders_to_analyze
 
 
+def get_satellite_image_folders(date_list):
+    """
+    Gets the satellite image folder (sensing date) to use for each month in date_list, either set by the user
+    (si_image_dates in config_input, if 'input_si_dates' is True) or the sensing date closest to the end of each month.
+    If 'si_cloud_selection' is True, the cloud fraction of each sensing date is read from the cloud index (see
+    si_cloud_index.py) and the sensing dates are chosen by closeness to the end of the month and clearness.
+
+    :param date_list: list with analysis dates (in datetime format)
+
+    :return: list with the satellite image folder names, one for each date in date_list
+    """
+    # list with satellite image folders
+    si_list = os.listdir(config_input.si_folder_path)
+    cloud_fractions = None
+    if config_input.si_cloud_selection and not (len(si_list) == 2 and not config_input.input_si_dates):
+        cloud_fractions = si_cloud_index.get_cloud_fractions(si_list)
+    if config_input.input_si_dates:  # If user inputs the dates to use:
+        si_list = check_input_si_dates(si_list, date_list, config_input.si_image_dates, cloud_fractions)
+    else:  # get images whose sensing date is closest to end of month
+        if len(si_list) == 2:  # if only 2 folders, only one sensing date was given
+            si_list = [os.path.basename(config_input.si_folder_path)]
+        # If no dates to directly use (user input), get the satellite image closest to the end of the month.
+        si_list = generate_satellite_image_date_list(si_list, date_list, cloud_fractions)
+    return si_list
+
+
+def validate_run_inputs(date_list):
+    """
+    Validates all input rasters of the run which exist before the calculations start (f(E,L) raster and the monthly
+    rasters of the modules that are not run, e.g. 'snow_raster_input' if run_rain_snow_rasters is False) against the
+    snap raster grid and against each other, in one pass, before any calculation starts (see 'validate_rasters' in
+    raster_metadata.py). The metadata read for each raster stays in the raster metadata cache, so the checks of each
+    module do not open the rasters again.
+
+    Rasters used in the R factor and total R factor (f(E,L), rain, R factor and snow melt rasters) must be on the same
+    grid, so the program stops if any problem is found. For the snow and snow cover rasters, which are only compared
+    with each other in the snow melt calculation, the problems are printed as warnings.
+
+    :param date_list: list with analysis dates (in datetime format)
+
+    :return: ---
+    """
+    # [name, raster paths, True if the program stops when a problem is found]
+    groups = []
+    r_factor_inputs = []
+    if config_input.run_r_factor:
+        r_factor_inputs.append(config_input.fEL_path)
+        if not config_input.run_rain_snow_rasters:
+            r_factor_inputs += [get_month_file(rain_raster_path, d, "rain") for d in date_list]
+    if config_input.run_total_factor:
+        if not config_input.run_r_factor:
+            r_factor_inputs += [get_month_file(r_factor_path, d, "R factor") for d in date_list]
+        if not config_input.run_snow_melt:
+            r_factor_inputs += [get_month_file(snow_melt_path, d, "snow melt") for d in date_list]
+    groups.append(["R factor", r_factor_inputs, True])
+
+    if config_input.run_snow_melt and config_input.snow_melt_model != 'degree_day':
+        snow_inputs = []
+        if not config_input.run_rain_snow_rasters:
+            snow_inputs += [get_month_file(snow_raster_path, d, "snow") for d in date_list]
+        if not config_input.run_snow_cover and not config_input.run_wasim_snow:
+            snow_inputs += [get_month_file(snow_cover_path, d, "snow cover") for d in date_list]
+        groups.append(["snow melt", snow_inputs, False])
+
+    errors = []
+    for name, paths, stop in groups:
+        if len(paths) == 0:
+            continue
+        group_errors, group_warnings = raster_metadata.validate_rasters(paths)
+        for message in group_warnings + ([] if stop else group_errors):
+            print("WARNING ({} input rasters): {}".format(name, message))
+        if stop:
+            errors += group_errors
+
+    if errors:
+        message = "ERROR: {} problem(s) found in the input rasters. Check input rasters:\n    ".format(len(errors)) + \
+                  "\n    ".join(errors)
+        sys.exit(message)
+
+
 if __name__ == '__main__':
     pass
 else:
     # Generate folder to save all results:
     create_folder(config_input.results_path)
+    # Load the file catalogs saved in a previous run
+    if config_input.persist_file_catalog:
+        load_catalogs(catalog_path())
 
     # Convert input dates (start and end date) to date format
     config_input.start_date = get_date(config_input.start_date)
@@ -369,10 +643,15 @@ else:
         snow_melt_path = os.path.join(config_input.results_path, "Snowmelt")
         create_folder(snow_melt_path)
         # check if needed input folders exist:
-        check_folder(snow_cover_path, 'snow_cover_path')
-        # snow cover raster
-        check_folder(snow_raster_path, 'snow_raster_path')
-        # snow per month raster
+        if config_input.snow_melt_model == 'degree_day':
+            # precipitation and temperature rasters
+            check_folder(config_input.precipitation_path, "precipitation_path")
+            check_folder(config_input.temperature_path, 'temperature_path')
+        else:
+            check_folder(snow_cover_path, 'snow_cover_path')
+            # snow cover raster
+            check_folder(snow_raster_path, 'snow_raster_path')
+            # snow per month raster
     else:
         snow_melt_path = config_input.snow_melt_input
 
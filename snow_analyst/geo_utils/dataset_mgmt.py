@@ -8,11 +8,12 @@ def coords2offset(geo_transform, x_coord, y_coord):
 
     Args:
         geo_transform: osgeo.gdal.Dataset.GetGeoTransform() object
-        x_coord (float): x-coordinate
-        y_coord (float): y-coordinate
+        x_coord (float or numpy.array): x-coordinate(s)
+        y_coord (float or numpy.array): y-coordinate(s)
 
     Returns:
-        tuple: Number of pixels ``(offset_x, offset_y)``,  both ``int`` .
+        tuple: Number of pixels ``(offset_x, offset_y)``,  both ``int`` (or both ``numpy.array`` of ``int64`` if the
+        coordinates are arrays, converted at once). As with ``int``, the offsets are truncated towards zero.
     """
     try:
         origin_x = geo_transform[0]
@@ -24,9 +25,13 @@ def coords2offset(geo_transform, x_coord, y_coord):
         return None
 
     try:
-        offset_x = int((x_coord - origin_x) / pixel_width)
-        offset_y = int((y_coord - origin_y) / pixel_height)
-    except ValueError:
+        if np.ndim(x_coord) > 0 or np.ndim(y_coord) > 0:
+            offset_x = np.trunc((np.asarray(x_coord, dtype=np.float64) - origin_x) / pixel_width).astype(np.int64)
+            offset_y = np.trunc((np.asarray(y_coord, dtype=np.float64) - origin_y) / pixel_height).astype(np.int64)
+        else:
+            offset_x = int((x_coord - origin_x) / pixel_width)
+            offset_y = int((y_coord - origin_y) / pixel_height)
+    except (TypeError, ValueError):
         logging.error("geo_transform tuple contains non-numeric data: %s" % str(geo_transform))
         return None
     return offset_x, offset_y
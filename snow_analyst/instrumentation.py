@@ -0,0 +1,275 @@
+"""
+Instrumentation of the modules (stages) of the analysis: records, for each stage and month, the wall time, the CPU time,
+the peak memory use (resident set size, RSS), the bytes read and written and the number of rasters written, and saves
+them in a run report ('run_report.json' in the results folder) at the end of the run.
+
+Stages are recorded with the 'stage' context manager:
+    with instrumentation.stage("snow_cover", date):
+        snow_cover.calculate_snow_cover(path, date)
+
+NOTES:
+- Nothing is recorded if 'run_report' in config_input is False, and 'stage' then only runs the code in it.
+- The peak RSS is the peak memory use of the process since it started (it cannot be reset), so the value of a stage is
+the peak up to the end of the stage. 'peak_rss_increase_mb' is how much the stage raised the peak.
+- Peak RSS is read with the 'resource' module (Linux, macOS) or, if it is not available (Windows), with psutil. Bytes
+read and written are read with psutil or, if it is not installed, from /proc/self/io (Linux). Values which cannot be
+read on the system are saved as None.
+- The rasters written by a stage are its output .tif files (see 'stage_outputs' in pipeline.py) which were created or
+modified during the stage, so rasters written by other stages running at the same time (run_parallel) are not counted.
+The stages without output files per month (e.g. 'climatology') are recorded with 'rasters_written' = None.
+- A stage run for several months at once (e.g. the snow melt of all months) is recorded as one record per month, with
+the time and I/O split evenly between the months ('shared' = True).
+- Modules which calculate several months in one call, but record each month themselves (R factor and total R factor),
+have their own 'stage' around each month. The code they run once for all months (e.g. reading the f(E,L) raster) is
+not in any record. A stage started inside a stage with the same name (e.g. a module run in a pipeline task, see
+pipeline.run_task) is not recorded again: it is part of the record of the outer stage.
+- If 'profile_stages' in config_input is True, each stage is also run with cProfile, and the profile is saved in the
+'profiles' sub-folder of the results folder (<stage>_<YYYYMM>.prof, which can be read with pstats or snakeviz).
+"""
+
+import config_input
+from package_handling import *
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Records of all stages run (one dictionary per stage and month)
+records = []
+# Names of the stages being recorded (see 'stage')
+active_stages = set()
+run_start = time.time()
+
+
+def peak_rss():
+    """
+    Gets the peak memory use (resident set size) of the process.
+
+    :return: int, peak RSS in bytes, or None if it cannot be read
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes in Linux and in bytes in macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        return getattr(memory, "peak_wset", memory.rss)
+    return None
+
+
+def io_bytes():
+    """
+    Gets the number of bytes read from and written to the storage by the process.
+
+    :return: [bytes read, bytes written], or [None, None] if they cannot be read
+    """
+    if psutil is not None:
+        try:
+            counters = psutil.Process().io_counters()
+            return counters.read_bytes, counters.write_bytes
+        except (AttributeError, psutil.Error):  # io_counters is not available in macOS
+            pass
+    try:
+        with open("/proc/self/io", "r") as f:
+            counters = dict(line.split(":") for line in f if ":" in line)
+        return int(counters["read_bytes"]), int(counters["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def output_rasters(name, months):
+    """
+    Gets the output rasters (.tif files) of a stage for its months (see 'stage_outputs' in pipeline.py), with their
+    modification time. Only the known output files are checked, so the results folder is not scanned.
+
+    :param name: string, name of the stage
+    :param months: list with the dates (in datetime format) of the months of the stage
+    :return: dictionary with the file path as key and the modification time (ns, None if the file does not exist) as
+    value, or None if the stage has no known output files per month
+    """
+    import pipeline  # imported here, since pipeline imports this module
+
+    files = {}
+    for date in months:
+        outputs = pipeline.stage_outputs(name, date)
+        if outputs is None:
+            return None
+        for path in outputs:
+            if path.lower().endswith(".tif"):
+                files[path] = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+    return files
+
+
+def month_dates(months):
+    """
+    Converts the month(s) of a stage to a list of dates.
+
+    :param months: date (in datetime format), list of dates, or None
+    :return: list with the dates (empty if months is None)
+    """
+    if months is None:
+        return []
+    if isinstance(months, datetime.date):
+        return [months]
+    return list(months)
+
+
+def profile_path(name, months):
+    """
+    Gets the path of the cProfile file of a stage.
+
+    :param name: string, name of the stage
+    :param months: list with the months of the stage (YYYYMM format)
+    :return: path of the .prof file, in the 'profiles' sub-folder of the results folder
+    """
+    folder = os.path.join(config_input.results_path, "profiles")
+    if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    if len(months) == 1:
+        suffix = months[0]
+    elif months:
+        suffix = "{}-{}".format(months[0], months[-1])
+    else:
+        suffix = "all"
+    return os.path.join(folder, "{}_{}.prof".format(name, suffix))
+
+
+@contextlib.contextmanager
+def stage(name, months=None):
+    """
+    Context manager which records the resources used by the code run in it (see module docstring) and adds the record
+    to 'records'. If 'run_report' in config_input is False, it only runs the code.
+
+    :param name: string, name of the stage (e.g. 'snow_cover')
+    :param months: date (in datetime format) or list of dates of the month(s) calculated in the stage, or None if the
+    stage calculates all months in the analysis date range
+    :return: dictionary with the record of the stage (filled when the stage is finished), or None if nothing is recorded
+    (also if a stage with the same name is already being recorded)
+    """
+    if not config_input.run_report or name in active_stages:
+        yield None
+        return
+
+    dates = month_dates(months)
+    record = {"stage": name, "months": [d.strftime('%Y%m') for d in dates], "pid": os.getpid()}
+    rasters_before = output_rasters(name, dates)
+    read_before, written_before = io_bytes()
+    rss_before = peak_rss()
+    profiler = cProfile.Profile() if config_input.profile_stages else None
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    active_stages.add(name)
+    try:
+        yield record
+    finally:
+        active_stages.discard(name)
+        if profiler is not None:
+            profiler.disable()
+        record["wall_s"] = time.perf_counter() - wall_start
+        record["cpu_s"] = time.process_time() - cpu_start
+
+        rss_after = peak_rss()
+        record["peak_rss_mb"] = rss_after / 2 ** 20 if rss_after is not None else None
+        record["peak_rss_increase_mb"] = (rss_after - rss_before) / 2 ** 20 if rss_after is not None else None
+        read_after, written_after = io_bytes()
+        record["read_bytes"] = read_after - read_before if read_after is not None else None
+        record["written_bytes"] = written_after - written_before if written_after is not None else None
+        if profiler is not None:
+            record["profile"] = profile_path(name, record["months"])
+            profiler.dump_stats(record["profile"])
+
+        if rasters_before is None:
+            record["rasters_written"] = None
+            records.append(record)
+        else:
+            rasters_after = output_rasters(name, dates)
+            changed = {p for p, t in rasters_after.items() if t is not None and rasters_before.get(p) != t}
+            if len(dates) <= 1:
+                record["rasters_written"] = len(changed)
+                records.append(record)
+            else:
+                # One record per month: the rasters written are counted for each month, and the time and I/O of a stage
+                # which calculated several months at once are split evenly between them ('shared' records)
+                for date in dates:
+                    month_record = dict(record, months=[date.strftime('%Y%m')], shared=True)
+                    month_record["rasters_written"] = len(changed.intersection(output_rasters(name, [date])))
+                    for key in ["wall_s", "cpu_s", "read_bytes", "written_bytes"]:
+                        if month_record[key] is not None:
+                            month_record[key] = month_record[key] / len(dates)
+                    records.append(month_record)
+
+
+def stage_summary():
+    """
+    Sums up the records of each stage (for all months).
+
+    :return: dictionary with the stage name as key and a dictionary with the total wall time, CPU time, bytes read and
+    written, rasters written and the maximum peak RSS of the stage as value
+    """
+    summary = {}
+    for record in records:
+        total = summary.setdefault(record["stage"], {"runs": 0, "months": 0, "wall_s": 0., "cpu_s": 0.,
+                                                     "peak_rss_mb": None, "read_bytes": None, "written_bytes": None,
+                                                     "rasters_written": None})
+        total["runs"] += 1
+        total["months"] += len(record["months"])
+        for key in ["wall_s", "cpu_s"]:
+            total[key] += record[key]
+        for key in ["read_bytes", "written_bytes", "rasters_written"]:
+            if record[key] is not None:
+                total[key] = (total[key] or 0) + record[key]
+        if record["peak_rss_mb"] is not None:
+            total["peak_rss_mb"] = max(total["peak_rss_mb"] or 0., record["peak_rss_mb"])
+    return summary
+
+
+def save_report(path=None):
+    """
+    Saves the run report (run information, a summary per stage and the records of each stage and month) to a .json file
+    and prints the summary. Nothing is saved if 'run_report' in config_input is False.
+
+    :param path: path of the .json file (default: 'run_report.json' in the results folder)
+    :return: path of the saved report, or None if nothing was saved
+    """
+    if not config_input.run_report:
+        return None
+    if path is None:
+        path = os.path.join(config_input.results_path, "run_report.json")
+
+    summary = stage_summary()
+    rss = peak_rss()
+    report = {
+        "start": datetime.datetime.fromtimestamp(run_start).isoformat(timespec="seconds"),
+        "end": datetime.datetime.now().isoformat(timespec="seconds"),
+        "wall_s": time.time() - run_start,
+        "cpu_s": time.process_time(),
+        "peak_rss_mb": rss / 2 ** 20 if rss is not None else None,
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "analysis_dates": [config_input.start_date.strftime('%Y%m'), config_input.end_date.strftime('%Y%m')],
+        "stages": summary,
+        "records": records,
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print("\n{:<20}{:>8}{:>12}{:>12}{:>14}{:>12}{:>10}".format("Stage", "Months", "Wall (s)", "CPU (s)",
+                                                            "Peak RSS (MB)", "I/O (MB)", "Rasters"))
+    for name, total in summary.items():
+        io = None
+        if total["read_bytes"] is not None or total["written_bytes"] is not None:
+            io = ((total["read_bytes"] or 0) + (total["written_bytes"] or 0)) / 2 ** 20
+        print("{:<20}{:>8}{:>12.2f}{:>12.2f}{:>14}{:>12}{:>10}".format(
+            name, total["months"], total["wall_s"], total["cpu_s"],
+            "{:.1f}".format(total["peak_rss_mb"]) if total["peak_rss_mb"] is not None else "-",
+            "{:.1f}".format(io) if io is not None else "-",
+            total["rasters_written"] if total["rasters_written"] is not None else "-"))
+    print("Run report saved in {}".format(path))
+    return path
@@ -12,37 +12,55 @@ It calls the following files in the following order:
  (2007)
  *total_R_factor.py: calculates the snow melt R factor and generates rasters with the total R factor values, per month,
  as a the sum of the precipitation and snow melt R factor.
+ *climatology.py: (optional) saves the long-term climatology and the anomalies of the total R factor.
+ *time_series_output.py: (optional) saves the monthly results of each product as one multi-band raster per year.
+ *monte_carlo.py: (optional) propagates the parameter and precipitation uncertainty to the total R factor.
 """
 
+import argparse
+import checkpoints
+import climatology
 import config_input
+import degree_day
 import file_management
+import instrumentation
+import log
+import monte_carlo
+import pipeline
 import pt_raster_manipulation
 import rain_snow_rasters
 import snow_cover
+import time_series_output
 import total_R_factor
 import wasim_snow
 from Rfactor_REM_db import Rfactor_main
 from package_handling import *
 from snow_melt import snow_melt_main
 
-if __name__ == '__main__':
-
-    # initialize ascii data
-    config_input.initialize_ascii()
 
-    # Generate a list with all the dates to run through and include in the analysis
-    date_list = file_management.get_date_list(config_input.start_date, config_input.end_date)
+def run_modules(date_list):
+    """
+    Runs all modules enabled in config_input, one after the other, for all months in date_list. Each module saves a
+    checkpoint for each month it finishes (see checkpoints.py) and, if 'resume_run' is True, only calculates the months
+    which were not completed in a previous run.
 
+    :param date_list: list with analysis dates (in datetime format)
+    """
     #  RUN PT_raster_manipulation
     # Generate .csv files with daily/hourly precipitation and temperature per input raster cell
     if config_input.run_pt_manipulation:
         print("Generating .csv files from precipitation and temperature data")
         # Run PT_Manipulation to get .csv files with precipitation and temperature data
         if config_input.start_date.strftime('%Y%m') == config_input.end_date.strftime('%Y%m'):  # If only one date
-            pt_raster_manipulation.generate_csv(date=config_input.start_date)
+            if checkpoints.pending_months("pt_manipulation", [config_input.start_date]):
+                with instrumentation.stage("pt_manipulation", config_input.start_date):
+                    pt_raster_manipulation.generate_csv(date=config_input.start_date)
+                checkpoints.mark_complete("pt_manipulation", config_input.start_date)
         else:  # if more than one date is being run
-            for date in date_list:
-                pt_raster_manipulation.generate_csv(date)
+            for date in checkpoints.pending_months("pt_manipulation", date_list):
+                with instrumentation.stage("pt_manipulation", date):
+                    pt_raster_manipulation.generate_csv(date)
+                checkpoints.mark_complete("pt_manipulation", date)
         print("Finished running PT_raster manipulation.")
 
     # RUN rain_snow_rasters
@@ -54,49 +72,145 @@ if __name__ == '__main__':
         # Check if more folders or if there are .csv files (to determine if 1 run or multiple)
         # If any .csv files in folder, loop through 1 folder
         if any(".csv" in string for string in csv_list):
-            rain_snow_rasters.generate_rain_snow_rasters(config_input.PT_path)
+            with instrumentation.stage("rain_snow_rasters", date_list):
+                rain_snow_rasters.generate_rain_snow_rasters(config_input.PT_path)
         else:  # Loop through each sub-folder
-            # clip csv_list to include only dates within input range
+            # get the sub-folders with dates within input range
             csv_list = file_management.filter_raster_lists(
-                csv_list, config_input.start_date, config_input.end_date, "rain_snow_rasters.py")
-            for date in csv_list:  # Run code for each folder (date) at a time
-                path = os.path.join(config_input.PT_path, date)
-                rain_snow_rasters.generate_rain_snow_rasters(path)
+                config_input.PT_path, config_input.start_date, config_input.end_date, "rain_snow_rasters.py", ext="")
+            # The original raster information is set by pt_raster_manipulation, which is skipped for completed months
+            pipeline.set_ascii_data(date_list[0])
+            pending = [d.strftime('%Y%m') for d in checkpoints.pending_months("rain_snow_rasters", date_list)]
+            for path in csv_list:  # Run code for each folder (date) at a time
+                date = file_management.get_date(path)
+                if date.strftime('%Y%m') not in pending:
+                    continue
+                with instrumentation.stage("rain_snow_rasters", date):
+                    rain_snow_rasters.generate_rain_snow_rasters(path)
+                checkpoints.mark_complete("rain_snow_rasters", date)
         print("Finished rain and snow raster generation")
 
     # RUN snow_cover
     # Generate a binary snow detection raster, to determine cells with snow
-    if config_input.run_snow_cover:
-        # list with satellite image folders
-        si_list = os.listdir(config_input.si_folder_path)
-        if config_input.input_si_dates:  # If user inputs the dates to use:
-            si_list = file_management.check_input_si_dates(
-                si_list, date_list, config_input.si_image_dates)
-        else:  # get images whose sensing date is closest to end of month
-            if len(si_list) == 2:  # if only 2 folders, only one sensing date was given
-                si_list = [os.path.basename(config_input.si_folder_path)]
-            # If no dates to directly use (user input), get the satellite image closest to the end of the month.
-            si_list = file_management.generate_satellite_image_date_list(
-                si_list, date_list)
+    if config_input.run_snow_cover and config_input.snow_cover_composite:
+        # Composite of all sensing dates around the end of each month
+        for d in checkpoints.pending_months("snow_cover", date_list):
+            with instrumentation.stage("snow_cover", d):
+                snow_cover.calculate_snow_cover_composite(d)
+            checkpoints.mark_complete("snow_cover", d)
+    elif config_input.run_snow_cover:
+        si_list = file_management.get_satellite_image_folders(date_list)
         print("Folders to loop through:, ", si_list)
+        pending = checkpoints.pending_months("snow_cover", date_list)
         for f, d in zip(si_list, date_list):
+            if d not in pending:
+                continue
             path = os.path.join(config_input.si_folder_path, str(f))
-            snow_cover.calculate_snow_cover(path, d)
+            with instrumentation.stage("snow_cover", d):
+                snow_cover.calculate_snow_cover(path, d)
+            checkpoints.mark_complete("snow_cover", d)
 
     # RUN wasim_snow
     if config_input.run_wasim_snow:
         print("Analyze snow raster from hydrological model WaSim")
-        wasim_snow.process_wasim_results()
+        pending = checkpoints.pending_months("wasim_snow", date_list)
+        if pending and config_input.wasim_in_memory and config_input.wasim_workers > 1:
+            # Months resampled in parallel: one (shared) record per month
+            with instrumentation.stage("wasim_snow", pending):
+                wasim_snow.process_wasim_results(pending)
+            for d in pending:
+                checkpoints.mark_complete("wasim_snow", d)
+        else:
+            for d in pending:
+                with instrumentation.stage("wasim_snow", d):
+                    wasim_snow.process_wasim_results([d])
+                checkpoints.mark_complete("wasim_snow", d)
 
     # RUN snow_melt
-    # Generate end of month snow rasters and snow melt rasters
-    if config_input.run_snow_melt:
-        snow_melt_main.process_snow_melt()
+    # Generate end of month snow rasters and snow melt rasters (the checkpoints are saved by snow_melt_main)
+    if config_input.run_snow_melt and config_input.snow_melt_model == 'degree_day':
+        # Degree-day model from the precipitation and temperature rasters (continues from the saved snow state)
+        pending = checkpoints.pending_months("snow_melt", date_list, chained=True)
+        if pending:
+            # The SWE is kept in memory from one month to the next (as in degree_day.process_degree_day)
+            swe = None
+            for d in pending:
+                with instrumentation.stage("snow_melt", d):
+                    swe = degree_day.process_degree_day_month(d, swe)
+            snow_melt_main.snow_melt_statistics([[d.strftime('%Y%m')] for d in date_list])
+    elif config_input.run_snow_melt:
+        pending = checkpoints.pending_months("snow_melt", date_list, chained=True)
+        if len(pending) == len(date_list):
+            # All months are calculated at once (see snowpack.py): one (shared) record per month
+            with instrumentation.stage("snow_melt", date_list):
+                snow_melt_main.process_snow_melt()
+        elif pending:
+            # Continue the snow melt recursion from the snow state saved for the last completed month
+            for d in pending:
+                with instrumentation.stage("snow_melt", d):
+                    snow_melt_main.process_snow_melt_month(d)
+            snow_melt_main.snow_melt_statistics([[d.strftime('%Y%m')] for d in date_list])
 
     # RUN Rfactor_REM_db
     if config_input.run_r_factor:
-        Rfactor_main.calculate_REM_db()
+        pending = checkpoints.pending_months("r_factor", date_list)
+        if pending:
+            # All months at once, so the f(E,L) raster is read once (each month is recorded and marked complete in
+            # calculate_REM_db)
+            Rfactor_main.calculate_REM_db(pending)
 
     # RUN total_precit_factor
     if config_input.run_total_factor:
-        total_R_factor.calculate_tot_R()
+        pending = checkpoints.pending_months("total_factor", date_list)
+        if pending:
+            # All months at once, so the arrays are allocated once (each month is recorded and marked complete in
+            # calculate_tot_R)
+            total_R_factor.calculate_tot_R(pending)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Calculates the monthly total R factor (rain and snow melt).")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the months completed in a previous run (see checkpoints.py) and continue the snow "
+                             "melt from the last saved snow state")
+    if parser.parse_args().resume:
+        config_input.resume_run = True
+
+    # initialize ascii data
+    config_input.initialize_ascii()
+
+    # Generate a list with all the dates to run through and include in the analysis
+    date_list = file_management.get_date_list(config_input.start_date, config_input.end_date)
+
+    # Check all existing input rasters against the snap raster grid before any calculation starts
+    file_management.validate_run_inputs(date_list)
+
+    if config_input.parallel_workers > 1:
+        # Run the modules month by month, as a graph of tasks in a process pool
+        pipeline.run_parallel(date_list, config_input.parallel_workers, incremental=config_input.incremental_run)
+    elif config_input.incremental_run:
+        # Run the modules as pipeline stages, recalculating only the months whose inputs or parameters changed
+        pipeline.run_pipeline(date_list)
+    else:
+        run_modules(date_list)
+
+    # Climatology and anomalies of the total R factor, if enabled
+    if config_input.run_climatology:
+        with instrumentation.stage("climatology", date_list):
+            climatology.save_climatology(date_list)
+
+    # Yearly time series files of the monthly results, if enabled
+    if config_input.time_series_output:
+        with instrumentation.stage("time_series_output", date_list):
+            time_series_output.save_time_series(date_list)
+
+    # Monte Carlo uncertainty of the total R factor, if enabled
+    if config_input.run_monte_carlo:
+        with instrumentation.stage("monte_carlo", date_list):
+            monte_carlo.run_monte_carlo(date_list)
+
+    # Save the run report (wall time, CPU time, memory, I/O and rasters written per stage and month), if enabled
+    instrumentation.save_report()
+    # Print the calls and times of the snow melt functions, if enabled
+    if log.profiling:
+        log.print_profile()
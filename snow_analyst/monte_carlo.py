@@ -0,0 +1,291 @@
+"""
+Monte Carlo uncertainty propagation for the total R factor: N samples of the uncertain parameters are drawn once (with
+the seed 'mc_seed' in config_input, so results are reproducible):
+    a:              coefficient of the REM(DB) equation (normal, mean 0.207, standard deviation 'mc_a_sd')
+    b:              exponent of the REM(DB) equation (normal, mean 1.561, standard deviation 'mc_b_sd')
+    snow_factor:    snow melt factor (normal, mean 'snow_factor', standard deviation 'mc_snow_factor_sd')
+    precipitation:  multiplicative error of the precipitation (log-normal, median 1, 'mc_precip_sd' is the standard
+                    deviation of its logarithm), the same for all cells of a month (one value per sample and month)
+and the total R factor of each sample is calculated with Rfactor_main.rfactor and total_R_factor.total_factor.
+
+The rasters are processed tile by tile (tiles of about 'mc_block_size' x 'mc_block_size' cells) and the samples in
+chunks of 'mc_chunk_size' samples, vectorized as (samples, cells) arrays. The statistics of each cell are updated after
+each chunk (see 'PixelStatistics'): the mean and standard deviation are combined with Chan's parallel variant of
+Welford's algorithm, and the quantiles are estimated from a histogram of each cell (widened when needed), so only one
+chunk of samples of one tile is in memory, never N complete rasters. Samples with a non-finite total R factor (e.g. a
+negative power base in the REM(DB) equation) are not counted.
+
+Results (in the 'monte_carlo' folder in the results folder), for each month:
+    RFactor_total_mean_YYYYMM.tif, RFactor_total_std_YYYYMM.tif and RFactor_total_qXX_YYYYMM.tif (one per quantile in
+    'mc_quantiles', e.g. q05 and q95 for the 5 % and 95 % quantiles).
+"""
+
+import config_input
+import file_management
+import total_R_factor
+from Rfactor_REM_db import Rfactor_main
+from Rfactor_REM_db import Rfactor_raster_calculations as raster_calc
+from package_handling import *
+
+
+class PixelStatistics:
+    """
+    Class with the streaming statistics of the samples of each cell of a tile: count, mean and sum of squared
+    differences from the mean (M2), updated chunk by chunk, and a histogram of each cell for the quantiles. Samples
+    which are not finite (e.g. a negative power base in the REM(DB) equation) are not counted.
+
+    The histogram range of each cell is set from its first samples. When samples of a later chunk fall outside the
+    range, the histogram of the cell is rebinned to a wider range (covering the old range and the new samples, plus a
+    margin): the counts of each old bin are moved to the new bin of the old bin's center, so the quantiles do not depend
+    on the chunk size, and are accurate to about one (final) bin width.
+
+    Attributes:
+        bins: INT with the number of histogram bins of each cell
+        count: np.array (cells) with the number of (finite) samples added so far to each cell
+        mean: np.array (cells) with the mean of the samples of each cell
+        m2: np.array (cells) with the sum of squared differences from the mean of each cell
+        low: np.array (cells) with the lower limit of the histogram of each cell (np.nan until the cell has samples)
+        width: np.array (cells) with the bin width of the histogram of each cell
+        counts: np.array (cells, bins) with the number of samples in each bin of each cell
+
+    Methods:
+        update(values): Adds a chunk of samples (samples, cells) to the statistics.
+        average(): Returns the mean of the samples of each cell.
+        std(): Returns the standard deviation of the samples of each cell.
+        quantile(q): Returns the estimated q quantile of the samples of each cell.
+    """
+
+    def __init__(self, n_cells, bins=64):
+        """
+        Assign values to class attributes when a new instance is initiated.
+        :param n_cells: INT with the number of cells
+        :param bins: INT with the number of histogram bins of each cell
+        """
+        self.bins = bins
+        self.count = np.zeros(n_cells, dtype=np.int64)
+        self.mean = np.zeros(n_cells, dtype=np.float64)
+        self.m2 = np.zeros(n_cells, dtype=np.float64)
+        self.low = np.full(n_cells, np.nan, dtype=np.float64)
+        self.width = np.ones(n_cells, dtype=np.float64)
+        self.counts = np.zeros((n_cells, bins), dtype=np.int32)
+
+    def update(self, values):
+        """
+        Adds a chunk of samples to the statistics of each cell.
+        :param values: np.array (samples, cells) with the sample values (non-finite values are ignored)
+        :return: None
+        """
+        finite = np.isfinite(values)
+        values = np.where(finite, values, np.nan).astype(np.float64)
+        n_chunk = finite.sum(axis=0)
+        has_values = n_chunk > 0
+        with np.errstate(all='ignore'):
+            chunk_mean = np.where(has_values, np.nansum(values, axis=0) / n_chunk, 0.)
+            chunk_m2 = np.nansum(np.square(values - chunk_mean), axis=0)
+            chunk_low = np.where(has_values, np.nanmin(np.where(finite, values, np.inf), axis=0), np.nan)
+            chunk_high = np.where(has_values, np.nanmax(np.where(finite, values, -np.inf), axis=0), np.nan)
+
+        # Chan et al.: combine the statistics of the chunk with the statistics of the previous chunks (of each cell)
+        n_total = self.count + n_chunk
+        delta = chunk_mean - self.mean
+        with np.errstate(all='ignore'):
+            self.mean += np.where(has_values, delta * n_chunk / n_total, 0.)
+            self.m2 += np.where(has_values, chunk_m2 + np.square(delta) * self.count * n_chunk / n_total, 0.)
+        self.count = n_total
+
+        # Histogram range: set for the cells with their first samples, widened for the cells with samples outside it
+        first = has_values & np.isnan(self.low)
+        if np.any(first):
+            self.set_range(first, chunk_low, chunk_high)
+        high = self.low + self.bins * self.width
+        outside = has_values & ~first & ((chunk_low < self.low) | (chunk_high >= high))
+        if np.any(outside):
+            self.rebin(outside, np.minimum(chunk_low, self.low), np.maximum(chunk_high, high))
+
+        # Add the finite samples to the histogram of their cell
+        with np.errstate(all='ignore'):
+            position = np.floor((values - self.low) / self.width)
+        position = np.clip(np.nan_to_num(position), 0, self.bins - 1).astype(np.int64)
+        position += np.arange(values.shape[1], dtype=np.int64) * self.bins
+        self.counts += np.bincount(position[finite], minlength=self.counts.size).reshape(self.counts.shape).astype(
+            np.int32)
+
+    def set_range(self, cells, low, high):
+        """
+        Sets the histogram range of some cells from the range of their samples, extended by half of its width on each
+        side (and at least by 0.1 % of the value, so cells with equal samples have a range).
+        :param cells: boolean np.array (cells), True for the cells whose range to set
+        :param low: np.array (cells) with the lowest sample of each cell
+        :param high: np.array (cells) with the highest sample of each cell
+        :return: None
+        """
+        extent = np.maximum(high[cells] - low[cells], np.maximum(np.abs(high[cells]), 1.) * 1e-3)
+        self.low[cells] = low[cells] - extent / 2
+        self.width[cells] = 2 * extent / self.bins
+
+    def rebin(self, cells, low, high):
+        """
+        Widens the histogram range of some cells to cover [low, high], moving the counts of each old bin to the new bin
+        of its center.
+        :param cells: boolean np.array (cells), True for the cells to rebin
+        :param low: np.array (cells) with the lowest value the new range must cover
+        :param high: np.array (cells) with the highest value the new range must cover
+        :return: None
+        """
+        index = np.nonzero(cells)[0]
+        centers = self.low[index, None] + (np.arange(self.bins) + 0.5) * self.width[index, None]
+        self.set_range(cells, low, high)
+        position = np.clip(np.floor((centers - self.low[index, None]) / self.width[index, None]), 0,
+                           self.bins - 1).astype(np.int64)
+        position += np.arange(index.shape[0], dtype=np.int64)[:, None] * self.bins
+        self.counts[index] = np.bincount(position.ravel(), weights=self.counts[index].ravel(),
+                                         minlength=index.shape[0] * self.bins).reshape(-1, self.bins).astype(np.int32)
+
+    def average(self):
+        """Returns the mean of the samples of each cell (np.nan in cells without finite samples)."""
+        return np.where(self.count > 0, self.mean, np.nan)
+
+    def std(self):
+        """Returns the (sample) standard deviation of the samples of each cell (np.nan with less than 2 samples)."""
+        with np.errstate(all='ignore'):
+            return np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan)
+
+    def quantile(self, q):
+        """
+        Returns the q quantile of the samples of each cell, interpolated linearly within the histogram bin in which it
+        falls.
+        :param q: FLOAT between 0 and 1
+        :return: np.array (cells) with the estimated quantile (np.nan in cells without finite samples)
+        """
+        cumulative = np.cumsum(self.counts, axis=1)
+        target = q * self.count
+        position = np.argmax(cumulative >= target[:, None], axis=1)
+        cells = np.arange(self.counts.shape[0])
+        before = np.where(position > 0, cumulative[cells, position - 1], 0)
+        in_bin = np.maximum(self.counts[cells, position], 1)
+        fraction = np.clip((target - before) / in_bin, 0., 1.)
+        return np.where(self.count > 0, self.low + (position + fraction) * self.width, np.nan)
+
+
+def draw_samples(n_samples, n_months, seed=None):
+    """
+    Draws the samples of the uncertain parameters.
+
+    :param n_samples: int, number of samples
+    :param n_months: int, number of months (one precipitation error per sample and month)
+    :param seed: int or None, seed of the random number generator
+    :return: dictionary with np.float32 arrays: 'a', 'b' and 'snow_factor' (samples), 'precipitation' (months, samples)
+    """
+    rng = np.random.default_rng(seed)
+    return {"a": rng.normal(0.207, config_input.mc_a_sd, n_samples).astype(np.float32),
+            "b": rng.normal(1.561, config_input.mc_b_sd, n_samples).astype(np.float32),
+            "snow_factor": rng.normal(config_input.snow_factor, config_input.mc_snow_factor_sd,
+                                      n_samples).astype(np.float32),
+            "precipitation": rng.lognormal(0., config_input.mc_precip_sd, (n_months, n_samples)).astype(np.float32)}
+
+
+def quantile_name(q):
+    """
+    Gets the name of a quantile for the output file names (e.g. 'q05' for 0.05, 'q975' for 0.975).
+
+    :param q: float between 0 and 1
+    :return: string with the name
+    """
+    digits = "{:.3f}".format(q).split(".")[1].rstrip("0")
+    return "q" + (digits if len(digits) > 1 else digits + "0")
+
+
+def monte_carlo_tile(month, p_tile, f_el_tile, s_tile, samples, precip_error):
+    """
+    Calculates the statistics of the total R factor samples of the cells of a tile.
+
+    :param month: float, month (in number format)
+    :param p_tile: np.array (cells) with the precipitation of the cells of the tile with data
+    :param f_el_tile: np.array (cells) with the f(E,L) values of the same cells
+    :param s_tile: np.array (cells) with the snow melt of the same cells
+    :param samples: dictionary with the parameter samples (see 'draw_samples')
+    :param precip_error: np.array (samples) with the precipitation error of each sample for the month
+    :return: PixelStatistics of the cells
+    """
+    n_samples = samples["a"].shape[0]
+    chunk_size = max(1, int(config_input.mc_chunk_size))
+    statistics = PixelStatistics(p_tile.shape[0], config_input.mc_histogram_bins)
+    # Two buffers: precipitation samples (then total R factor samples) and R factor samples
+    buffers = np.empty((2, min(chunk_size, n_samples), p_tile.shape[0]), dtype=np.float32)
+    for start in range(0, n_samples, chunk_size):
+        chunk = slice(start, min(start + chunk_size, n_samples))
+        n_chunk = chunk.stop - chunk.start
+        p_samples = np.multiply(p_tile, precip_error[chunk, None], out=buffers[0, :n_chunk])
+        r_samples = Rfactor_main.rfactor(month, p_samples, f_el_tile, out=buffers[1, :n_chunk],
+                                         a=samples["a"][chunk, None], b=samples["b"][chunk, None])
+        total = total_R_factor.total_factor(s_tile, r_samples, samples["snow_factor"][chunk, None],
+                                            out=buffers[0, :n_chunk])
+        # Samples with an invalid result (e.g. a negative power base) are not counted (see PixelStatistics.update)
+        statistics.update(total)
+    return statistics
+
+
+def run_monte_carlo(date_list):
+    """
+    Runs the Monte Carlo uncertainty propagation of the total R factor for each month in date_list, from the rain
+    (precipitation), f(E,L) and snow melt rasters, and saves the mean, standard deviation and quantile rasters.
+
+    :param date_list: list with analysis dates (in datetime format)
+    :return: ---
+    """
+    n_samples = int(config_input.mc_samples)
+    all_months = file_management.get_date_list(config_input.start_date, config_input.end_date)
+    samples = draw_samples(n_samples, len(all_months), config_input.mc_seed)
+    month_number = {d.strftime('%Y%m'): i for i, d in enumerate(all_months)}
+    folder = os.path.join(config_input.results_path, "monte_carlo")
+    file_management.create_folder(folder)
+
+    f_el_raster = gdal.Open(config_input.fEL_path)
+    f_el_band = f_el_raster.GetRasterBand(1)
+    for date in date_list:
+        month = date.strftime('%Y%m')
+        print("Monte Carlo uncertainty of the total R factor for {} ({} samples)".format(month, n_samples))
+        p_path = file_management.get_month_file(file_management.rain_raster_path, date, "rain")
+        s_path = file_management.get_month_file(file_management.snow_melt_path, date, "snow melt")
+        raster_calc.check_input_rasters(p_path, config_input.fEL_path)
+        gt, proj = raster_calc.get_raster_data(p_path)
+        p_raster = gdal.Open(p_path)
+        s_raster = gdal.Open(s_path)
+        if (s_raster.RasterXSize, s_raster.RasterYSize) != (p_raster.RasterXSize, p_raster.RasterYSize):
+            sys.exit("The snow melt raster {} does not have the size of the rain raster {}. Check input "
+                     "rasters.".format(s_path, p_path))
+
+        # Output rasters, written tile by tile
+        names = ["mean", "std"] + [quantile_name(q) for q in config_input.mc_quantiles]
+        outputs = {}
+        for name in names:
+            path = os.path.join(folder, f"RFactor_total_{name}_{month}.tif")
+            outputs[name] = (path, raster_calc.create_raster(path, p_raster.RasterXSize, p_raster.RasterYSize, gt,
+                                                             proj))
+
+        precip_error = samples["precipitation"][month_number[month]]
+        for window in tqdm(raster_calc.block_windows(p_path, config_input.mc_block_size), desc="Tiles"):
+            p_tile = raster_calc.band_to_nan_array(p_raster.GetRasterBand(1), window)
+            f_el_tile = raster_calc.band_to_nan_array(f_el_band, window)
+            s_tile = raster_calc.band_to_nan_array(s_raster.GetRasterBand(1), window)
+            valid = np.isfinite(p_tile) & np.isfinite(f_el_tile) & np.isfinite(s_tile)
+
+            results = {name: np.full(p_tile.shape, np.nan, dtype=np.float32) for name in names}
+            if np.any(valid):
+                statistics = monte_carlo_tile(float(date.month), p_tile[valid], f_el_tile[valid], s_tile[valid],
+                                              samples, precip_error)
+                results["mean"][valid] = statistics.average()
+                results["std"][valid] = statistics.std()
+                for q in config_input.mc_quantiles:
+                    results[quantile_name(q)][valid] = statistics.quantile(q)
+            for name in names:
+                outputs[name][1].GetRasterBand(1).WriteArray(results[name], window[0], window[1])
+
+        for path, raster in outputs.values():
+            raster_calc.close_raster(raster, path)
+        outputs = p_raster = s_raster = None
+    f_el_band = f_el_raster = None
+
+
+if __name__ == '__main__':
+    run_monte_carlo(file_management.get_date_list(config_input.start_date, config_input.end_date))
@@ -1,4 +1,9 @@
-""" package_handling.py imports all the needed modules and packages to run the code """
+""" package_handling.py imports all the needed modules and packages to run the code
+
+The heavy packages (gdal, matplotlib.pyplot, pandas, rasterstats, scipy and geo_utils) are not imported directly:
+they are LazyModule objects, which import the package the first time one of its attributes is used. This way, a run
+only imports the packages it actually needs (e.g. matplotlib is only imported if the zonal statistics are plotted).
+"""
 
 # import all needed modules from the python standard library
 try:
@@ -11,28 +16,83 @@ try:
     import datetime
     import calendar
     import re
+    import hashlib
+    import json
+    import importlib
+    import functools
+    import bisect
+    import contextlib
+    import cProfile
 except ModuleNotFoundError as b:
     print('ModuleNotFoundError: Missing basic libraries (required: glob, logging, math, os, sys, time, datetime, '
-          'calendar, re')
+          'calendar, re, hashlib, json, importlib, functools, bisect, contextlib, cProfile')
     print(b)
 
-# import additional python libraries
+
+class LazyModule:
+    """
+    Class for a module which is imported the first time one of its attributes is used.
+
+    Attributes:
+        name: STR with name of the module to import (as in 'import name')
+        message: STR with message to print if the module cannot be imported
+        on_load: FUNCTION which receives the module and is called once, after the module is imported (optional)
+    """
+
+    def __init__(self, name, message, on_load=None):
+        """
+        Assign values to class attributes when a new instance is initiated.
+        :param name: STR with name of the module to import
+        :param message: STR with message to print if the module cannot be imported
+        :param on_load: FUNCTION which receives the module and is called after the module is imported (optional)
+        """
+        self._name = name
+        self._message = message
+        self._on_load = on_load
+        self._module = None
+
+    def _load(self):
+        """Import the module (only the first time the method is called) and return it."""
+        if self._module is None:
+            try:
+                module = importlib.import_module(self._name)
+            except ModuleNotFoundError as e:
+                print(self._message)
+                print(e)
+                raise
+            if self._on_load is not None:
+                self._on_load(module)
+            self._module = module
+        return self._module
+
+    def __getattr__(self, attribute):
+        """Called for all attributes that are not attributes of the LazyModule: import the module and get attribute"""
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        if self._module is None:
+            return "<lazy module '{}' (not imported)>".format(self._name)
+        return repr(self._module)
+
+
+# import additional python libraries: numpy and tqdm are imported directly, the rest when they are first used
 try:
-    import gdal
-    import matplotlib.pyplot as plt
     import numpy as np
-    import pandas as pd
-    import rasterstats as rs
-    import scipy
     from tqdm import tqdm
 except ModuleNotFoundError as e:
-    print('ModuleNotFoundError: Missing fundamental packages (required: gdal, maptlotlib.pyplot, numpy, '
+    print('ModuleNotFoundError: Missing fundamental packages (required: gdal, matplotlib.pyplot, numpy, '
           'pandas, rasterstats, scipy, tqdm')
     print(e)
 
+package_message = 'ModuleNotFoundError: Missing fundamental packages (required: gdal, matplotlib.pyplot, numpy, ' \
+                  'pandas, rasterstats, scipy, tqdm'
+# gdal exceptions are enabled as soon as gdal is imported (as geo_utils does when it is imported)
+gdal = LazyModule('gdal', package_message, on_load=lambda module: module.UseExceptions())
+plt = LazyModule('matplotlib.pyplot', package_message)
+pd = LazyModule('pandas', package_message)
+rs = LazyModule('rasterstats', package_message)
+scipy = LazyModule('scipy', package_message)
+
 # import geo_utils
-try:
-    sys.path.append(os.path.abspath(""))
-    import geo_utils as gu
-except ModuleNotFoundError:
-    print("ModuleNotFoundError: Cannot import geo_utils")
+sys.path.append(os.path.abspath(""))
+gu = LazyModule('geo_utils', "ModuleNotFoundError: Cannot import geo_utils")
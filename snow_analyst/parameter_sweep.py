@@ -0,0 +1,304 @@
+"""
+Parameter sweep (calibration) mode: evaluates all combinations of the values of T_snow, NDSI_min, blue_min and
+snow_factor given in config_input ('sweep_T_snow', 'sweep_NDSI_min', 'sweep_blue_min', 'sweep_snow_factor') in one
+run. The inputs of each month are read once, and each parameter is an extra axis of the arrays of the calculations:
+    1. rain/snow split (T_snow axis): the precipitation and temperature rasters of the month (the inputs of
+        pt_raster_manipulation.py) are read once (see degree_day.read_pt_cube), and the rain and snow of each T_snow
+        value are summed up in the same loop over the time steps.
+    2. resampling: the rain and snow of each T_snow value are resampled to the snap raster grid, clipped to the shape,
+        with the in-memory inverse distance interpolation of wasim_snow.py (same interpolation as resampling.py).
+    3. snow detection (NDSI_min and blue_min axes): the B02, B03 and B11 bands of the sensing date of the month are read
+        once and the snow cover is calculated for each NDSI_min and blue_min combination (as in snow_cover.py). If the
+        snow cover is not calculated from satellite images ('run_snow_cover' is False, or 'snow_cover_composite' is
+        True), the existing snow cover rasters are used and the detection thresholds are not swept.
+    4. snow melt (T_snow, NDSI_min and blue_min axes): the monthly snow balance of snow_melt_main.py, with the snow at
+        the end of the month of each combination carried over to the next month.
+    5. R factor (T_snow axis, see Rfactor_main.rfactor) and total R factor (all axes, with the snow_factor axis, see
+        total_R_factor.total_factor).
+
+Only the cells inside the shape are kept in memory (as a vector for each combination), so memory use is about the number
+of cells x the number of T_snow x NDSI_min x blue_min combinations x 4 arrays (float32).
+
+For each month and combination, the zonal summary (in 'shape_zone') of the snow, the snow cover, the snow melt, the R
+factor and the total R factor is saved in 'parameter_sweep/sweep_summary.csv' in the results folder. The total R factor
+rasters of each combination are only saved if 'sweep_save_rasters' is True (in 'parameter_sweep/combination_<i>', see
+'sweep_combinations.csv' for the parameters of each combination).
+
+The sweep runs independently of the other modules: python parameter_sweep.py
+"""
+
+import warnings
+
+import config_input
+import degree_day
+import file_management
+import raster_calculations as rc
+import snow_cover
+import wasim_snow
+from Rfactor_REM_db import Rfactor_main
+from package_handling import *
+
+
+def sweep_values(values, default):
+    """
+    Gets the values of a swept parameter as a float32 array.
+
+    :param values: list with the values of the parameter (from config_input), or None/empty
+    :param default: value of the parameter to use if no values are given (the value in config_input)
+
+    :return: np.array with the parameter values
+    """
+    if not values:
+        values = [default]
+    return np.asarray(values, dtype=np.float32)
+
+
+def sweep_folder():
+    """
+    Gets the folder with the parameter sweep results (and creates it, if it does not exist).
+
+    :return: path of the 'parameter_sweep' folder in the results folder
+    """
+    folder = os.path.join(config_input.results_path, "parameter_sweep")
+    file_management.create_folder(folder)
+    return folder
+
+
+def zone_cells(shape_path, grid_gt, mask):
+    """
+    Gets the cells inside a zone shapefile, among the cells inside the (clipping) shape.
+
+    :param shape_path: path of the zone shapefile (.shp)
+    :param grid_gt: geotransform of the clipped snap raster grid
+    :param mask: np.array of booleans with True in the cells inside the (clipping) shape
+
+    :return: np.array of booleans with True in the cells (of the mask) which are also inside the zone
+    """
+    rows, cols = mask.shape
+    bounds = [grid_gt[0], grid_gt[3] + grid_gt[5] * rows, grid_gt[0] + grid_gt[1] * cols, grid_gt[3]]
+    zone = gdal.Rasterize("", shape_path, format="MEM", outputBounds=bounds, width=cols, height=rows,
+                          burnValues=[1], initValues=[0], outputType=gdal.GDT_Byte)
+    in_zone = zone.GetRasterBand(1).ReadAsArray() == 1
+    zone = None
+    return in_zone[mask]
+
+
+def split_rain_snow(precipitation, temperature, t_snow):
+    """
+    Sums up the rain and snow of a month for each T_snow value, in one loop over the time steps (as
+    rain_snow_rasters.py: rain if T > T_snow, snow if T < T_snow).
+
+    :param precipitation: np.array (time steps, cells) of precipitation
+    :param temperature: np.array (time steps, cells) of temperature
+    :param t_snow: np.array with the T_snow values
+
+    :return: [np.array (T_snow values, cells) with the rain, np.array (T_snow values, cells) with the snow]
+    """
+    rain = np.zeros((t_snow.shape[0], precipitation.shape[1]), dtype=np.float32)
+    snow = np.zeros_like(rain)
+    threshold = t_snow[:, None]
+    for t in range(precipitation.shape[0]):
+        rain += np.where(temperature[t] > threshold, precipitation[t], 0.)
+        snow += np.where(temperature[t] < threshold, precipitation[t], 0.)
+    return rain, snow
+
+
+def resample_cells(values, valid, gt, grid_gt, mask):
+    """
+    Resamples values of the original (coarse) grid to the cells inside the shape of the snap raster grid, for each value
+    of the first axis (see wasim_snow.get_interpolator).
+
+    :param values: np.array (n, cells with data) with the values of the cells with data of the original grid
+    :param valid: np.array (rows, columns) of booleans with True in the cells with data of the original grid
+    :param gt: geotransform of the original grid
+    :param grid_gt: geotransform of the clipped snap raster grid
+    :param mask: np.array of booleans with True in the cells inside the shape
+
+    :return: np.array (n, cells inside the shape) with the resampled values
+    """
+    index, weights = wasim_snow.get_interpolator(gt, valid, grid_gt, mask)
+    resampled = np.empty((values.shape[0], index.shape[0]), dtype=np.float32)
+    for i in range(values.shape[0]):
+        resampled[i] = np.einsum("ij,ij->i", weights, values[i][index])
+    return resampled
+
+
+def snow_cover_cells(date, folder, mask, ndsi_min, blue_min):
+    """
+    Calculates the snow cover of a month (cells inside the shape) for each NDSI_min and blue_min combination from the
+    satellite image bands of the month (as snow_cover.calculate_snow_cover) or, if folder is None, reads the existing
+    snow cover raster of the month (same snow cover for all combinations).
+
+    :param date: date (in datetime format) of the month
+    :param folder: path of the satellite image folder of the month, or None
+    :param mask: np.array of booleans with True in the cells inside the shape
+    :param ndsi_min: np.array with the NDSI_min values
+    :param blue_min: np.array with the blue_min values
+
+    :return: np.array (NDSI_min values, blue_min values, cells inside the shape) with the snow cover (1 or 0)
+    """
+    if folder is None:
+        cover_path = file_management.get_month_file(file_management.snow_cover_path, date, "snow cover")
+        cover = rc.raster_to_nan_array(cover_path)
+        if cover.shape != mask.shape:
+            sys.exit("The snow cover raster {} does not have the size of the clipped snap raster. Check input "
+                     "rasters.".format(cover_path))
+        cover = np.nan_to_num(cover[mask])
+        return np.broadcast_to(cover, (ndsi_min.shape[0], blue_min.shape[0], cover.shape[0]))
+
+    band2, band3, band11 = snow_cover.get_scene_bands(folder)
+    blue, green, swir = [rc.raster_to_nan_array(band) for band in [band2, band3, band11]]
+    if blue.shape != mask.shape:
+        sys.exit("The satellite image bands in {} do not have the size of the clipped snap raster. Check input "
+                 "rasters.".format(folder))
+    blue, green, swir = blue[mask], green[mask], swir[mask]
+    with np.errstate(all="ignore"):
+        ndsi = (green - swir) / (green + swir)
+    return ((ndsi > ndsi_min[:, None, None]) & (blue > blue_min[None, :, None])).astype(np.float32)
+
+
+def summarize(values, in_zone):
+    """
+    Calculates the zonal summary of the values of each combination (cells inside the zone).
+
+    :param values: np.array (..., cells inside the shape)
+    :param in_zone: np.array of booleans with True in the cells inside the zone
+
+    :return: [np.array (...) with the mean, np.array (...) with the maximum]
+    """
+    zone_values = values[..., in_zone]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)  # zones without data
+        return np.nanmean(zone_values, axis=-1), np.nanmax(zone_values, axis=-1)
+
+
+def save_total_rasters(total, date, mask, gt, proj):
+    """
+    Saves the total R factor raster of a month for each combination.
+
+    :param total: np.array (combinations, cells inside the shape) with the total R factor
+    :param date: date (in datetime format) of the month
+    :param mask: np.array of booleans with True in the cells inside the shape
+    :param gt: geotransform of the clipped snap raster grid
+    :param proj: projection of the clipped snap raster grid
+
+    :return: ---
+    """
+    grid = np.full(mask.shape, np.nan, dtype=np.float32)
+    for i in range(total.shape[0]):
+        folder = os.path.join(sweep_folder(), "combination_{}".format(i))
+        file_management.create_folder(folder)
+        grid[mask] = total[i]
+        rc.save_raster(grid, os.path.join(folder, f"RFactor_total_{date.strftime('%Y%m')}.tif"), gt, proj, np.nan)
+
+
+def total_factor_sweep(snow_melt, r_factor, snow_factor):
+    """
+    Calculates the total R factor for each combination (see total_R_factor.total_factor).
+
+    :param snow_melt: np.array (T_snow, NDSI_min, blue_min, cells) with the snow melt
+    :param r_factor: np.array (T_snow, cells) with the R factor
+    :param snow_factor: np.array with the snow_factor values
+
+    :return: np.array (T_snow, NDSI_min, blue_min, snow_factor, cells) with the total R factor
+    """
+    total = snow_melt[:, :, :, None, :] * snow_factor[:, None]
+    total += r_factor[:, None, None, None, :]
+    return total
+
+
+def run_sweep(date_list):
+    """
+    Runs the parameter sweep for all months in date_list (in order) and saves the zonal summary of each month and
+    parameter combination (and, if 'sweep_save_rasters' is True, the total R factor rasters).
+
+    :param date_list: list with analysis dates (in datetime format)
+
+    :return: pd.DataFrame with the zonal summary of each month and combination
+    """
+    # Satellite image folder of each month (None: use the existing snow cover rasters)
+    if config_input.run_snow_cover and not config_input.snow_cover_composite:
+        si_folders = [os.path.join(config_input.si_folder_path, str(f))
+                      for f in file_management.get_satellite_image_folders(date_list)]
+        ndsi_min = sweep_values(config_input.sweep_NDSI_min, config_input.NDSI_min)
+        blue_min = sweep_values(config_input.sweep_blue_min, config_input.blue_min)
+    else:
+        print("The snow cover is read from the snow cover rasters: NDSI_min and blue_min are not swept.")
+        si_folders = [None] * len(date_list)
+        ndsi_min = sweep_values(None, config_input.NDSI_min)
+        blue_min = sweep_values(None, config_input.blue_min)
+    t_snow = sweep_values(config_input.sweep_T_snow, config_input.T_snow)
+    snow_factor = sweep_values(config_input.sweep_snow_factor, config_input.snow_factor)
+
+    # Parameters of each combination, in the order of the flattened (T_snow, NDSI_min, blue_min, snow_factor) axes
+    grid = np.meshgrid(t_snow, ndsi_min, blue_min, snow_factor, indexing="ij")
+    combinations = pd.DataFrame({"T_snow": grid[0].ravel(), "NDSI_min": grid[1].ravel(), "blue_min": grid[2].ravel(),
+                                 "snow_factor": grid[3].ravel()})
+    combinations.index.name = "combination"
+    combinations.to_csv(os.path.join(sweep_folder(), "sweep_combinations.csv"))
+    print("Parameter sweep: {} combinations for {} months".format(len(combinations), len(date_list)))
+
+    # Grid of the results (snap raster clipped to the shape), zone and f(E,L) (read once)
+    grid_gt, proj, mask = wasim_snow.clip_grid()
+    in_zone = zone_cells(config_input.shape_zone, grid_gt, mask)
+    f_el = rc.raster_to_nan_array(config_input.fEL_path)
+    if f_el.shape != mask.shape:
+        sys.exit("The f(E,L) raster does not have the size of the clipped snap raster. Check input rasters.")
+    f_el = f_el[mask]
+
+    summaries = []
+    snow_end = None
+    for date, folder in zip(date_list, si_folders):
+        print("Parameter sweep for {}".format(date.strftime('%Y%m')))
+        # 1-2. Rain and snow for each T_snow value, resampled to the cells inside the shape: (T_snow, cells)
+        precipitation, temperature, dt_days, valid, header = degree_day.read_pt_cube(date)
+        rain, snow = split_rain_snow(precipitation, temperature, t_snow)
+        del precipitation, temperature
+        gt = rc.get_ascii_gt(header)
+        rain = resample_cells(rain, valid, gt, grid_gt, mask)
+        snow = resample_cells(snow, valid, gt, grid_gt, mask)
+
+        # 3. Snow cover for each NDSI_min, blue_min combination: (NDSI_min, blue_min, cells)
+        cover = snow_cover_cells(date, folder, mask, ndsi_min, blue_min)
+
+        # 4. Snow balance: (T_snow, NDSI_min, blue_min, cells)
+        snow_start = np.broadcast_to(snow[:, None, None, :], (t_snow.shape[0],) + cover.shape).copy()
+        if snow_end is not None:
+            snow_start += snow_end
+        snow_end = snow_start * cover
+        snow_melt = np.subtract(snow_start, snow_end, out=snow_start)
+
+        # 5. R factor (T_snow, cells) and total R factor (T_snow, NDSI_min, blue_min, snow_factor, cells)
+        r_factor = Rfactor_main.rfactor(float(date.month), rain, f_el)
+        total = total_factor_sweep(snow_melt, r_factor, snow_factor)
+
+        # Zonal summaries, flattened in the order of the combinations
+        shape = grid[0].shape
+        snow_mean = summarize(snow, in_zone)[0]
+        melt_mean, melt_max = summarize(snow_melt, in_zone)
+        r_mean, r_max = summarize(r_factor, in_zone)
+        total_mean, total_max = summarize(total, in_zone)
+        cover_pct = summarize(cover, in_zone)[0] * 100
+        summary = combinations.copy()
+        summary.insert(0, "month", date.strftime('%Y%m'))
+        summary["snow_mean"] = np.broadcast_to(snow_mean[:, None, None, None], shape).ravel()
+        summary["snow_cover_pct"] = np.broadcast_to(cover_pct[None, :, :, None], shape).ravel()
+        summary["snow_melt_mean"] = np.broadcast_to(melt_mean[..., None], shape).ravel()
+        summary["snow_melt_max"] = np.broadcast_to(melt_max[..., None], shape).ravel()
+        summary["r_factor_mean"] = np.broadcast_to(r_mean[:, None, None, None], shape).ravel()
+        summary["r_factor_max"] = np.broadcast_to(r_max[:, None, None, None], shape).ravel()
+        summary["total_mean"] = total_mean.ravel()
+        summary["total_max"] = total_max.ravel()
+        summaries.append(summary)
+
+        if config_input.sweep_save_rasters:
+            save_total_rasters(total.reshape(-1, total.shape[-1]), date, mask, grid_gt, proj)
+
+    results = pd.concat(summaries)
+    results.to_csv(os.path.join(sweep_folder(), "sweep_summary.csv"))
+    print("Saved parameter sweep summary: ", os.path.join(sweep_folder(), "sweep_summary.csv"))
+    return results
+
+
+if __name__ == '__main__':
+    run_sweep(file_management.get_date_list(config_input.start_date, config_input.end_date))
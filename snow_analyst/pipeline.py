@@ -0,0 +1,647 @@
+"""
+Dependency-aware pipeline runner with incremental re-execution.
+
+Each module of the analysis is a stage of the pipeline, which declares its input and output files for each month:
+    PT cube (pt_raster_manipulation) -> rain/snow rasters (rain_snow_rasters) -> snow cover (snow_cover or wasim_snow)
+    -> snow melt (snow_melt_main) -> R factor (Rfactor_main) -> total R factor (total_R_factor)
+
+For each month, a stage saves a fingerprint of its input files (path, size and modification time) and of its parameters
+(values from config_input) in 'pipeline_state.json', in the results folder. When the pipeline is run again, a stage
+only recalculates the months whose fingerprint changed (or whose output files do not exist). Since the fingerprint of a
+stage includes the output files of the previous stage, recalculating a month in a stage also recalculates it in all
+following stages, while e.g. changing 'snow_factor' only recalculates the total R factor.
+
+The snow melt stage is 'chained': the snow at the start of each month depends on the snow at the end of the previous
+month, so its inputs include the results of the previous month and the months are calculated in order.
+
+With 'run_parallel', the stages are split into one task per stage and month, which are run in a process pool as soon as
+the tasks they depend on (same month in the upstream stages and, for the snow melt, the previous month) are finished.
+
+NOTES:
+- Only the modules enabled in config_input (run_...) are stages of the pipeline. The input files of the first enabled
+stage are read from the input folders set in config_input.
+- Fingerprints use the size and modification time of the input files (not their content), so a stage which is run
+again makes all following stages run again, even if its results did not change.
+"""
+
+import config_input
+import degree_day
+import file_management
+import instrumentation
+import log
+import pt_raster_manipulation
+import rain_snow_rasters
+import raster_calculations as rc
+import si_date_selection
+import snow_cover
+import total_R_factor
+import wasim_snow
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from Rfactor_REM_db import Rfactor_main
+from package_handling import *
+from snow_melt import snow_melt_main
+
+
+class Stage:
+    """
+    Class for a stage of the pipeline, which runs a module for a list of months.
+
+    Attributes:
+        name: STR with name of the stage (key in the pipeline state file)
+        run: FUNCTION which receives a LIST of months (datetime format) and calculates them
+        inputs: FUNCTION which receives a month (datetime format) and returns a LIST with the input file/folder paths
+        outputs: FUNCTION which receives a month (datetime format) and returns a LIST with the output file/folder paths
+        parameters: DICT with the parameters (from config_input) which affect the results of the stage
+        chained: BOOLEAN, True if each month depends on the results of the previous month (months are run in order,
+                 one at a time)
+        upstream: LIST with the names of the stages whose results (for the same month) are inputs of the stage
+        records_months: BOOLEAN, True if 'run' records each month in the run report itself (see instrumentation.py), so
+                        the months to calculate are run at once
+
+    Methods:
+        fingerprint(date): Returns a hash of the input files and parameters of the stage for a given month.
+        is_complete(date): Checks if all output files of the stage exist for a given month.
+    """
+
+    def __init__(self, name, run, inputs, outputs, parameters=None, chained=False, upstream=None,
+                 records_months=False):
+        """
+        Assign values to class attributes when a new instance is initiated.
+        :param name: STR with name of the stage
+        :param run: FUNCTION which receives a LIST of months (datetime format) and calculates them
+        :param inputs: FUNCTION which receives a month and returns a LIST of input file/folder paths
+        :param outputs: FUNCTION which receives a month and returns a LIST of output file/folder paths
+        :param parameters: DICT with the parameters which affect the results of the stage
+        :param chained: BOOLEAN, True if each month depends on the results of the previous month
+        :param upstream: LIST with the names of the stages whose results (for the same month) are inputs of the stage
+        :param records_months: BOOLEAN, True if 'run' records each month in the run report itself
+        """
+        self.name = name
+        self.run = run
+        self.inputs = inputs
+        self.outputs = outputs
+        self.parameters = parameters if parameters is not None else {}
+        self.chained = chained
+        self.upstream = upstream if upstream is not None else []
+        self.records_months = records_months
+
+    def fingerprint(self, date):
+        """
+        Returns a hash of the input files (path, size and modification time) and parameters of the stage for a month.
+        :param date: DATETIME of month
+        :return: STR with hexadecimal hash
+        """
+        fingerprint = hashlib.sha1()
+        fingerprint.update(json.dumps(self.parameters, sort_keys=True, default=str).encode())
+        for path in sorted(self.inputs(date)):
+            fingerprint.update(file_signature(path).encode())
+        return fingerprint.hexdigest()
+
+    def is_complete(self, date):
+        """
+        Checks if all output files of the stage exist for a month.
+        :param date: DATETIME of month
+        :return: BOOLEAN
+        """
+        return all(os.path.exists(path) for path in self.outputs(date))
+
+
+def file_signature(path):
+    """
+    Function generates a signature (string) of a file with its path, size and modification time. If the path is a
+    folder, the signature includes all files in the folder (and its sub-folders). If the path does not exist, the
+    signature only includes the path.
+
+    :param path: string, file or folder path
+
+    :return: string with file signature
+    """
+    if os.path.isdir(path):
+        signatures = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for f in sorted(files):
+                signatures.append(file_signature(os.path.join(root, f)))
+        return "{}:[{}]".format(path, ";".join(signatures))
+    if not os.path.exists(path):
+        return "{}:missing".format(path)
+    stat = os.stat(path)
+    return "{}:{}:{}".format(path, stat.st_size, stat.st_mtime_ns)
+
+
+def state_path():
+    """
+    Returns the path of the file in which the pipeline state (fingerprint of each stage and month) is saved.
+    :return: string, file path
+    """
+    return os.path.join(config_input.results_path, "pipeline_state.json")
+
+
+def load_state():
+    """
+    Function reads the pipeline state from the results folder. If there is no state file, the state is empty.
+
+    :return: dictionary with {stage name: {YYYYMM: fingerprint}}
+    """
+    if not os.path.exists(state_path()):
+        return {}
+    with open(state_path(), 'r') as f:
+        return json.load(f)
+
+
+def save_state(state):
+    """
+    Function saves the pipeline state to the results folder. The state is first written to a temporary file, so an
+    interrupted run does not leave an incomplete state file.
+
+    :param state: dictionary with {stage name: {YYYYMM: fingerprint}}
+
+    :return: ---
+    """
+    temp_path = state_path() + ".tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(temp_path, state_path())
+
+
+def previous_month(date):
+    """
+    Returns the first day of the month before the input date.
+    :param date: date (in datetime format)
+    :return: date (in datetime format)
+    """
+    return (date.replace(day=1) - datetime.timedelta(days=1)).replace(day=1)
+
+
+def month(d):
+    """
+    Returns the month of a date in YYYYMM format.
+    :param d: date (in datetime format) of the month
+    :return: string with the month
+    """
+    return d.strftime('%Y%m')
+
+
+def pt_folder(d):
+    """
+    Returns the folder with the .csv files of a month (the PT folder itself if the .csv files are directly in it,
+    one month only).
+    :param d: date (in datetime format) of the month
+    :return: path
+    """
+    folder = os.path.join(config_input.PT_path, month(d))
+    if not os.path.exists(folder) and glob.glob(config_input.PT_path + "/*.csv"):
+        folder = config_input.PT_path
+    return folder
+
+
+def snow_raster(d):
+    """
+    Returns the path of the snow raster of a month.
+    :param d: date (in datetime format) of the month
+    :return: path
+    """
+    if config_input.run_rain_snow_rasters:
+        return os.path.join(file_management.snow_raster_path, f'Snow_{month(d)}.tif')
+    return file_management.get_month_file(file_management.snow_raster_path, d, "snow")
+
+
+def rain_raster(d):
+    """
+    Returns the path of the rain raster of a month.
+    :param d: date (in datetime format) of the month
+    :return: path
+    """
+    if config_input.run_rain_snow_rasters:
+        return os.path.join(file_management.rain_raster_path, f'Rain_{month(d)}.tif')
+    return file_management.get_month_file(file_management.rain_raster_path, d, "rain")
+
+
+def snow_cover_raster(d):
+    """
+    Returns the path of the snow cover raster of a month (from satellite images or from WaSim).
+    :param d: date (in datetime format) of the month
+    :return: path
+    """
+    if config_input.run_snow_cover:
+        return os.path.join(file_management.snow_cover_path, f'SnowCover_{month(d)}.tif')
+    if config_input.run_wasim_snow:
+        return os.path.join(file_management.snow_cover_path, f'Snow_WaSim_binary_{month(d)}.tif')
+    return file_management.get_month_file(file_management.snow_cover_path, d, "snow cover")
+
+
+def snow_end_raster(d):
+    """
+    Returns the path of the raster with the snow at the end of a month.
+    :param d: date (in datetime format) of the month
+    :return: path
+    """
+    return os.path.join(config_input.results_path, 'Snow_end_month', f'snow_end_month_{month(d)}.tif')
+
+
+def snow_melt_raster(d):
+    """
+    Returns the path of the snow melt raster of a month.
+    :param d: date (in datetime format) of the month
+    :return: path
+    """
+    if config_input.run_snow_melt:
+        return os.path.join(file_management.snow_melt_path, f'snowmelt_{month(d)}.tif')
+    return file_management.get_month_file(file_management.snow_melt_path, d, "snow melt")
+
+
+def r_factor_raster(d):
+    """
+    Returns the path of the R factor (precipitation) raster of a month.
+    :param d: date (in datetime format) of the month
+    :return: path
+    """
+    if config_input.run_r_factor:
+        return os.path.join(file_management.r_factor_path, f'RFactor_REM_db_{month(d)}.tif')
+    return file_management.get_month_file(file_management.r_factor_path, d, "R factor")
+
+
+def stage_outputs(name, d):
+    """
+    Returns the output files (or folders) of a stage for a month. The output files of the stages are only defined
+    here, and are used by the pipeline stages (see 'build_stages'), the checkpoints (checkpoints.py) and the run report
+    (instrumentation.py).
+    :param name: string, name of the stage
+    :param d: date (in datetime format) of the month
+    :return: list with the output paths, or None if the stage has no output files per month (e.g. 'climatology')
+    """
+    outputs = {
+        "pt_manipulation": lambda: [os.path.join(config_input.PT_path, month(d))],
+        "rain_snow_rasters": lambda: [snow_raster(d), rain_raster(d)],
+        "snow_cover": lambda: [snow_cover_raster(d)],
+        "wasim_snow": lambda: [os.path.join(config_input.results_path, 'wasim', f'Snow_WaSim_{month(d)}.tif'),
+                               snow_cover_raster(d)],
+        "snow_melt": lambda: [snow_end_raster(d), snow_melt_raster(d)] + (
+            [degree_day.state_path(d)] if config_input.snow_melt_model == 'degree_day' else []),
+        "r_factor": lambda: [r_factor_raster(d)],
+        "total_factor": lambda: [os.path.join(file_management.total_factor_path, f'RFactor_total_{month(d)}.tif')],
+    }
+    if name not in outputs:
+        return None
+    return outputs[name]()
+
+
+def build_stages(date_list):
+    """
+    Function generates the pipeline stages for the modules enabled in config_input, in the order in which they must
+    be run.
+
+    :param date_list: list with analysis dates (in datetime format)
+
+    :return: list with the pipeline stages (Stage instances)
+    """
+    stages = []
+
+    # 1. PT cube: .csv files with precipitation and temperature per cell
+    if config_input.run_pt_manipulation:
+        stages.append(Stage(
+            name="pt_manipulation",
+            run=lambda dates: [pt_raster_manipulation.generate_csv(d) for d in dates],
+            inputs=lambda d: file_management.get_PT_datefiles(config_input.precipitation_path, d) +
+                             file_management.get_PT_datefiles(config_input.temperature_path, d),
+            outputs=lambda d: stage_outputs("pt_manipulation", d)))
+
+    # 2. Rain and snow rasters
+    if config_input.run_rain_snow_rasters:
+        def run_rain_snow(dates):
+            set_ascii_data(dates[0])
+            for d in dates:
+                rain_snow_rasters.generate_rain_snow_rasters(pt_folder(d))
+
+        stages.append(Stage(
+            name="rain_snow_rasters",
+            run=run_rain_snow,
+            inputs=lambda d: [pt_folder(d), config_input.snapraster_path, config_input.shape_path],
+            outputs=lambda d: stage_outputs("rain_snow_rasters", d),
+            parameters={"T_snow": config_input.T_snow, "precip_index": config_input.precip_index,
+                        "precip_index_step": config_input.precip_index_step},
+            upstream=["pt_manipulation"]))
+
+    # 3. Snow cover from satellite images or from WaSim snow storage
+    if config_input.run_snow_cover and config_input.snow_cover_composite:
+        si_all = os.listdir(config_input.si_folder_path)
+        si_paths = lambda d: [os.path.join(config_input.si_folder_path, str(f)) for f in
+                              si_date_selection.window_sensing_dates(si_all, d, config_input.composite_window_days)[0]]
+        stages.append(Stage(
+            name="snow_cover",
+            run=lambda dates: [snow_cover.calculate_snow_cover_composite(d, si_all) for d in dates],
+            inputs=lambda d: si_paths(d) + [config_input.shape_path],
+            outputs=lambda d: stage_outputs("snow_cover", d),
+            parameters={"NDSI_min": config_input.NDSI_min, "blue_min": config_input.blue_min,
+                        "run_satellite_image_clip_merge": config_input.run_satellite_image_clip_merge,
+                        "image_list": config_input.image_list,
+                        "composite_window_days": config_input.composite_window_days,
+                        "composite_decay_days": config_input.composite_decay_days}))
+    elif config_input.run_snow_cover:
+        si_folders = dict(zip([month(d) for d in date_list], file_management.get_satellite_image_folders(date_list)))
+        si_path = lambda d: os.path.join(config_input.si_folder_path, str(si_folders[month(d)]))
+        stages.append(Stage(
+            name="snow_cover",
+            run=lambda dates: [snow_cover.calculate_snow_cover(si_path(d), d) for d in dates],
+            inputs=lambda d: [si_path(d), config_input.shape_path],
+            outputs=lambda d: stage_outputs("snow_cover", d),
+            parameters={"NDSI_min": config_input.NDSI_min, "blue_min": config_input.blue_min,
+                        "run_satellite_image_clip_merge": config_input.run_satellite_image_clip_merge,
+                        "image_list": config_input.image_list}))
+    if config_input.run_wasim_snow:
+        stages.append(Stage(
+            name="wasim_snow",
+            run=wasim_snow.process_wasim_results,
+            # Monthly, daily or hourly WaSim rasters (the daily/hourly rasters of each month are aggregated)
+            inputs=lambda d: file_management.get_catalog(config_input.snow_wasim_path, ".txt").month_files(d) + [
+                config_input.snapraster_path, config_input.shape_path],
+            outputs=lambda d: stage_outputs("wasim_snow", d),
+            parameters={"wasim_in_memory": config_input.wasim_in_memory}))
+
+    # 4. Snow melt: each month depends on the snow at the end of the previous month
+    if config_input.run_snow_melt and config_input.snow_melt_model == 'degree_day':
+        # Degree-day model: the inputs are the precipitation and temperature rasters and the previous month's snow state
+        def degree_day_inputs(d):
+            inputs = file_management.get_PT_datefiles(config_input.precipitation_path, d) + \
+                     file_management.get_PT_datefiles(config_input.temperature_path, d)
+            if d > date_list[0]:
+                inputs.append(degree_day.state_path(previous_month(d)))
+            return inputs
+
+        stages.append(Stage(
+            name="snow_melt",
+            run=lambda dates: [degree_day.process_degree_day_month(d) for d in dates],
+            inputs=degree_day_inputs,
+            outputs=lambda d: stage_outputs("snow_melt", d),
+            parameters={"T_snow": config_input.T_snow, "T_melt": config_input.T_melt,
+                        "degree_day_factor": config_input.degree_day_factor},
+            chained=True))
+    elif config_input.run_snow_melt:
+        def snow_melt_inputs(d):
+            inputs = [snow_raster(d), snow_cover_raster(d)]
+            if d > date_list[0]:
+                inputs.append(snow_end_raster(previous_month(d)))
+            return inputs
+
+        def run_snow_melt(dates):
+            for d in dates:
+                snow_melt_main.process_snow_melt_month(d)
+
+        stages.append(Stage(
+            name="snow_melt",
+            run=run_snow_melt,
+            inputs=snow_melt_inputs,
+            outputs=lambda d: stage_outputs("snow_melt", d),
+            chained=True,
+            upstream=["rain_snow_rasters", "snow_cover", "wasim_snow"]))
+
+    # 5. R factor
+    if config_input.run_r_factor:
+        stages.append(Stage(
+            name="r_factor",
+            run=Rfactor_main.calculate_REM_db,
+            inputs=lambda d: [rain_raster(d), config_input.fEL_path],
+            outputs=lambda d: stage_outputs("r_factor", d),
+            upstream=["rain_snow_rasters"],
+            records_months=True))
+
+    # 6. Total R factor
+    if config_input.run_total_factor:
+        stages.append(Stage(
+            name="total_factor",
+            run=total_R_factor.calculate_tot_R,
+            inputs=lambda d: [r_factor_raster(d), snow_melt_raster(d)],
+            outputs=lambda d: stage_outputs("total_factor", d),
+            parameters={"snow_factor": config_input.snow_factor},
+            upstream=["r_factor", "snow_melt"],
+            records_months=True))
+
+    return stages
+
+
+def set_ascii_data(date):
+    """
+    Function sets the original (ASCII) raster information in config_input, needed to generate the rain and snow
+    rasters, if the PT manipulation stage did not run for any month (and thus did not set it).
+
+    :param date: date (in datetime format) of any month in the analysis date range
+
+    :return: ---
+    """
+    if len(config_input.ascii_data) == 0:
+        precip_files = file_management.get_PT_datefiles(config_input.precipitation_path, date)
+        config_input.ascii_data = rc.get_ascii_data(precip_files[0])
+
+
+def run_pipeline(date_list, incremental=True):
+    """
+    Function runs all pipeline stages, in order, for the months in date_list. If incremental is True, each stage only
+    calculates the months whose fingerprint changed since the last run or whose results are missing.
+
+    :param date_list: list with analysis dates (in datetime format)
+    :param incremental: boolean, if False all months are calculated in all stages
+
+    :return: dictionary with {stage name: list with calculated months (YYYYMM)}
+    """
+    state = load_state()
+    calculated = {}
+    for stage in build_stages(date_list):
+        stage_state = state.setdefault(stage.name, {})
+        calculated[stage.name] = []
+
+        if stage.chained:
+            # Months are checked and run one at a time, since each month's fingerprint includes the results of the
+            # previous month
+            for date in date_list:
+                key = date.strftime('%Y%m')
+                fingerprint = stage.fingerprint(date)
+                if incremental and stage_state.get(key) == fingerprint and stage.is_complete(date):
+                    continue
+                with instrumentation.stage(stage.name, date):
+                    stage.run([date])
+                stage_state[key] = fingerprint
+                calculated[stage.name].append(key)
+                save_state(state)
+        else:
+            fingerprints = {}
+            for date in date_list:
+                key = date.strftime('%Y%m')
+                fingerprint = stage.fingerprint(date)
+                if not incremental or stage_state.get(key) != fingerprint or not stage.is_complete(date):
+                    fingerprints[key] = (date, fingerprint)
+            if stage.records_months and fingerprints:
+                # All months at once (e.g. the f(E,L) raster is read once), each month is recorded by the stage itself
+                stage.run([d for d, f in fingerprints.values()])
+                for key, (date, fingerprint) in fingerprints.items():
+                    stage_state[key] = fingerprint
+                    calculated[stage.name].append(key)
+            elif stage.name == "wasim_snow" and config_input.wasim_in_memory and config_input.wasim_workers > 1 and \
+                    fingerprints:
+                # The WaSim months are resampled in parallel, so they are run at once (one shared record per month)
+                with instrumentation.stage(stage.name, [d for d, f in fingerprints.values()]):
+                    stage.run([d for d, f in fingerprints.values()])
+                for key, (date, fingerprint) in fingerprints.items():
+                    stage_state[key] = fingerprint
+                    calculated[stage.name].append(key)
+            else:
+                for key, (date, fingerprint) in fingerprints.items():
+                    with instrumentation.stage(stage.name, date):
+                        stage.run([date])
+                    stage_state[key] = fingerprint
+                    calculated[stage.name].append(key)
+            if fingerprints:
+                save_state(state)
+
+        if calculated[stage.name]:
+            print("Pipeline stage '{}': calculated {} of {} months.".format(stage.name, len(calculated[stage.name]),
+                                                                            len(date_list)))
+        else:
+            print("Pipeline stage '{}': all months are up to date.".format(stage.name))
+
+    # Zonal statistics of the snow at the end of the month, if the snow melt was calculated again
+    if calculated.get("snow_melt"):
+        snow_melt_main.snow_melt_statistics([[d.strftime('%Y%m')] for d in date_list])
+
+    return calculated
+
+
+# Pipeline stages in each worker process of 'run_parallel' (set by 'init_worker')
+worker_stages = {}
+
+
+def init_worker(date_list, profiling=False):
+    """
+    Function initializes each worker process of 'run_parallel': initializes the ascii data and generates the pipeline
+    stages, so each task only needs the stage name and date.
+
+    :param date_list: list with analysis dates (in datetime format)
+    :param profiling: boolean, True to profile the snow melt functions in the worker (see snow_melt/log.py)
+
+    :return: ---
+    """
+    global worker_stages
+    log.set_profiling(profiling)
+    config_input.initialize_ascii()
+    worker_stages = {stage.name: stage for stage in build_stages(date_list)}
+
+
+def run_task(stage_name, date):
+    """
+    Function runs one month of a pipeline stage in a worker process.
+
+    :param stage_name: string, name of the stage
+    :param date: date (in datetime format) of the month to calculate
+
+    :return: [float, time (in seconds) the task took to run, dictionary with the record of the task (see
+    instrumentation.py) or None if 'run_report' is False, dictionary with the profile of the snow melt functions called
+    by the task (see log.take_profile)]
+    """
+    task_start = time.time()
+    with instrumentation.stage(stage_name, date) as record:
+        worker_stages[stage_name].run([date])
+    return time.time() - task_start, record, log.take_profile()
+
+
+def run_parallel(date_list, workers, incremental=True):
+    """
+    Function runs the pipeline as a graph of tasks (one per stage and month) in a pool of 'workers' processes. A task
+    is started as soon as the tasks it depends on are finished: the same month in the upstream stages and, for chained
+    stages (snow melt), the previous month. If incremental is True, tasks whose fingerprint did not change since the
+    last run (and whose results exist) are not run. If any task fails, no new tasks are started, and the program exits
+    after the running tasks are finished.
+
+    :param date_list: list with analysis dates (in datetime format)
+    :param workers: int, number of worker processes
+    :param incremental: boolean, if False all tasks are run
+
+    :return: dictionary with {stage name: list with calculated months (YYYYMM)}
+    """
+    run_start = time.time()
+    stages = build_stages(date_list)
+    stage_names = [stage.name for stage in stages]
+    stages = dict(zip(stage_names, stages))
+    dates = {d.strftime('%Y%m'): d for d in date_list}
+    months = list(dates.keys())
+
+    # Tasks and the tasks they depend on
+    dependencies = {}
+    for name, stage in stages.items():
+        for i, key in enumerate(months):
+            task_dependencies = [(upstream, key) for upstream in stage.upstream if upstream in stages]
+            if stage.chained and i > 0:
+                task_dependencies.append((name, months[i - 1]))
+            dependencies[(name, key)] = task_dependencies
+
+    state = load_state()
+    summary = {name: {"calculated": 0, "up_to_date": 0, "time": 0.} for name in stage_names}
+    calculated = {name: [] for name in stage_names}
+    pending = set(dependencies.keys())
+    done = set()
+    running = {}
+    failed = []
+
+    print("Running {} tasks ({} stages, {} months) with {} worker processes.".format(
+        len(pending), len(stages), len(months), workers))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(list(date_list), log.profiling)) as executor:
+        while pending or running:
+            # Start all tasks whose dependencies are finished (earliest months first). Up to date tasks are finished
+            # directly, which can make other tasks ready
+            ready = True
+            while ready and not failed:
+                ready = sorted([t for t in pending if all(d in done for d in dependencies[t])],
+                               key=lambda t: (t[1], stage_names.index(t[0])))
+                for task in ready:
+                    pending.remove(task)
+                    name, key = task
+                    fingerprint = stages[name].fingerprint(dates[key])
+                    if incremental and state.get(name, {}).get(key) == fingerprint and \
+                            stages[name].is_complete(dates[key]):
+                        done.add(task)
+                        summary[name]["up_to_date"] += 1
+                        continue
+                    running[executor.submit(run_task, name, dates[key])] = (task, fingerprint)
+                ready = [t for t in ready if t in done]
+
+            if not running:
+                break
+
+            # Wait for any running task to finish
+            finished, not_finished = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+            for future in finished:
+                (name, key), fingerprint = running.pop(future)
+                if future.exception() is not None:
+                    failed.append((name, key, future.exception()))
+                    print("Task '{}' for {} failed: {}".format(name, key, future.exception()))
+                    continue
+                task_time, record, profile = future.result()
+                log.merge_profile(profile)
+                done.add((name, key))
+                state.setdefault(name, {})[key] = fingerprint
+                calculated[name].append(key)
+                summary[name]["calculated"] += 1
+                summary[name]["time"] += task_time
+                if record is not None:
+                    instrumentation.records.append(record)
+                print("[{}/{}] Finished '{}' for {} ({:.1f} s)".format(
+                    len(done), len(dependencies), name, key, task_time))
+            save_state(state)
+
+    # Progress summary
+    print("\n{:<20}{:>12}{:>12}{:>16}".format("Stage", "Calculated", "Up to date", "Task time (s)"))
+    for name in stage_names:
+        print("{:<20}{:>12}{:>12}{:>16.1f}".format(name, summary[name]["calculated"], summary[name]["up_to_date"],
+                                                    summary[name]["time"]))
+    print("Total run time: {:.1f} s ({} of {} tasks finished)".format(time.time() - run_start, len(done),
+                                                                      len(dependencies)))
+
+    if failed:
+        message = "ERROR: {} pipeline task(s) failed (first: '{}' for {}). {} task(s) were not run.".format(
+            len(failed), failed[0][0], failed[0][1], len(pending))
+        sys.exit(message)
+
+    # Zonal statistics of the snow at the end of the month, if the snow melt was calculated again
+    if calculated.get("snow_melt"):
+        snow_melt_main.snow_melt_statistics([[d.strftime('%Y%m')] for d in date_list])
+
+    return calculated
@@ -0,0 +1,188 @@
+"""
+Temperature-binned precipitation index: for each month and cell of the original (coarse) precipitation/temperature
+grid, the precipitation of the month is accumulated by temperature, at the edges of temperature bins (e.g. every 0.1 C
+from -10 C to 10 C, see 'precip_index_range' and 'precip_index_step' in config_input), as two prefix sums:
+    lt[j] = sum of the precipitation with temperature < edge j
+    le[j] = sum of the precipitation with temperature <= edge j
+The index is built once per month from the .csv files of pt_raster_manipulation.py (one pass over the files) and saved
+in the 'precip_index' folder in the results folder. The rain and snow of the month for any T_snow on a bin edge are then
+a lookup of one value per cell, with the same result as rain_snow_rasters.py:
+    snow = lt[T_snow]               (temperature < T_snow)
+    rain = total - le[T_snow]       (temperature > T_snow)
+A T_snow between two edges is rounded to the closest edge, and a T_snow outside the index range is an error.
+
+If 'precip_index' in config_input is True, rain_snow_rasters.py uses the index (building it, if it does not exist or if
+the .csv files changed), so a run with a different T_snow does not read the .csv files again.
+"""
+
+import config_input
+import file_management
+from package_handling import *
+
+
+def index_edges():
+    """
+    Gets the temperature bin edges of the index.
+
+    :return: np.array with the temperature bin edges (C)
+    """
+    t_min, t_max = config_input.precip_index_range
+    n_edges = int(round((t_max - t_min) / config_input.precip_index_step)) + 1
+    return np.round(t_min + np.arange(n_edges) * config_input.precip_index_step, 6)
+
+
+def index_path(month):
+    """
+    Gets the path of the index of a month (and creates the 'precip_index' folder, if it does not exist).
+
+    :param month: string with the month (YYYYMM)
+    :return: path of the .npz index file
+    """
+    folder = os.path.join(config_input.results_path, "precip_index")
+    file_management.create_folder(folder)
+    return os.path.join(folder, "precip_index_{}.npz".format(month))
+
+
+def csv_month(filenames):
+    """
+    Gets the month of the .csv files of a folder from the year and month columns of the first file (as
+    rain_snow_rasters.py does).
+
+    :param filenames: list with the .csv file paths (at least one)
+    :return: string with the month (YYYYMM)
+    """
+    station_file = np.array(pd.read_csv(filenames[0], delimiter=',', nrows=2))
+    return "{}{:02d}".format(int(station_file[1, 0]), int(station_file[1, 1]))
+
+
+def csv_files(path):
+    """
+    Gets the .csv files of a folder, and checks that there is at least one.
+
+    :param path: folder path where the .csv files (one for each cell in the original rasters) are located
+    :return: list with the .csv file paths
+    """
+    filenames = glob.glob(path + "/*.csv")
+    if len(filenames) == 0:
+        message = "ERROR: Input folder '{}' has no .csv files.".format(path)
+        sys.exit(message)
+    return filenames
+
+
+def source_signature(filenames):
+    """
+    Gets a signature of the .csv files of a month (names, sizes and modification times), to check if the index is up to
+    date.
+
+    :param filenames: list with the .csv file paths
+    :return: string with the signature (SHA-1)
+    """
+    signature = hashlib.sha1()
+    for file in sorted(filenames):
+        stat = os.stat(file)
+        signature.update("{}|{}|{};".format(os.path.basename(file), stat.st_size, stat.st_mtime_ns).encode("utf-8"))
+    return signature.hexdigest()
+
+
+def build_index(path):
+    """
+    Builds the index of a month from the .csv files with the precipitation and temperature of each cell (the input of
+    rain_snow_rasters.py), and saves it.
+
+    :param path: folder path where the .csv files (one for each cell in the original rasters) of the month are located
+    :return: dictionary with the index (see 'load_index')
+    """
+    filenames = csv_files(path)
+    edges = index_edges()
+    n_edges = edges.shape[0]
+    rows = np.empty(len(filenames), dtype=np.int32)
+    cols = np.empty(len(filenames), dtype=np.int32)
+    lt = np.empty((n_edges, len(filenames)), dtype=np.float64)
+    le = np.empty_like(lt)
+    total = np.empty(len(filenames), dtype=np.float64)
+
+    d = "Building precipitation index for date: " + os.path.basename(path)
+    for f in tqdm(range(0, len(filenames)), desc=d):
+        station_file = np.array(pd.read_csv(filenames[f], delimiter=','))
+        precipitation = station_file[:, 6]
+        temperature = station_file[:, 7]
+        # Each precipitation value is added to the prefix sums of all edges above (lt) / from (le) its temperature
+        lt[:, f] = np.cumsum(np.bincount(np.searchsorted(edges, temperature, side='right'), weights=precipitation,
+                                         minlength=n_edges + 1))[:n_edges]
+        le[:, f] = np.cumsum(np.bincount(np.searchsorted(edges, temperature, side='left'), weights=precipitation,
+                                         minlength=n_edges + 1))[:n_edges]
+        total[f] = np.sum(precipitation)
+        rows[f] = int(station_file[0, 8])
+        cols[f] = int(station_file[0, 9])
+
+    month = csv_month(filenames)
+    index = {"edges": edges, "lt": lt, "le": le, "total": total, "rows": rows, "cols": cols,
+             "shape": np.array([int(config_input.ascii_data[1]), int(config_input.ascii_data[0])]),
+             "month": month, "source": source_signature(filenames)}
+    target = index_path(month)
+    with open(target + ".tmp", "wb") as file:
+        np.savez_compressed(file, **index)
+    os.replace(target + ".tmp", target)
+    return index
+
+
+def load_index(path):
+    """
+    Loads the index of a month or, if it does not exist, if the .csv files of the month changed or if the temperature
+    bins in config_input changed, builds it (see 'build_index').
+
+    :param path: folder path where the .csv files of the month are located
+    :return: dictionary with the index: 'edges' (temperature bin edges), 'lt' and 'le' (prefix sums, (edges, cells)),
+    'total' (total precipitation of each cell), 'rows' and 'cols' (row and column of each cell in the original grid),
+    'shape' (rows and columns of the original grid), 'month' (YYYYMM) and 'source' (signature of the .csv files)
+    """
+    filenames = csv_files(path)
+    target = index_path(csv_month(filenames))
+    if os.path.exists(target):
+        with np.load(target) as data:
+            index = {key: data[key] for key in data.files}
+        index["month"] = str(index["month"])
+        index["source"] = str(index["source"])
+        if index["source"] == source_signature(filenames) and \
+                np.array_equal(index["edges"], index_edges()):
+            return index
+    return build_index(path)
+
+
+def edge_position(edges, t_snow):
+    """
+    Gets the position of the bin edge closest to a temperature threshold.
+
+    :param edges: np.array with the temperature bin edges of the index
+    :param t_snow: float, temperature threshold (C)
+    :return: int, index of the closest edge
+    """
+    step = edges[1] - edges[0] if edges.shape[0] > 1 else 1.
+    if t_snow < edges[0] - step / 2 or t_snow > edges[-1] + step / 2:
+        message = "ERROR: T_snow = {} is outside of the precipitation index range [{}, {}]. Check " \
+                  "'precip_index_range' in config_input.".format(t_snow, edges[0], edges[-1])
+        sys.exit(message)
+    position = int(np.argmin(np.abs(edges - t_snow)))
+    if not math.isclose(edges[position], t_snow, abs_tol=1e-6):
+        print("T_snow = {} is rounded to the closest precipitation index bin edge ({}).".format(t_snow,
+                                                                                             edges[position]))
+    return position
+
+
+def rain_snow(index, t_snow, no_data=None):
+    """
+    Gets the rain and snow of the month for a temperature threshold, as rasters of the original grid.
+
+    :param index: dictionary with the index of the month (see 'load_index')
+    :param t_snow: float, temperature threshold (C): snow if the temperature is below it, rain if it is above it
+    :param no_data: value of the cells without data (default: no data value of the original rasters)
+    :return: [np.array with the rain, np.array with the snow], with the shape of the original grid
+    """
+    if no_data is None:
+        no_data = config_input.ascii_data[5]
+    j = edge_position(index["edges"], t_snow)
+    rain = np.full(tuple(index["shape"]), no_data, dtype=np.float64)
+    snow = np.full(tuple(index["shape"]), no_data, dtype=np.float64)
+    rain[index["rows"], index["cols"]] = index["total"] - index["le"][j]
+    snow[index["rows"], index["cols"]] = index["lt"][j]
+    return rain, snow
@@ -118,13 +118,10 @@ def generate_csv(date):
     save_folder = os.path.join(config_input.PT_path, str(date.strftime('%Y%m')))
     file_management.create_folder(save_folder)
 
-    # Get all txt files in the path directory, and save them in a list
-    filenames_precip = glob.glob(config_input.precipitation_path + "/*.txt")
-    filenames_temp = glob.glob(config_input.temperature_path + "/*.txt")
-
-    # -- Extract from the input folder the files that correspond to the analysis date
-    filenames_precip = file_management.get_PT_datefiles(filenames_precip, date)
-    filenames_temp = file_management.get_PT_datefiles(filenames_temp, date)
+    # -- Extract from the input folders the txt files that correspond to the analysis date (each folder is only scanned
+    # once, for all analysis dates)
+    filenames_precip = file_management.get_PT_datefiles(config_input.precipitation_path, date)
+    filenames_temp = file_management.get_PT_datefiles(config_input.temperature_path, date)
 
     # -- Check the input files:
     file_management.compare_dates(
@@ -26,18 +26,19 @@ in the original raster  and must contain the following information: year-month-d
 
 import config_input
 import file_management
+import precip_index
 import raster_calculations as rc
 import resampling
 from package_handling import *
 
 
-def generate_rain_snow_rasters(path):
-    """Reads .csv files with precipitation and temperature rasters and generates a snow and rain raster for the
-    time frame in .csv file (which should be 1 month)
+def sum_rain_snow(path):
+    """Reads the .csv files with precipitation and temperature of each cell and sums up the snow and rain of the time
+    frame in the .csv files (which should be 1 month)
 
     :param path: folder path where .csv files (one for each cell in the original rasters) are located
+    :return: [np.array with the snow, np.array with the rain (original grid), string with the date (YYYYMM)]
     """
-
     # Get all the .csv files in the input folder, and save the names in a list, to iterate through them
     filenames = glob.glob(path + "/*.csv")
 
@@ -76,6 +77,24 @@ def generate_rain_snow_rasters(path):
     date = str(int(station_file[1, 0])) + str(month)
     # print("Date: ", date)
 
+    return result_array_snow, result_array_rain, date
+
+
+def generate_rain_snow_rasters(path):
+    """Reads .csv files with precipitation and temperature rasters and generates a snow and rain raster for the
+    time frame in .csv file (which should be 1 month)
+
+    :param path: folder path where .csv files (one for each cell in the original rasters) are located
+    """
+
+    if config_input.precip_index:
+        # Rain and snow from the temperature-binned precipitation index of the month (built once, see precip_index.py)
+        index = precip_index.load_index(path)
+        result_array_rain, result_array_snow = precip_index.rain_snow(index, config_input.T_snow)
+        date = index["month"]
+    else:
+        result_array_snow, result_array_rain, date = sum_rain_snow(path)
+
     # Get original raster (coarse) data:
     gt_original = rc.get_ascii_gt(config_input.ascii_data)
 
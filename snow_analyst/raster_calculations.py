@@ -1,3 +1,4 @@
+import raster_metadata
 from package_handling import *
 
 """
@@ -14,12 +15,12 @@ def get_snap_raster_data(raster_path):
 
     :return: tuples, with geotransform, tuple with projection, list with snap raster extension, float with cell size
     """
-    raster = gdal.Open(raster_path)  # Extract raster from path
-    gt = raster.GetGeoTransform()  # Get GEOTransform Data: (Top left corner X, cell size, 0, Top left corner Y, 0,
+    raster = raster_metadata.get_metadata(raster_path)  # Raster metadata (only read once per raster)
+    gt = raster.gt  # Get GEOTransform Data: (Top left corner X, cell size, 0, Top left corner Y, 0,
     # -cell size)
-    proj = raster.GetProjection()  # Get projection of raster
-    x_size = raster.RasterXSize  # Number of columns
-    y_size = raster.RasterYSize  # Number of rows
+    proj = raster.proj  # Get projection of raster
+    x_size = raster.x_size  # Number of columns
+    y_size = raster.y_size  # Number of rows
 
     cell_size = gt[1]  # Cell resolution
     ulx = gt[0]  # Upper left X or Xmin
@@ -41,10 +42,10 @@ def get_raster_data(raster_path):
 
     :return: tuples with GEOTransform and projection
     """
-    raster = gdal.Open(raster_path)  # Extract raster from path
-    gt = raster.GetGeoTransform()  # Get GEOTransform Data: (Top left corner X, cell size, 0, Top left corner Y, 0,
+    raster = raster_metadata.get_metadata(raster_path)  # Raster metadata (only read once per raster)
+    gt = raster.gt  # Get GEOTransform Data: (Top left corner X, cell size, 0, Top left corner Y, 0,
     # -cell size)
-    proj = raster.GetProjection()  # Get projection of raster
+    proj = raster.proj  # Get projection of raster
 
     return gt, proj
 
@@ -87,6 +88,82 @@ def raster_to_array(raster_path, mask):
         return array
 
 
+def band_to_nan_array(band, window=None, out=None):
+    """
+    Function reads the data of a raster band (or of a window of the band) into a float32 array in which all no data
+    cells are set to np.nan.
+
+    :param band: gdal raster band
+    :param window: tuple with (x offset, y offset, number of columns, number of rows) of the window to read (optional).
+    If None, the complete band is read.
+    :param out: np.float32 array with the same shape as the band/window, into which to read the raster data (optional).
+    If None, a new array is allocated.
+
+    :return: np.float32 array with np.nan in all no data cells
+
+    Note: as in 'raster_to_array', if the raster has no (or a nan) no data value, all non-finite values are considered
+    no data.
+    """
+    if window is None:
+        window = (0, 0, band.XSize, band.YSize)
+    x_off, y_off, x_size, y_size = window
+    no_data = band.GetNoDataValue()
+
+    if out is None:
+        out = np.empty((y_size, x_size), dtype=np.float32)
+    band.ReadAsArray(x_off, y_off, x_size, y_size, buf_obj=out)
+
+    if no_data is None or math.isnan(no_data):
+        out[~np.isfinite(out)] = np.nan
+    else:
+        out[out == np.float32(no_data)] = np.nan
+    return out
+
+
+def raster_to_nan_array(raster_path, out=None):
+    """
+    Function extracts raster data from input raster file into a float32 array in which all no_data cells are set to
+    np.nan, to be used instead of a masked array in calculations with in-place numpy operations.
+
+    :param raster_path: string, path for .tif raster file
+    :param out: np.float32 array with the same shape as the raster, into which to read the raster data (optional). If
+    None, a new array is allocated.
+
+    :return: np.float32 array with np.nan in all no data cells
+
+    Note: as in 'raster_to_array', if the raster has no (or a nan) no data value, all non-finite values are considered
+    no data.
+    """
+    raster = gdal.Open(raster_path)
+    return band_to_nan_array(raster.GetRasterBand(1), out=out)
+
+
+def block_windows(raster_path, block_size):
+    """
+    Function divides a raster into windows of approximately block_size x block_size cells. The window size is rounded
+    up to a multiple of the raster's (internal) block size, so each window reads complete blocks from file.
+
+    :param raster_path: string, path for .tif raster file
+    :param block_size: int, number of rows and columns in each window
+
+    :return: list with (x offset, y offset, number of columns, number of rows) tuples for each window
+    """
+    raster = gdal.Open(raster_path)
+    x_block, y_block = raster.GetRasterBand(1).GetBlockSize()
+    x_size = raster.RasterXSize
+    y_size = raster.RasterYSize
+
+    # Round window size up to a multiple of the internal block size
+    x_window = int(math.ceil(block_size / x_block)) * x_block if x_block <= block_size else block_size
+    y_window = int(math.ceil(block_size / y_block)) * y_block if y_block <= block_size else block_size
+
+    windows = []
+    for y_off in range(0, y_size, y_window):
+        for x_off in range(0, x_size, x_window):
+            windows.append((x_off, y_off, min(x_window, x_size - x_off), min(y_window, y_size - y_off)))
+    return windows
+
+
 def clip(clip_path, save_path, original_raster):
     """
     Function clips the raster to the same extents as the snap raster (same no-data cells) using gdal.warp
@@ -150,14 +227,14 @@ def compare_extents(raster_path1, raster_path2):
 
     :return: ---
     """
-    # Get raster 1 data:
-    raster1 = gdal.Open(raster_path1)  # Extract raster from path
-    x_size1 = raster1.RasterXSize  # Number of columns
-    y_size1 = raster1.RasterYSize  # Number of rows
-
-    raster2 = gdal.Open(raster_path2)  # Extract raster from path
-    x_size2 = raster2.RasterXSize  # Number of columns
-    y_size2 = raster2.RasterYSize  # Number of rows
+    # Get raster 1 data (from the raster metadata cache):
+    raster1 = raster_metadata.get_metadata(raster_path1)
+    x_size1 = raster1.x_size  # Number of columns
+    y_size1 = raster1.y_size  # Number of rows
+
+    raster2 = raster_metadata.get_metadata(raster_path2)
+    x_size2 = raster2.x_size  # Number of columns
+    y_size2 = raster2.y_size  # Number of rows
 
     if not x_size1 == x_size2 or not y_size1 == y_size2:
         message = "Raster {} and {} have different raster resolutions and/or number of rows and columns. " \
@@ -0,0 +1,163 @@
+"""
+Raster metadata cache: the size, geotransform, projection, no data value and data type of each raster are read once
+(one gdal.Open per raster) and kept in memory, so the checks of the input rasters (e.g. CompareData in snow_melt,
+'compare_extents' in raster_calculations.py and 'check_input_rasters' in Rfactor_raster_calculations.py) do not open
+the same rasters again for each month.
+
+The metadata of a raster is read again if the raster file was modified (different size or modification time), e.g. a
+result raster that is calculated again in the same run.
+
+'validate_rasters' compares a batch of rasters with the snap raster grid (cell size, alignment and projection) and with
+each other (number of rows and columns, origin), and reports all problems at once. It is called for all input rasters
+of a run before any calculation starts (see 'validate_run_inputs' in file_management.py).
+"""
+
+import config_input
+from package_handling import *
+
+
+class RasterMetadata:
+    """
+    Class with the metadata of a raster file.
+
+    Attributes:
+        path: STR with the raster file path
+        x_size: INT with the number of columns
+        y_size: INT with the number of rows
+        bands: INT with the number of bands
+        gt: TUPLE with the geotransform (Top left corner X, cell size, 0, Top left corner Y, 0, -cell size)
+        proj: STR with the projection (wkt)
+        nodata: FLOAT with the no data value of the first band (None if it has no no data value)
+        dtype: STR with the gdal data type of the first band (e.g. 'Float32')
+
+    Methods:
+        cell_size(): Returns the cell size (x resolution) of the raster.
+        extent(): Returns the extent of the raster as [ulx, uly, lrx, lry].
+    """
+
+    def __init__(self, path, raster):
+        """
+        Assign values to class attributes from an open gdal raster dataset.
+        :param path: STR with the raster file path
+        :param raster: gdal.Dataset of the raster
+        """
+        band = raster.GetRasterBand(1)
+        self.path = path
+        self.x_size = raster.RasterXSize
+        self.y_size = raster.RasterYSize
+        self.bands = raster.RasterCount
+        self.gt = raster.GetGeoTransform()
+        self.proj = raster.GetProjection()
+        self.nodata = band.GetNoDataValue()
+        self.dtype = gdal.GetDataTypeName(band.DataType)
+
+    def cell_size(self):
+        """Returns the cell size (x resolution) of the raster."""
+        return self.gt[1]
+
+    def extent(self):
+        """Returns the extent of the raster as a list with [ulx, uly, lrx, lry]."""
+        return [self.gt[0], self.gt[3], self.gt[0] + self.gt[1] * self.x_size, self.gt[3] + self.gt[5] * self.y_size]
+
+
+# Metadata of each raster read in this run: {path: [file size, modification time (ns), RasterMetadata]}
+metadata_cache = {}
+
+
+def get_metadata(path):
+    """
+    Gets the metadata of a raster from the cache or, if it is not in the cache or the file was modified, from the
+    raster file (and saves it in the cache).
+
+    :param path: raster file path
+    :return: RasterMetadata of the raster
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise FileNotFoundError("The raster path {} does not exist.".format(path))
+    key = os.path.abspath(path)
+    entry = metadata_cache.get(key)
+    if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+        return entry[2]
+
+    raster = gdal.Open(path)
+    metadata = RasterMetadata(path, raster)
+    raster = None
+    metadata_cache[key] = [stat.st_size, stat.st_mtime_ns, metadata]
+    return metadata
+
+
+def clear_cache():
+    """Deletes the metadata of all rasters from the cache."""
+    metadata_cache.clear()
+
+
+def snap_grid_problems(metadata, snap):
+    """
+    Compares the grid of a raster with the snap raster grid: the cell size must be the same, the raster origin must be
+    on the snap raster grid (a multiple of the cell size from the snap raster origin, with a tolerance of 1% of the cell
+    size) and the projection must be the same.
+
+    :param metadata: RasterMetadata of the raster to check
+    :param snap: RasterMetadata of the snap raster
+    :return: [list with the errors (cell size, alignment), list with the warnings (projection)]
+    """
+    errors, warnings = [], []
+    name = os.path.basename(metadata.path)
+    cell_size = snap.cell_size()
+    if not np.float32(metadata.cell_size()) == np.float32(cell_size):
+        errors.append("{}: cell size {} differs from the snap raster cell size {}.".format(name, metadata.cell_size(),
+                                                                                           cell_size))
+    else:
+        for i, axis in [(0, "x"), (3, "y")]:
+            offset = (metadata.gt[i] - snap.gt[i]) / cell_size
+            if abs(offset - round(offset)) > 0.01:
+                errors.append("{}: origin {} = {} is not on the snap raster grid (shifted {:.2f} cells).".format(
+                    name, axis, metadata.gt[i], offset - round(offset)))
+    if metadata.proj != snap.proj:
+        warnings.append("{}: projection differs from the snap raster projection.".format(name))
+    return errors, warnings
+
+
+def validate_rasters(paths, snap_path=None):
+    """
+    Validates a batch of rasters, which are used together in the calculations, before any calculation starts: each
+    raster is compared with the snap raster grid (see 'snap_grid_problems'), and all rasters must have the same number
+    of rows and columns and the same origin (within half a cell) as the first raster. The metadata of each raster is
+    only read once (see 'get_metadata').
+
+    :param paths: list with the raster file paths
+    :param snap_path: path of the snap raster (default: snapraster_path in config_input)
+    :return: [list with the errors, list with the warnings], with one message per problem found
+    """
+    if snap_path is None:
+        snap_path = config_input.snapraster_path
+    errors, warnings = [], []
+    if len(paths) == 0:
+        return errors, warnings
+    snap = get_metadata(snap_path)
+
+    reference = None
+    for path in paths:
+        try:
+            metadata = get_metadata(path)
+        except FileNotFoundError as e:
+            errors.append(str(e))
+            continue
+        raster_errors, raster_warnings = snap_grid_problems(metadata, snap)
+        errors += raster_errors
+        warnings += raster_warnings
+
+        if reference is None:
+            reference = metadata
+            continue
+        name = os.path.basename(path)
+        if (metadata.x_size, metadata.y_size) != (reference.x_size, reference.y_size):
+            errors.append("{}: {} rows x {} columns, but {} has {} rows x {} columns.".format(
+                name, metadata.y_size, metadata.x_size, os.path.basename(reference.path), reference.y_size,
+                reference.x_size))
+        elif abs(metadata.gt[0] - reference.gt[0]) > abs(reference.gt[1]) / 2 or \
+                abs(metadata.gt[3] - reference.gt[3]) > abs(reference.gt[5]) / 2:
+            errors.append("{}: extent differs from the extent of {}.".format(name, os.path.basename(reference.path)))
+    return errors, warnings
@@ -85,14 +85,17 @@ def get_raster_points(array, gt):
 def generate_vrt_file(csv_file):
     """
     Function receives a .csv file path, which was created in the "GetRasterPoints" and is then copied to a vrt file.
-    The .csv file MUST BE named "file", since that name is automatically called in the vrt file creation.
+    The .vrt file is saved in the same folder as the .csv file, and refers to the .csv file relative to its location, so
+    several rasters can be resampled at the same time (each with its own .csv file).
 
     :param csv_file: .csv file path with point coordinates (x,y,z) generated in "GetRasterPoints" function
     :return: .vrt file path
     """
     # Create a .vrt file with the same name as .csv by changing the extension to .vrt (virtual). .vrt file will be
-    # overwritten in each loop and erased at the end of the loop
+    # erased at the end of the resampling
     vrt_name = csv_file.replace(".csv", ".vrt")
+    csv_name = os.path.basename(csv_file)
+    layer_name = os.path.splitext(csv_name)[0]
 
     # print("Name \'VRT\': ", vrt_name)
 
@@ -100,13 +103,13 @@ def generate_vrt_file(csv_file):
     if os.path.exists(vrt_name):
         os.remove(vrt_name)
 
-    # Create VRT file with coordinate information (located in file.csv file) :
+    # Create VRT file with coordinate information (located in the .csv file) :
     vrt = open(vrt_name, 'w')  # Open .vrt file
-    # Create the .vrt file with the following code, which remains constant always
+    # Create the .vrt file with the following code, which only changes with the .csv file name
     vrt.write("<OGRVRTDataSource>\n \
-        <OGRVRTLayer name=\"file\">\n \
-        <SrcDataSource>file.csv</SrcDataSource>\n \
-        <SrcLayer>file</SrcLayer> \n \
+        <OGRVRTLayer name=\"" + layer_name + "\">\n \
+        <SrcDataSource relativeToVRT=\"1\">" + csv_name + "</SrcDataSource>\n \
+        <SrcLayer>" + layer_name + "</SrcLayer> \n \
         <GeometryType>wkbPoint25D</GeometryType>\n \
         <LayerSRS>EPSG:32634</LayerSRS>\n \
         <GeometryField encoding=\"PointFromColumns\" x=\"x\" y=\"y\" z=\"z\"/>\n \
@@ -130,8 +133,9 @@ def interpolate_points(vrt_file, folder, snap_data, cell_size):
     :param cell_size: float with cell size of the resulting raster (same as snap raster's)
     :return: path for the interpolated raster file
     """
-    # 1.Set raster name: This file will later be eliminated, so name does not matter
-    raster_name = os.path.join(folder, "InterpolatedRaster.tif")
+    # 1.Set raster name: This file will later be eliminated. The name of the .vrt file is added, so several rasters can
+    # be resampled at the same time
+    raster_name = os.path.join(folder, os.path.splitext(os.path.basename(vrt_file))[0] + "_InterpolatedRaster.tif")
     # print("Raster name: ", raster_name)
 
     # 2.Check if raster exists, and if it does, erase if:
@@ -195,8 +199,8 @@ def main(original_raster, snap_raster, snap_boundary, save_name):
     # Path with the .csv file with coordinates
     xyz_array = get_raster_points(original_array, gt_original)
 
-    # 6. Save the XYZ coordinate data to a .csv file
-    xyz_csv = "file.csv"
+    # 6. Save the XYZ coordinate data to a .csv file (in the results folder, named after the resampled raster)
+    xyz_csv = os.path.join(results_folder, os.path.splitext(os.path.basename(save_name))[0] + "_points.csv")
     save_csv(xyz_array, xyz_csv)  # Save array to .csv file
 
     # 7. Create a .vrt file from the .csv in order to be read by the gdal grid command
@@ -0,0 +1,207 @@
+"""
+Pre-scan of the satellite image sensing dates: calculates the cloud fraction of each sensing date within the study
+area, so the sensing date used for each month can be chosen by closeness to the end of the month AND clearness (see
+'select_sensing_dates' in si_date_selection.py).
+
+Only the low resolution cloud information of each scene is read (never the full resolution bands):
+1. L2A images: the scene classification layer (SCL, 60 m if available, 20 m otherwise). Cloud classes: 3 (cloud
+    shadows), 8 (cloud, medium probability), 9 (cloud, high probability) and 10 (thin cirrus). Class 0 (no data) is
+    not considered.
+2. If there is no SCL band: the cloud probability mask (MSK_CLDPRB), where cells with a probability of
+    'cloud_probability_min' or more are clouds.
+All tiles (satellite sub-folders) of a sensing date are mosaicked and clipped to 'shape_path' in memory, at
+'scan_resolution'.
+
+The cloud fraction of each sensing date is saved in a cached index ('si_cloud_index.json' in the results folder), so
+each scene is only scanned once. The cloud fraction of a sensing date is calculated again if its cloud mask files or the
+shapefile were modified.
+"""
+
+import config_input
+from package_handling import *
+
+# SCL classes corresponding to clouds: cloud shadows, cloud medium probability, cloud high probability, thin cirrus
+scl_cloud_classes = [3, 8, 9, 10]
+# SCL class for no data cells
+scl_no_data = 0
+# Minimum cloud probability (%) in MSK_CLDPRB for a cell to be considered cloudy
+cloud_probability_min = 50
+# Resolution (m) at which the cloud masks are read
+scan_resolution = 60
+
+
+def index_path():
+    """
+    Gets the path of the .json file with the cloud fraction of each sensing date.
+
+    :return: path of the cloud index .json file, in the results folder
+    """
+    return os.path.join(config_input.results_path, "si_cloud_index.json")
+
+
+def find_cloud_mask_files(folder):
+    """
+    Looks for the cloud mask files of a sensing date in all its sub-folders (one for each satellite tile): the SCL band
+    with the lowest resolution or, if there is no SCL band, the cloud probability mask (MSK_CLDPRB).
+
+    :param folder: sensing date folder path
+    :return: [list with the cloud mask file paths, string with the mask type ('SCL' or 'CLDPRB')], or [[], None] if the
+    folder has no cloud mask files (e.g. pre-processed images)
+    """
+    scl_files = {}
+    cldprb_files = {}
+    for root, dirs, files in os.walk(folder):
+        for file in files:
+            if not file.lower().endswith((".jp2", ".tif")):
+                continue
+            name = os.path.splitext(file)[0]
+            resolution = 60 if "60m" in name else 20
+            if "_SCL" in name or name.startswith("SCL"):
+                scl_files.setdefault(resolution, []).append(os.path.join(root, file))
+            elif "MSK_CLDPRB" in name:
+                cldprb_files.setdefault(resolution, []).append(os.path.join(root, file))
+
+    # Use the lowest resolution available
+    if scl_files:
+        return sorted(scl_files[max(scl_files)]), "SCL"
+    if cldprb_files:
+        return sorted(cldprb_files[max(cldprb_files)]), "CLDPRB"
+    return [], None
+
+
+def mask_signature(files):
+    """
+    Generates a signature of the cloud mask files and the clipping shapefile (path, size and modification time), to
+    determine if the cloud fraction saved in the index is still valid.
+
+    :param files: list with the cloud mask file paths
+    :return: string with the signature
+    """
+    signature = []
+    for path in list(files) + [config_input.shape_path]:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.append("{}:{}:{}".format(path, stat.st_size, stat.st_mtime_ns))
+        else:
+            signature.append("{}:missing".format(path))
+    return hashlib.sha1("|".join(signature).encode("utf-8")).hexdigest()
+
+
+def cloud_fraction(files, mask_type):
+    """
+    Calculates the fraction of cloudy cells of a sensing date within the study area. The cloud masks of all tiles are
+    mosaicked, resampled to 'scan_resolution' and clipped to 'shape_path' in memory.
+
+    :param files: list with the cloud mask file paths of the sensing date
+    :param mask_type: string, 'SCL' (scene classification) or 'CLDPRB' (cloud probability)
+    :return: float with the cloud fraction (0-1) of the valid cells, or None if there are no valid cells in the study
+    area
+    """
+    no_data = scl_no_data if mask_type == "SCL" else 255
+    options = gdal.WarpOptions(format="MEM", xRes=scan_resolution, yRes=scan_resolution, resampleAlg="near",
+                               cutlineDSName=config_input.shape_path, cropToCutline=True, srcNodata=no_data,
+                               dstNodata=no_data)
+    ds = gdal.Warp("", files, options=options)
+    array = ds.GetRasterBand(1).ReadAsArray()
+    ds = None
+
+    valid = array != no_data
+    n_valid = np.count_nonzero(valid)
+    if n_valid == 0:
+        return None
+    if mask_type == "SCL":
+        cloudy = np.isin(array, scl_cloud_classes) & valid
+    else:
+        cloudy = (array >= cloud_probability_min) & valid
+    return float(np.count_nonzero(cloudy)) / n_valid
+
+
+def cloud_mask_on_grid(folder, gt, proj, x_size, y_size):
+    """
+    Reads the cloud mask of a sensing date resampled (in memory) to the grid of the satellite image bands, to mask the
+    cloudy cells of each scene (e.g. in the snow cover composite).
+
+    :param folder: sensing date folder path
+    :param gt: geotransform of the band rasters
+    :param proj: projection (wkt) of the band rasters
+    :param x_size: int, number of columns of the band rasters
+    :param y_size: int, number of rows of the band rasters
+    :return: boolean array (y_size, x_size), True in cloudy cells, or None if the sensing date has no cloud mask
+    """
+    files, mask_type = find_cloud_mask_files(folder)
+    if not files:
+        return None
+    no_data = scl_no_data if mask_type == "SCL" else 255
+    bounds = (gt[0], gt[3] + gt[5] * y_size, gt[0] + gt[1] * x_size, gt[3])
+    options = gdal.WarpOptions(format="MEM", outputBounds=bounds, width=x_size, height=y_size, dstSRS=proj,
+                               resampleAlg="near", srcNodata=no_data, dstNodata=no_data)
+    ds = gdal.Warp("", files, options=options)
+    array = ds.GetRasterBand(1).ReadAsArray()
+    ds = None
+    if mask_type == "SCL":
+        return np.isin(array, scl_cloud_classes)
+    return (array >= cloud_probability_min) & (array != no_data)
+
+
+def load_index(path):
+    """
+    Loads the cloud index .json file.
+
+    :param path: path of the cloud index .json file
+    :return: dictionary with the sensing date folder name as key, and a dictionary with the mask signature and cloud
+    fraction as value (empty if the file does not exist)
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print("Could not read the satellite image cloud index in {}. All sensing dates will be scanned.".format(path))
+        return {}
+
+
+def save_index(index, path):
+    """
+    Saves the cloud index to a .json file (first to a temporary file, which then replaces the index file).
+
+    :param index: dictionary with the cloud index
+    :param path: path of the cloud index .json file
+    :return: ---
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def get_cloud_fractions(folders):
+    """
+    Gets the cloud fraction of each sensing date folder in 'si_folder_path'. Only the sensing dates which are not in
+    the cloud index, or whose cloud masks changed, are scanned. Folders whose name is not a date (8 digits) are ignored.
+
+    :param folders: list with the sensing date folder names
+    :return: dictionary with the folder name as key and the cloud fraction (0-1) as value. The value is None if the
+    folder has no cloud mask or no valid cells in the study area
+    """
+    path = index_path()
+    index = load_index(path)
+    fractions = {}
+    modified = False
+    for f in folders:
+        if sum(c.isdigit() for c in str(f)) != 8:
+            continue
+        files, mask_type = find_cloud_mask_files(os.path.join(config_input.si_folder_path, str(f)))
+        signature = mask_signature(files)
+        entry = index.get(str(f))
+        if entry is None or entry.get("signature") != signature:
+            fraction = cloud_fraction(files, mask_type) if files else None
+            index[str(f)] = {"signature": signature, "mask": mask_type, "cloud_fraction": fraction}
+            modified = True
+            if fraction is not None:
+                print("Cloud fraction of the satellite images from {}: {:.1%}".format(f, fraction))
+        fractions[f] = index[str(f)]["cloud_fraction"]
+
+    if modified:
+        save_index(index, path)
+    return fractions
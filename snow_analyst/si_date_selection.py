@@ -0,0 +1,173 @@
+"""
+Selection of the satellite image sensing date (folder) to use for each analysis month.
+
+The sensing date folders (YYYYMMDD in the folder name) are converted to a sorted numpy datetime64 array once, and the
+sensing date closest to the end of each month is found, for all months at once, with a binary search (np.searchsorted)
+instead of subtracting each month from all folder dates.
+
+Constraints for the selected sensing dates:
+1. max_days: maximum number of days between the sensing date and the end of the month (config_input.si_max_days).
+2. max_cloud_fraction: maximum cloud fraction of the sensing date (0-1). Only used if the cloud fraction of the sensing
+    dates is given (sensing dates without a cloud fraction are always accepted).
+
+If the cloud fraction of the sensing dates is given (see si_cloud_index.py) and 'cloud_weight' is set, the sensing date
+with the lowest score within 'max_days' of the end of each month is selected, instead of the closest one:
+    score = days from the end of the month + cloud_weight * cloud fraction
+
+Functions are called by 'generate_satellite_image_date_list' and 'check_input_si_dates' in file_management.py.
+"""
+
+from package_handling import *
+
+
+def to_datetime64(name):
+    """
+    Converts a folder name or sensing date with a date in YYYYMMDD format to a numpy datetime64 (in days).
+
+    :param name: folder name or sensing date (string or int) with 8 digits (YYYYMMDD)
+    :return: numpy datetime64[D]
+    """
+    digits = ''.join(re.findall(r'\d+', str(name)))
+    try:
+        return np.datetime64('{}-{}-{}'.format(digits[0:4], digits[4:6], digits[6:8]), 'D')
+    except ValueError:
+        sys.exit("Wrong input date format in satellite image folder {}.".format(name))
+
+
+def folder_dates(folders):
+    """
+    Converts the folder names whose name corresponds to a sensing date (8 digits, YYYYMMDD) to a sorted datetime64
+    array. Folders whose name is not a date are ignored.
+
+    :param folders: list with folder names (string format)
+    :return: [list with the folder names, sorted by date, numpy array (datetime64[D]) with the date of each folder]
+    """
+    names = [f for f in folders if sum(c.isdigit() for c in f) == 8]
+    dates = np.array([to_datetime64(f) for f in names], dtype='datetime64[D]')
+    order = np.argsort(dates, kind='stable')
+    return [names[i] for i in order], dates[order]
+
+
+def month_ends(date_list):
+    """
+    Gets the last day of each month in date_list.
+
+    :param date_list: list with analysis dates (in datetime format)
+    :return: numpy array (datetime64[D]) with the last day of the month of each date
+    """
+    months = np.array([d.strftime('%Y-%m') for d in date_list], dtype='datetime64[M]')
+    return (months + 1).astype('datetime64[D]') - 1
+
+
+def closest_dates(dates, targets):
+    """
+    Finds, for each target date, the closest date in a sorted date array. If 2 dates are at the same distance, the
+    earliest one is chosen.
+
+    :param dates: sorted numpy array (datetime64[D]) with the available dates
+    :param targets: numpy array (datetime64[D]) with the dates to look for
+    :return: [numpy array with the index (in 'dates') of the closest date to each target, numpy array with the
+    difference in days between the target and the closest date]
+    """
+    # index of the first date after (or at) each target: the closest date is either this one or the one before
+    right = np.searchsorted(dates, targets, side='left')
+    left = np.clip(right - 1, 0, len(dates) - 1)
+    right = np.clip(right, 0, len(dates) - 1)
+
+    left_days = np.abs((targets - dates[left]).astype(np.int64))
+    right_days = np.abs((dates[right] - targets).astype(np.int64))
+    index = np.where(left_days <= right_days, left, right)
+    days = np.minimum(left_days, right_days)
+    return index, days
+
+
+def select_sensing_dates(folders, date_list, max_days=15, cloud_fractions=None, max_cloud_fraction=None,
+                         cloud_weight=None):
+    """
+    Selects, for each analysis month, the sensing date folder closest to the end of the month, among the folders that
+    meet the constraints (maximum cloud fraction). If cloud_weight is set, it selects the sensing date that minimizes
+    the days from the end of the month plus the weighted cloud fraction.
+
+    :param folders: list with folder names (string format)
+    :param date_list: list with analysis dates (in datetime format)
+    :param max_days: int, maximum number of days between the sensing date and the end of the month
+    :param cloud_fractions: (optional) dict with the folder name as key and the cloud fraction (0-1) as value
+    :param max_cloud_fraction: (optional) float, maximum cloud fraction of the sensing dates to select
+    :param cloud_weight: (optional) float, days from the end of the month equivalent to a cloud fraction of 1 (e.g. with
+    30, a clear sensing date 10 days before the end of the month is preferred to the last day of the month with a cloud
+    fraction of 0.5)
+
+    :return: list with the selected folder name for each analysis date, or None for the months without a valid
+    sensing date
+    """
+    names, dates = folder_dates(folders)
+
+    # Remove the sensing dates which are too cloudy
+    if cloud_fractions is not None and max_cloud_fraction is not None:
+        clear = np.array([cloud_fractions.get(f) is None or cloud_fractions[f] <= max_cloud_fraction for f in names],
+                         dtype=bool)
+        names = [f for f, c in zip(names, clear) if c]
+        dates = dates[clear]
+
+    if len(names) == 0:
+        return [None] * len(date_list)
+
+    targets = month_ends(date_list)
+    if cloud_fractions is None or not cloud_weight:
+        index, days = closest_dates(dates, targets)
+        return [names[i] if d <= max_days else None for i, d in zip(index, days)]
+
+    # Score the sensing dates within max_days of each month end (sensing dates without a cloud fraction are not
+    # penalized)
+    clouds = np.nan_to_num(np.array([cloud_fractions.get(f) for f in names], dtype=float), nan=0.0)
+    first = np.searchsorted(dates, targets - max_days, side='left')
+    last = np.searchsorted(dates, targets + max_days, side='right')
+    selected = []
+    for target, i, j in zip(targets, first, last):
+        if i == j:  # no sensing dates within max_days
+            selected.append(None)
+            continue
+        score = np.abs((dates[i:j] - target).astype(np.int64)) + cloud_weight * clouds[i:j]
+        selected.append(names[i + int(np.argmin(score))])
+    return selected
+
+
+def window_sensing_dates(folders, date, window_days):
+    """
+    Gets the sensing date folders within window_days of the end of the input date's month (before or after), sorted
+    from the closest to the farthest from the end of the month.
+
+    :param folders: list with folder names (string format)
+    :param date: analysis date (in datetime format)
+    :param window_days: int, maximum number of days between the sensing dates and the end of the month
+
+    :return: [list with the folder names, numpy array with the days between each sensing date and the end of the month
+    (negative before the end of the month)]
+    """
+    names, dates = folder_dates(folders)
+    target = month_ends([date])[0]
+    first = np.searchsorted(dates, target - window_days, side='left')
+    last = np.searchsorted(dates, target + window_days, side='right')
+
+    days = (dates[first:last] - target).astype(np.int64)
+    order = np.argsort(np.abs(days), kind='stable')
+    return [names[first + i] for i in order], days[order]
+
+
+def match_input_dates(si_dates, month_dates, max_days=30):
+    """
+    Finds, for each sensing date set by the user, the analysis month (end of month sensing date) closest to it.
+
+    :param si_dates: list with the sensing dates set by the user (YYYYMMDD format)
+    :param month_dates: list with the sensing date (folder name) selected for each analysis month, in YYYYMMDD format
+    :param max_days: int, maximum number of days between the user sensing date and the month's sensing date
+
+    :return: list with the index (in month_dates) of the month corresponding to each user sensing date, or None if the
+    user sensing date is more than max_days from any month
+    """
+    month_dates = np.array([to_datetime64(f) for f in month_dates], dtype='datetime64[D]')
+    order = np.argsort(month_dates, kind='stable')
+    targets = np.array([to_datetime64(f) for f in si_dates], dtype='datetime64[D]')
+
+    index, days = closest_dates(month_dates[order], targets)
+    return [int(order[i]) if d < max_days else None for i, d in zip(index, days)]
@@ -1,5 +1,8 @@
 import config_input
 import file_management
+import raster_calculations as rc
+import si_cloud_index
+import si_date_selection
 import si_merge_clip as satellite_images
 from package_handling import *
 
@@ -12,6 +15,8 @@ from package_handling import *
      the satellite images.
 NOTES:
 - Main function "calculate_snow_cover" does all the calculations for one sensing date at a time.
+- If 'snow_cover_composite' is True, "calculate_snow_cover_composite" is used instead: it combines all sensing dates
+    within 'composite_window_days' of the end of the month (see the function for details).
 - Program can be run individually or through "main_snow_codes"
 - Program generates a binary raster, where 1 means there is snow presence, and 0 means there is none.
 - An error is generated if any of the needed bands (02, 03, 11) are not available. If the TCI rasters are not
@@ -66,17 +71,13 @@ def get_band_paths(folder):
     return band_results
 
 
-def calculate_snow_cover(folder, date):
-    """    Main function to calculate the snow cover for a given month, based on a Sentinel 2 satellite image.
+def get_scene_bands(folder):
+    """Gets the B02, B03 and B11 raster paths for a sensing date, either by merging and clipping the raw satellite
+    images (if 'run_satellite_image_clip_merge' is True) or from the pre-processed rasters in the input folder.
 
-    :param folder: Folder path where satellite images to use are located.
-    The file name should have the sensing date in
-     the name in format "YYYYMMDD"
-    :param date: analysis date (in datetime format) being looped through or being analyzed
-    :return: ---
+    :param folder: Folder path where satellite images for the sensing date are located.
+    :return: [B02 raster path, B03 raster path, B11 raster path]
     """
-    print(" Calculating snow cover for date {} with satellite image sensing date: {}".format(date.strftime('%Y%m'),
-                                                                                             os.path.split(folder)[1]))
     if config_input.run_satellite_image_clip_merge:
         print("     Merging and resampling input satellite images")
         band_results = satellite_images.sat_image_merge_clip(folder)
@@ -84,10 +85,25 @@ def calculate_snow_cover(folder, date):
         print("     Reading pre-processed input satellite images")
         band_results = get_band_paths(folder)
 
-    #  Snow Detection Calculation
+    #  Snow Detection bands
     band2 = band_results[0]  # B02 raster
     band3 = band_results[1]  # B03 raster
     band11 = band_results[2]  # B11 raster
+    return band2, band3, band11
+
+
+def calculate_snow_cover(folder, date):
+    """    Main function to calculate the snow cover for a given month, based on a Sentinel 2 satellite image.
+
+    :param folder: Folder path where satellite images to use are located.
+    The file name should have the sensing date in
+     the name in format "YYYYMMDD"
+    :param date: analysis date (in datetime format) being looped through or being analyzed
+    :return: ---
+    """
+    print(" Calculating snow cover for date {} with satellite image sensing date: {}".format(date.strftime('%Y%m'),
+                                                                                             os.path.split(folder)[1]))
+    band2, band3, band11 = get_scene_bands(folder)
 
     # Extract raster, raster data as array, raster geotransform
     blue_dataset, blue_array, blue_geotransform = gu.raster2array(band2)
@@ -108,5 +124,98 @@ def calculate_snow_cover(folder, date):
     gu.create_raster(snow_raster, snow, epsg=32634, nan_val=-9999, rdtype=gdal.GDT_UInt32, geo_info=blue_geotransform)
 
 
+def calculate_snow_cover_composite(date, folders=None):
+    """    Calculates the snow cover for a given month by combining all Sentinel 2 satellite images (sensing dates)
+    within 'composite_window_days' of the end of the month, so a cloudy scene does not discard the month.
+
+    The scenes are read one at a time and block by block ('composite_block_size'), so the memory used does not depend
+    on the number of scenes:
+    1. For each scene and block, the NDSI is calculated and each cell is flagged as snow (NDSI > NDSI_min and
+        blue > blue_min) or no snow.
+    2. Cells which are cloudy in the scene (cloud mask of the scene, see si_cloud_index.py) are ignored. The flag of the
+        other cells is added to a weighted vote, where the weight of each scene is exp(-days / composite_decay_days),
+        with days being the number of days between the sensing date and the end of the month.
+    3. A cell is snow if the weighted snow votes are at least half of its total weight. Cells which are cloudy in all
+        scenes get the flag of the scene closest to the end of the month.
+
+    :param date: analysis date (in datetime format) being looped through or being analyzed
+    :param folders: (optional) list with the sensing date folder names in 'si_folder_path'. If None, all folders in
+    'si_folder_path' are used.
+    :return: ---
+    """
+    if folders is None:
+        folders = os.listdir(config_input.si_folder_path)
+    scenes, scene_days = si_date_selection.window_sensing_dates(folders, date, config_input.composite_window_days)
+    if len(scenes) == 0:
+        message = "There are no available satellite images within {} days of the end of the analysis date: {}".format(
+            config_input.composite_window_days, date.strftime('%Y%m'))
+        sys.exit(message)
+    print(" Calculating snow cover composite for date {} with satellite image sensing dates: {}".format(
+        date.strftime('%Y%m'), ", ".join(str(f) for f in scenes)))
+
+    # Arrays for the whole raster: weighted snow votes, total weight of the clear scenes in each cell, and snow flag of
+    # the closest scene (255 where no scene has data)
+    votes = weights = nearest = None
+    geotransform = None
+    for scene, days in zip(scenes, scene_days):
+        folder = os.path.join(config_input.si_folder_path, str(scene))
+        band2, band3, band11 = get_scene_bands(folder)
+        blue_raster = gdal.Open(band2)
+        green_raster = gdal.Open(band3)
+        swir_raster = gdal.Open(band11)
+        x_size, y_size = blue_raster.RasterXSize, blue_raster.RasterYSize
+
+        if votes is None:
+            geotransform = blue_raster.GetGeoTransform()
+            votes = np.zeros((y_size, x_size), dtype=np.float32)
+            weights = np.zeros((y_size, x_size), dtype=np.float32)
+            nearest = np.full((y_size, x_size), 255, dtype=np.uint8)
+        elif (x_size, y_size) != (votes.shape[1], votes.shape[0]) or \
+                not np.allclose(blue_raster.GetGeoTransform(), geotransform):
+            message = "ERROR: The satellite images from {} do not have the same extent and resolution as the images " \
+                      "from {}. Check input.".format(scene, scenes[0])
+            sys.exit(message)
+
+        cloud = si_cloud_index.cloud_mask_on_grid(folder, geotransform, blue_raster.GetProjection(), x_size, y_size)
+        weight = np.float32(math.exp(-abs(int(days)) / config_input.composite_decay_days))
+
+        for window in rc.block_windows(band2, config_input.composite_block_size):
+            x_off, y_off, x_win, y_win = window
+            block = (slice(y_off, y_off + y_win), slice(x_off, x_off + x_win))
+            blue = rc.band_to_nan_array(blue_raster.GetRasterBand(1), window)
+            green = rc.band_to_nan_array(green_raster.GetRasterBand(1), window)
+            swir = rc.band_to_nan_array(swir_raster.GetRasterBand(1), window)
+
+            # NDSI calculation and snow flag
+            with np.errstate(all='ignore'):
+                ndsi = (green - swir) / (green + swir)
+                snow = np.logical_and(ndsi > config_input.NDSI_min, blue > config_input.blue_min)
+            valid = np.isfinite(ndsi) & np.isfinite(blue)
+
+            # Snow flag of the closest scene with data (scenes are sorted from the closest to the farthest)
+            unset = valid & (nearest[block] == 255)
+            nearest[block][unset] = snow[unset]
+
+            # Weighted vote of the cells without clouds
+            clear = valid if cloud is None else valid & ~cloud[block]
+            np.add(weights[block], weight, out=weights[block], where=clear)
+            np.add(votes[block], weight, out=votes[block], where=clear & snow)
+
+        blue_raster = green_raster = swir_raster = cloud = None
+
+    # Calculate Snow Array: weighted majority of the clear scenes, or the closest scene if all scenes are cloudy
+    snow = np.zeros(votes.shape, dtype=np.uint8)
+    clear = weights > 0
+    snow[clear] = votes[clear] >= 0.5 * weights[clear]
+    cloudy = ~clear & (nearest != 255)
+    snow[cloudy] = nearest[cloudy]
+    print("     {:.1%} of the cells were cloudy in all scenes".format(np.count_nonzero(cloudy) / snow.size))
+
+    # Save resulting snow Raster
+    snow_raster = os.path.join(
+        file_management.snow_cover_path, f'SnowCover_{date.strftime("%Y%m")}.tif')
+    gu.create_raster(snow_raster, snow, epsg=32634, nan_val=-9999, rdtype=gdal.GDT_UInt32, geo_info=geotransform)
+
+
 if __name__ == '__main__':
     pass
@@ -1,4 +1,5 @@
 # from config import *
+import raster_metadata
 from log import *
 from package_handling import *
 
@@ -18,6 +19,9 @@ class CompareData:
         number_of_items(object_one, object_two): Compare number of items of two objects.
         compare_geotransform(): Round the geotransformation values off to four decimal places and compare them.
         compare_projection(): Compare the projection of two rasters.
+
+    The geotransformation and projection of the rasters are read from the raster metadata cache (raster_metadata.py),
+    so each raster is only opened once per run.
     """
 
     def __init__(self, array_one, array_two, raster_one_path, raster_two_path):
@@ -63,13 +67,15 @@ class CompareData:
     def compare_geotransform(self):
         """Round geotransformation of two rasters off to four decimal places and compare them."""
         try:
-            raster_one_gt = gdal.Open(self.raster_one_path).GetGeoTransform()
+            raster_one_gt = raster_metadata.get_metadata(self.raster_one_path).gt
         except FileNotFoundError:
             logger.error("FileNotFoundError: The raster path %s does not exist." % self.raster_one_path)
+            return
         try:
-            raster_two_gt = gdal.Open(self.raster_two_path).GetGeoTransform()
+            raster_two_gt = raster_metadata.get_metadata(self.raster_two_path).gt
         except FileNotFoundError:
             logger.error("FileNotFoundError: The raster path %s does not exist." % self.raster_two_path)
+            return
         for i in range(0, 6, 1):
             if not round(raster_one_gt[i], 4) == round(raster_two_gt[i], 4):
                 logger.warning("Geotransformation data at index " + str(i) + " differs from each other. ")
@@ -77,12 +83,14 @@ class CompareData:
     def compare_projection(self):
         """Compare the projection of two rasters."""
         try:
-            raster_one_proj = gdal.Open(self.raster_one_path).GetProjection()
+            raster_one_proj = raster_metadata.get_metadata(self.raster_one_path).proj
         except FileNotFoundError:
             logger.error("FileNotFoundError: The raster path %s does not exist." % self.raster_one_path)
+            return
         try:
-            raster_two_proj = gdal.Open(self.raster_two_path).GetProjection()
+            raster_two_proj = raster_metadata.get_metadata(self.raster_two_path).proj
         except FileNotFoundError:
             logger.error("FileNotFoundError: The raster path %s does not exist." % self.raster_two_path)
+            return
         if not raster_one_proj == raster_two_proj:
             logger.error("Raster have different Projections.")
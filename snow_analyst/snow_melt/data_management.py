@@ -1,3 +1,5 @@
+import file_management
+import raster_metadata
 from log import *
 from package_handling import *
 
@@ -78,60 +80,10 @@ class DataManagement:
     def get_date_format(self):
         """
             Function extracts the date from the input file/folder name, in datetime format. The date should be in
-            YYYYMM, YYYYMMDD, or YYYYMMDD0HH format
+            YYYYMM, YYYYMMDD, or YYYYMMDD0HH format (see 'file_management.get_date')
             :return: file date in datetime format
             """
-        file_name = os.path.basename(
-            self.filename)  # Get file name (which should contain the date)
-        # Combine all digits to a string (removes any integer)
-        digits = ''.join(re.findall(r'\d+', file_name))
-
-        if len(digits) == 6:  # Either MMYYYY or YYYYMM
-            if int(digits[0:2]) > 12:  # YYYYMM format
-                try:
-                    # print(" Date in YYYYMM format")
-                    date = datetime.datetime.strptime(digits, '%Y%m')
-                except ValueError:
-                    sys.exit("Wrong input date format.")
-            else:  # MMYYYY format
-                try:
-                    # print("date in MMYYYY format")
-                    date = datetime.datetime.strptime(digits, '%m%Y')
-                except ValueError:
-                    sys.exit("Wrong input date format.")
-        elif len(digits) == 4:  # Should be YY_MM
-            # print("Date format in YYMM")
-            try:
-                date = datetime.datetime.strptime(digits, '%y%m')
-            except ValueError:
-                sys.exit(
-                    "Wrong input date format in input file {}.".format(self.filename))
-        elif len(digits) == 8:  # YYYYMMDD format:
-            # print("Date format in YYYYMMDD")
-            try:
-                date = datetime.datetime.strptime(digits, '%Y%m%d')
-            except ValueError:
-                sys.exit(
-                    "Wrong input date format in input file {}.".format(self.filename))
-        elif len(digits) == 10:  # YYYYMMDDHH
-            # print("Date format in YYYYMMDD_HH")
-            try:
-                date = datetime.datetime.strptime(digits, '%Y%m%d%H')
-            except ValueError:
-                sys.exit(
-                    "Wrong input date format in input file {}.".format(self.filename))
-        elif len(digits) == 11:  # YYYYMMDD0HH
-            # print("Date format in YYYYMMDD_0HH")
-            try:
-                date = datetime.datetime.strptime(digits, '%Y%m%d0%H')
-            except ValueError:
-                sys.exit(
-                    "Wrong input date format in input file {}.".format(self.filename))
-        else:
-            sys.exit(
-                "Check input date format. It must be in either YYYYMM, MMYYYY or YYMM.")
-
-        return date
+        return file_management.get_date(self.filename)
 
     def create_date_string(self):
         """
@@ -156,13 +108,13 @@ class DataManagement:
                  proj: STR defining a gdal.DataSet.GetProjection object
         """
         try:
-            raster = gdal.Open(self.filename)  # Extract raster from path
-        except RuntimeError as re:
+            raster = raster_metadata.get_metadata(self.filename)  # Raster metadata (only read once per raster)
+        except (RuntimeError, FileNotFoundError) as re:
             logger.error("RuntimeError: Raster can't be accessed")
             print(re)
             sys.exit(1)  # code shouldn't run any further if this error occurs
-        gt = raster.GetGeoTransform()  # Get geotransformation data
-        proj = raster.GetProjection()  # Get projection of raster
+        gt = raster.gt  # Get geotransformation data
+        proj = raster.proj  # Get projection of raster
         return gt, proj  # Return both variables
 
     @staticmethod
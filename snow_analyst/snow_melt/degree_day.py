@@ -0,0 +1,260 @@
+"""
+Degree-day (temperature index) snow melt model, as an alternative to the monthly snow balance of snow_melt_main.py
+(snow_melt_model = 'degree_day' in config_input).
+
+The model time-steps through all precipitation and temperature rasters of each month (hourly, daily or monthly .txt
+ASCII rasters, the input of pt_raster_manipulation.py), for all cells at once. For each time step of length dt (days)
+and each cell:
+    snow water equivalent (SWE) += P                                    if T < T_snow (snowfall)
+    melt = min(SWE, degree_day_factor * max(T - T_melt, 0) * dt)
+    SWE -= melt
+The melt of all time steps of the month is summed up, and the SWE at the end of each month is the SWE at the start of
+the next month (0 at the start of the first month).
+
+The model runs on the original (coarse) grid of the ASCII rasters. The monthly melt and the SWE at the end of the month
+are then resampled to the snap raster (as the rain and snow rasters, see rain_snow_rasters.py) and saved as
+'Snowmelt/snowmelt_YYYYMM.tif' and 'Snow_end_month/snow_end_month_YYYYMM.tif' in the results folder, so they can be
+used by total_R_factor.py. The SWE at the end of each month (original grid) is also saved as
+'Snow_end_month/degree_day_swe_YYYYMM.npy', to continue the model in the next month.
+
+If numba is installed (and 'degree_day_numba' is True), the time loop of each cell is compiled with numba and run in
+parallel for all cells. Otherwise, each time step is calculated for all cells at once with numpy.
+"""
+
+import checkpoints
+import config_input
+import file_management
+import raster_calculations as rc
+import resampling
+from log import *
+from package_handling import *
+
+# numba is only imported (and the model compiled) on the first call of 'run_degree_day' with 'degree_day_numba' enabled,
+# so importing this module does not load numba (see 'get_degree_day_numba')
+numba = None
+# Compiled degree-day model: None before the first call, False if numba is not installed
+degree_day_numba = None
+
+
+def degree_day_numpy(precipitation, temperature, dt_days, swe, t_snow, t_melt, ddf):
+    """
+    Degree-day model for all cells at once, one time step after the other.
+    :param precipitation: ARRAY (time steps, cells) of precipitation (mm)
+    :param temperature: ARRAY (time steps, cells) of temperature (C)
+    :param dt_days: ARRAY (time steps) with the length of each time step (days)
+    :param swe: ARRAY (cells) of snow water equivalent at the start of the period (mm), updated to the end of the period
+    :param t_snow: FLOAT temperature below which precipitation is snow (C)
+    :param t_melt: FLOAT temperature above which snow melts (C)
+    :param ddf: FLOAT degree-day factor (mm/C/day)
+    :return: ARRAY (cells) of snow melt in the period (mm)
+    """
+    melt_total = np.zeros_like(swe)
+    melt = np.empty_like(swe)
+    for t in range(precipitation.shape[0]):
+        # Snowfall
+        swe += np.where(temperature[t] < t_snow, precipitation[t], 0.)
+        # Potential melt, limited to the available snow
+        np.subtract(temperature[t], t_melt, out=melt)
+        np.maximum(melt, 0., out=melt)
+        melt *= ddf * dt_days[t]
+        np.minimum(melt, swe, out=melt)
+        swe -= melt
+        melt_total += melt
+    return melt_total
+
+
+def degree_day_cells(precipitation, temperature, dt_days, swe, t_snow, t_melt, ddf):
+    """
+    Degree-day model for numba (compiled in 'get_degree_day_numba'): the time steps of each cell are calculated in a
+    loop, for all cells in parallel. Same parameters and results as 'degree_day_numpy'.
+    """
+    n_steps, n_cells = precipitation.shape
+    melt_total = np.zeros(n_cells, dtype=swe.dtype)
+    for c in numba.prange(n_cells):
+        snow = swe[c]
+        total = 0.
+        for t in range(n_steps):
+            if temperature[t, c] < t_snow:
+                snow += precipitation[t, c]
+            melt = ddf * dt_days[t] * (temperature[t, c] - t_melt)
+            if melt > 0.:
+                if melt > snow:
+                    melt = snow
+                snow -= melt
+                total += melt
+        swe[c] = snow
+        melt_total[c] = total
+    return melt_total
+
+
+def get_degree_day_numba():
+    """
+    Import numba and compile 'degree_day_cells' on the first call (later calls return the compiled function).
+    :return: compiled FUNCTION, or None if numba is not installed
+    """
+    global numba, degree_day_numba
+    if degree_day_numba is None:
+        try:
+            import numba
+        except ImportError:
+            degree_day_numba = False
+        else:
+            degree_day_numba = numba.njit(parallel=True, cache=True)(degree_day_cells)
+    return degree_day_numba or None
+
+
+def time_steps(dates, month):
+    """
+    Get the length of each time step from the dates of the input rasters: each raster is valid until the date of the
+    next raster. The last raster of the month has the same length as the previous one or, if there is only one raster in
+    the month (monthly data), the length of the month.
+    :param dates: LIST of the dates of the rasters of the month (datetime format), sorted
+    :param month: DATETIME of the month
+    :return: ARRAY with the length of each time step (days)
+    """
+    if len(dates) == 1:
+        return np.array([calendar.monthrange(month.year, month.month)[1]], dtype=np.float64)
+    seconds = np.array([(d2 - d1).total_seconds() for d1, d2 in zip(dates[:-1], dates[1:])], dtype=np.float64)
+    return np.append(seconds, seconds[-1]) / 86400.
+
+
+def read_pt_cube(month):
+    """
+    Read all precipitation and temperature rasters of a month into 2 arrays (time steps, cells), with only the cells
+    which have data in the first precipitation and temperature rasters.
+    :param month: DATETIME of the month
+    :return: precipitation: ARRAY (time steps, cells), float32
+             temperature: ARRAY (time steps, cells), float32
+             dt_days: ARRAY (time steps) with the length of each time step (days)
+             valid: ARRAY (rows, columns) of BOOLEANS, True in the cells with data
+             header: ARRAY with the header of the ASCII rasters (ncols, nrows, xllcorner, yllcorner, cellsize, nodata)
+    """
+    filenames_precip = file_management.get_PT_datefiles(config_input.precipitation_path, month)
+    filenames_temp = file_management.get_PT_datefiles(config_input.temperature_path, month)
+    file_management.compare_dates(filenames_precip, filenames_temp, "Precipitation", "Temperature")
+
+    header = rc.get_ascii_data(filenames_precip[0])
+    no_data = header[5]
+    first_precip = rc.ascii_to_array(filenames_precip[0])
+    valid = (first_precip != no_data) & (rc.ascii_to_array(filenames_temp[0]) != no_data)
+
+    n_steps = len(filenames_precip)
+    precipitation = np.empty((n_steps, int(np.count_nonzero(valid))), dtype=np.float32)
+    temperature = np.empty_like(precipitation)
+    for i in tqdm(range(n_steps), desc="Reading precipitation and temperature for {}".format(month.strftime('%Y%m'))):
+        p_array = first_precip if i == 0 else rc.ascii_to_array(filenames_precip[i])
+        precipitation[i] = p_array[valid]
+        temperature[i] = rc.ascii_to_array(filenames_temp[i])[valid]
+    # No data cells in later rasters: no precipitation, and no melt (temperature below T_melt and T_snow)
+    precipitation[precipitation == no_data] = 0.
+    temperature[temperature == no_data] = min(config_input.T_snow, config_input.T_melt) - 1.
+
+    dates = [file_management.get_date(f) for f in filenames_precip]
+    return precipitation, temperature, time_steps(dates, month), valid, header
+
+
+def run_degree_day(precipitation, temperature, dt_days, swe):
+    """
+    Run the degree-day model with numba (if it is installed and enabled) or numpy, with the parameters in config_input.
+    :param precipitation: ARRAY (time steps, cells) of precipitation (mm)
+    :param temperature: ARRAY (time steps, cells) of temperature (C)
+    :param dt_days: ARRAY (time steps) with the length of each time step (days)
+    :param swe: ARRAY (cells) of SWE at the start of the period (float64), updated to the SWE at the end of the period
+    :return: ARRAY (cells) of snow melt in the period (mm)
+    """
+    args = (precipitation, temperature, dt_days, swe, float(config_input.T_snow), float(config_input.T_melt),
+            float(config_input.degree_day_factor))
+    if config_input.degree_day_numba:
+        model = get_degree_day_numba()
+        if model is not None:
+            return model(*args)
+    return degree_day_numpy(*args)
+
+
+def state_path(month):
+    """
+    Get the path of the .npy file with the SWE at the end of a month (original grid, cells with data only).
+    :param month: DATETIME of the month
+    :return: STR with the file path
+    """
+    return os.path.join(config_input.results_path, 'Snow_end_month', f'degree_day_swe_{month.strftime("%Y%m")}.npy')
+
+
+def save_resampled(array, valid, header, save_path):
+    """
+    Save an array with the values of the cells with data as a raster with the snap raster resolution: the array is
+    saved with the original (ASCII) grid and resampled to the snap raster (see resampling.py).
+    :param array: ARRAY (cells) with the values of the cells with data
+    :param valid: ARRAY (rows, columns) of BOOLEANS, True in the cells with data
+    :param header: ARRAY with the header of the ASCII rasters
+    :param save_path: STR of the path of the resampled raster
+    """
+    no_data = float(header[5])
+    grid = np.full(valid.shape, no_data, dtype=np.float32)
+    grid[valid] = array
+    gt_snap, proj = rc.get_raster_data(config_input.snapraster_path)
+    original_path = os.path.join(os.path.dirname(save_path), "Original_" + os.path.basename(save_path))
+    rc.save_raster(grid, original_path, rc.get_ascii_gt(header), proj, no_data)
+    resampling.main(original_path, config_input.snapraster_path, config_input.shape_path, save_path)
+    if os.path.exists(original_path):
+        os.remove(original_path)
+
+
+@wrapper(entering, exiting)
+def process_degree_day_month(month, swe=None):
+    """
+    Calculate the snow melt and the SWE at the end of a month with the degree-day model, and save both rasters (with the
+    snap raster resolution) and the SWE state. If swe is None, the SWE at the start of the month is read from the state
+    saved for the previous month (0 for the first month of the analysis date range), so the months must be calculated
+    in order.
+    :param month: DATETIME of the month to calculate
+    :param swe: ARRAY (cells with data) of SWE at the start of the month (optional)
+    :return: ARRAY (cells with data) of SWE at the end of the month
+    """
+    precipitation, temperature, dt_days, valid, header = read_pt_cube(month)
+    n_cells = precipitation.shape[1]
+
+    if swe is None:
+        swe = np.zeros(n_cells, dtype=np.float64)
+        if (month.year, month.month) > (config_input.start_date.year, config_input.start_date.month):
+            previous_month = month.replace(day=1) - datetime.timedelta(days=1)
+            if not os.path.exists(state_path(previous_month)):
+                message = "There is no degree-day snow state for {}, which is needed to calculate the snow melt for " \
+                          "{}. Calculate the previous months first.".format(previous_month.strftime('%Y%m'),
+                                                                            month.strftime('%Y%m'))
+                sys.exit(message)
+            swe = np.load(state_path(previous_month))
+    if swe.shape[0] != n_cells:
+        message = "The degree-day snow state has {} cells, but the input rasters for {} have {} cells with data. " \
+                  "Check input rasters.".format(swe.shape[0], month.strftime('%Y%m'), n_cells)
+        sys.exit(message)
+
+    swe = np.array(swe, dtype=np.float64)
+    melt = run_degree_day(precipitation, temperature, dt_days, swe)
+
+    # Save results with the snap raster resolution, and the SWE state (original grid)
+    month_year = month.strftime('%Y%m')
+    snow_end_folder = os.path.join(config_input.results_path, 'Snow_end_month')
+    file_management.create_folder(snow_end_folder)
+    file_management.create_folder(os.path.join(config_input.results_path, 'Snowmelt'))
+    save_resampled(melt, valid, header, os.path.join(config_input.results_path, 'Snowmelt',
+                                                     f'snowmelt_{month_year}.tif'))
+    save_resampled(swe, valid, header, os.path.join(snow_end_folder, f'snow_end_month_{month_year}.tif'))
+    np.save(state_path(month), swe)
+    checkpoints.mark_complete("snow_melt", month)
+    logger.info("Degree-day snow melt for %s: mean melt %.1f mm, mean SWE at the end of the month %.1f mm",
+                month_year, float(melt.mean()) if n_cells else 0., float(swe.mean()) if n_cells else 0.)
+    return swe
+
+
+@wrapper(entering, exiting)
+def process_degree_day(date_list):
+    """
+    Calculate the snow melt with the degree-day model for all months in date_list (in order), keeping the SWE in memory
+    from one month to the next. The SWE at the start of the first month is read from the state saved for the previous
+    month (or 0, if it is the first month of the analysis date range).
+    :param date_list: LIST of DATETIME of the months to calculate
+    """
+    swe = None
+    for month in date_list:
+        swe = process_degree_day_month(month, swe)
@@ -1,38 +1,69 @@
 from config_input import logging  # CHANGE: calls all folders input file "config_input", which contains all variables
 
 #                                   and imports all needed modules
+import config_input
+from config_input import functools, time
 
 # define name and location of logfile
 log_file = "./logfile.log"
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, filename=log_file, filemode="a",
-                    format="%(asctime)-15s %(levelname)-8s %(message)s")
+# Configure logger: warnings and info messages are printed. The logfile (with the DEBUG messages of the wrapper) is only
+# opened when it is needed (see 'configure_log_file'), so importing the snow melt modules does not open a file handler
 logger = logging.getLogger("logger")
+logger.setLevel(logging.INFO)
+log_format = logging.Formatter("%(asctime)-15s %(levelname)-8s %(message)s")
 
 # Configure streamhandler
 stream_handler = logging.StreamHandler()
 stream_handler.setLevel(logging.INFO)
-stream_handler.setFormatter(logging.Formatter("%(asctime)-15s %(levelname)-8s %(message)s"))
+stream_handler.setFormatter(log_format)
 
 logger.addHandler(stream_handler)
+file_handler = None
+
+# Runtime switches of the wrapper (see 'wrapper'):
+# - profiling: accumulate the number of calls and the cumulative/self time of each wrapped function (in 'profile_stats')
+# - log_calls: call the pre and post functions (e.g. log entering/exiting at DEBUG level) for each call (switch it on
+#   with 'set_log_calls', which also opens the logfile)
+# The profile is kept per process: the stats of the worker processes of pipeline.run_parallel are sent back with the
+# result of each task and added to the profile of the main process (see 'take_profile' and 'merge_profile'). The tiles
+# of the parallel snow melt (snowpack.process_tiled with more than 1 worker) are not profiled, only the function that
+# calculates them in the main process.
+profiling = config_input.profile_snow_melt
+log_calls = False
+
+# Profile of each wrapped function: {"module.function": [calls, cumulative time (s), self time (s), active calls]}
+profile_stats = {}
+# Time spent in wrapped functions called by each active wrapped call (innermost call last)
+_child_times = []
 
 
 def wrapper(pre, post):
     """
-    Simple wrap function, Wrapper decorator @ is to be placed right on top of function to be wrapped
-    :param pre: Function called before the function that is being wrapped
-    :param post: Function called after the function that is being wrapped
+    Simple wrap function, Wrapper decorator @ is to be placed right on top of function to be wrapped. When 'profiling'
+    and 'log_calls' are both False (default), the wrapper only checks both switches and calls the function.
+    :param pre: Function called before the function that is being wrapped (only if 'log_calls' is True)
+    :param post: Function called after the function that is being wrapped (only if 'log_calls' is True)
     """
 
     def decorator(function):
+        name = "{}.{}".format(function.__module__, function.__qualname__)
+
+        @functools.wraps(function)
         def inner(*args, **kwargs):
-            # function that is called before executing wrapped function
-            pre(function)
-            # execute wrapped function
-            result = function(*args, **kwargs)
-            # function that is called after executing wrapped function
-            post(function)
+            if not profiling and not log_calls:
+                return function(*args, **kwargs)
+            if log_calls:
+                # function that is called before executing wrapped function
+                pre(function)
+            if profiling:
+                result = profile_call(name, function, args, kwargs)
+            else:
+                # execute wrapped function
+                result = function(*args, **kwargs)
+            if log_calls:
+                # function that is called after executing wrapped function
+                post(function)
             return result
 
         return inner
@@ -40,6 +71,131 @@ def wrapper(pre, post):
     return decorator
 
 
+def profile_call(name, function, args, kwargs):
+    """
+    Calls a wrapped function and adds its call count, cumulative time (including the wrapped functions it calls) and
+    self time (excluding them) to 'profile_stats'. For recursive calls, the cumulative time is only added once.
+    :param name: STR with the module and name of the function (key in 'profile_stats')
+    :param function: FUNCTION to call
+    :param args: TUPLE with the positional arguments of the function
+    :param kwargs: DICT with the keyword arguments of the function
+    :return: the result of the function
+    """
+    stats = profile_stats.get(name)
+    if stats is None:
+        stats = profile_stats[name] = [0, 0., 0., 0]
+    stats[3] += 1
+    _child_times.append(0.)
+    start = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        child_time = _child_times.pop()
+        if _child_times:
+            _child_times[-1] += elapsed
+        stats[0] += 1
+        stats[2] += elapsed - child_time
+        stats[3] -= 1
+        if stats[3] == 0:
+            stats[1] += elapsed
+
+
+def set_profiling(enabled=True):
+    """
+    Switches the profiling of the wrapped functions on or off at runtime.
+    :param enabled: BOOLEAN, True to accumulate the calls and times of the wrapped functions
+    """
+    global profiling
+    profiling = enabled
+
+
+def configure_log_file():
+    """
+    Adds a handler that writes all messages (including the DEBUG messages of the wrapper) to the logfile, if it was not
+    added yet.
+    """
+    global file_handler
+    if file_handler is not None:
+        return
+    file_handler = logging.FileHandler(log_file, mode="a")
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(log_format)
+    logger.addHandler(file_handler)
+    logger.setLevel(logging.DEBUG)
+
+
+def set_log_calls(enabled=True):
+    """
+    Switches the logging of each call of the wrapped functions on or off at runtime (and opens the logfile).
+    :param enabled: BOOLEAN, True to call the pre and post functions of the wrapper for each call
+    """
+    global log_calls
+    if enabled:
+        configure_log_file()
+    log_calls = enabled
+
+
+def take_profile():
+    """
+    Get the calls and times accumulated so far and delete them (e.g. in a worker process, so each task only returns the
+    profile of its own calls).
+    :return: DICT with {"module.function": [calls, cumulative time (s), self time (s)]}
+    """
+    stats = {name: s[:3] for name, s in profile_stats.items() if s[0]}
+    profile_stats.clear()
+    return stats
+
+
+def merge_profile(stats):
+    """
+    Add the calls and times of another process (see 'take_profile') to the profile of this process.
+    :param stats: DICT with {"module.function": [calls, cumulative time (s), self time (s)]}
+    """
+    for name, (calls, cumulative, self_time) in stats.items():
+        total = profile_stats.get(name)
+        if total is None:
+            total = profile_stats[name] = [0, 0., 0., 0]
+        total[0] += calls
+        total[1] += cumulative
+        total[2] += self_time
+
+
+def reset_profile():
+    """
+    Deletes the calls and times accumulated so far.
+    """
+    profile_stats.clear()
+
+
+def profile_summary(sort="cumulative"):
+    """
+    Get the accumulated profile of the wrapped functions.
+    :param sort: STR with the column by which to sort the functions (descending): 'calls', 'cumulative' or 'self'
+    :return: LIST of DICTS with the function name, number of calls, cumulative time, self time and time per call (s)
+    """
+    rows = [{"function": name, "calls": s[0], "cumulative": s[1], "self": s[2],
+             "per_call": s[1] / s[0] if s[0] else 0.} for name, s in profile_stats.items()]
+    return sorted(rows, key=lambda row: row[sort], reverse=True)
+
+
+def print_profile(sort="cumulative"):
+    """
+    Print (and log) the accumulated profile of the wrapped functions as a table.
+    :param sort: STR with the column by which to sort the functions (descending): 'calls', 'cumulative' or 'self'
+    """
+    rows = profile_summary(sort)
+    if not rows:
+        return
+    lines = ["{:<45}{:>10}{:>16}{:>12}{:>16}".format("Function", "Calls", "Cumulative (s)", "Self (s)",
+                                                     "Per call (ms)")]
+    for row in rows:
+        lines.append("{:<45}{:>10}{:>16.3f}{:>12.3f}{:>16.3f}".format(row["function"], row["calls"],
+                                                                      row["cumulative"], row["self"],
+                                                                      row["per_call"] * 1000))
+    logger.info("Profile of the snow melt functions:\n" + "\n".join(lines))
+
+
 def entering(function):
     """
     Function that logs when a wrapped function is called / entered
@@ -1,5 +1,8 @@
+import checkpoints
 import config_input
 import file_management
+import raster_metadata
+import snowpack
 from fun import *
 from package_handling import *
 from zon_statistics import *
@@ -79,21 +82,17 @@ def snowcalc_over_list(initial_snow, satellite_data, measured_snow_next_period):
 
 
 @wrapper(entering, exiting)
-def filter_raster_lists(ras_list):
+def filter_raster_lists(folder):
     """
-    Function filters input list to only include dates in between the start and end date (analysis range). If there are
-    no files for the given date range (new_list is empty), function throws an error.
+    Function gets, from the file catalog of the input folder, the .tif files whose dates are in between the start and
+    end date (analysis range). If there are no files for the given date range (new_list is empty), function throws an
+    error.
     [Author: María Fernanda Morales]
-    :param ras_list: list with file paths, whose names contain the date in either YYYYMM or YYMM format
-    :return: filtered list, without the files that are not within the analysis date range.
+    :param folder: folder path with files whose names contain the date in either YYYYMM or YYMM format
+    :return: list with the files within the analysis date range, sorted by date.
     """
-    new_list = []
-    for elem in ras_list:
-        data_manager = DataManagement(
-            path=r'' + os.path.abspath('../Results'), filename=elem)
-        date = data_manager.get_date_format()
-        if config_input.start_date <= date <= config_input.end_date:
-            new_list.append(elem)
+    new_list = file_management.get_catalog(folder, ".tif").range_files(config_input.start_date,
+                                                                       config_input.end_date)
 
     if len(new_list) == 0:
         message = "There are no input files corresponding to the onput date range. Check input."
@@ -116,14 +115,10 @@ def filter_raster_lists(ras_list):
 
 @wrapper(entering, exiting)
 def process_snow_melt():
-    # Get all file paths into a list: All raster files must be .tif format
+    # Get the file paths corresponding to the analysis date range into a list: All raster files must be .tif format
     #   CHANGE: input file names
-    snow_mm_paths = sorted(glob.glob(file_management.snow_raster_path + "/*.tif"))
-    snow_cover_paths = sorted(glob.glob(file_management.snow_cover_path + "/*.tif"))
-
-    # Filter file lists to include only files corresponding to the analysis date range: CHANGE
-    snow_mm_paths = filter_raster_lists(snow_mm_paths)
-    snow_cover_paths = filter_raster_lists(snow_cover_paths)
+    snow_mm_paths = filter_raster_lists(file_management.snow_raster_path)
+    snow_cover_paths = filter_raster_lists(file_management.snow_cover_path)
 
     # Create folder if it does not already exist
     data_manager = DataManagement(path=config_input.results_path, filename=snow_mm_paths[0])
@@ -135,40 +130,80 @@ def process_snow_melt():
         compare_date(snow_mm_paths[i], snow_cover_paths[i])
         i += 1
 
-    # loop through input raster files, write raster arrays and corresponding dates in lists
-    date, snow_mm, snow_cover = raster2list(snow_mm_paths, snow_cover_paths)
+    # Dates of the input rasters [YYYYmm]
+    date = [[DataManagement(path=config_input.results_path, filename=path).create_date_string()]
+            for path in snow_mm_paths]
 
-    # get projection and geotransformation of input raster
-    gt, proj = data_manager.get_proj_data()
+    if config_input.snow_melt_tile_size:
+        # Tiled calculation: each tile is read, calculated and saved for all months (see snowpack.process_tiled)
+        gt, proj = data_manager.get_proj_data()
+        # All rasters must have the same grid, since the same window is read from each raster
+        errors, warnings = raster_metadata.validate_rasters(snow_mm_paths + snow_cover_paths)
+        if errors:
+            sys.exit("The snow and snow cover rasters cannot be calculated tile by tile:\n" + "\n".join(errors))
+        snow_end_paths = [os.path.join(config_input.results_path, 'Snow_end_month', f'snow_end_month_{d[0]}.tif')
+                          for d in date]
+        snow_melt_paths = [os.path.join(config_input.results_path, 'Snowmelt', f'snowmelt_{d[0]}.tif') for d in date]
+        snowpack.process_tiled(snow_mm_paths, snow_cover_paths, snow_end_paths, snow_melt_paths, gt, proj,
+                               config_input.snow_melt_tile_size, config_input.snow_melt_tile_workers)
+        for d in date:
+            # The snow state is not saved (the complete rasters are never in memory): the next months are continued
+            # from the 'Snow_end_month' rasters, which have the same values
+            month = file_management.get_date(str(d[0]))
+            checkpoints.discard_snow_state(month)
+            checkpoints.mark_complete("snow_melt", month)
+    else:
+        # Read the input rasters of all months into (months, rows, columns) stacks
+        snow_mm = snowpack.read_stack(snow_mm_paths, 'snow')
+        snow_cover = snowpack.read_stack(snow_cover_paths, 'snow_cover')
 
-    # Check input data
-    j = 0
-    for file in snow_mm:
-        check_data(snow_mm[j], snow_cover[j], snow_mm_paths[j],
-                   snow_cover_paths[j], snow_mm_paths, snow_cover_paths)
-        j += 1
+        # get projection and geotransformation of input raster
+        gt, proj = data_manager.get_proj_data()
 
-    # Calculations
-    snow_end_month, snow_melt = snowcalc_over_list(
-        snow_mm[0], snow_cover, snow_mm)
+        # Check input data
+        for j in range(len(snow_mm_paths)):
+            check_data(snow_mm[j], snow_cover[j], snow_mm_paths[j],
+                       snow_cover_paths[j], snow_mm_paths, snow_cover_paths)
 
-    # Saving arrays as raster
-    k = 0
-    for entry in snow_melt:
-        # save_path = r'' + os.path.abspath('../Results/Snow_end_month') + "/snow_end_month" + str(date[k][0]) + ".tif"
-        save_path = os.path.join(
-            config_input.results_path, 'Snow_end_month', f'snow_end_month_{str(date[k][0])}.tif')
-        DataManagement.save_raster(save_path, snow_end_month[k], gt, proj)
+        # Calculations: snow at the end of each month and snow melt of each month, in one loop over the months
+        snow_end_month = snowpack.empty_stack(snow_mm.shape, 'snow_end_month')
+        snow_melt = snowpack.empty_stack(snow_mm.shape, 'snow_melt')
+        snowpack.snowpack_sweep(snow_mm, snow_cover, snow_end=snow_end_month, snow_melt=snow_melt)
+
+        # Saving arrays as raster
+        for k in range(len(date)):
+            save_path = os.path.join(
+                config_input.results_path, 'Snow_end_month', f'snow_end_month_{str(date[k][0])}.tif')
+            DataManagement.save_raster(save_path, snow_end_month[k], gt, proj)
+
+            save_path = os.path.join(
+                config_input.results_path, 'Snowmelt', f'snowmelt_{str(date[k][0])}.tif')
+            DataManagement.save_raster(save_path, snow_melt[k], gt, proj)
+
+            # Checkpoint: save the snow carried over to the next month and the month's completion marker
+            month = file_management.get_date(str(date[k][0]))
+            checkpoints.save_snow_state(month, snow_end_month[k])
+            checkpoints.mark_complete("snow_melt", month)
 
-        save_path = os.path.join(
-            config_input.results_path, 'Snowmelt', f'snowmelt_{str(date[k][0])}.tif')
-        DataManagement.save_raster(save_path, snow_melt[k], gt, proj)
-        k += 1
+        # Release (and delete) the stacks
+        del snow_mm, snow_cover, snow_end_month, snow_melt
+        snowpack.remove_stacks()
 
+    # Calculate and plot zonal statistics
+    snow_melt_statistics(date)
+    print("Total time: ", time.time() - start_time, "seconds")
+    # stop logging
+    logging.shutdown()
+
+
+@wrapper(entering, exiting)
+def snow_melt_statistics(date):
+    """
+    Calculate (and plot, if plot_statistic is enabled) the zonal statistics of the snow at the end of each month.
+    :param date: LIST which contains the year and month [YYYYmm] of each month in the analysis date range
+    """
     # Path to calculated results to be used for statistical calculations
-    snow_result_paths = sorted(
-        glob.glob(config_input.results_path + '/Snow_end_month' + "/*.tif"))
-    snow_result_paths = filter_raster_lists(snow_result_paths)
+    snow_result_paths = filter_raster_lists(config_input.results_path + '/Snow_end_month')
     # Calculate and plot zonal statistics
     zonal_statistics = ZonStatistics(path_raster=snow_result_paths, shape=config_input.shape_zone, datelist=date,
                                      parameter=config_input.statistical_param)
@@ -178,10 +213,68 @@ def process_snow_melt():
         zonal_statistics.plot_zon_statistics()
     else:
         logger.info("Plot statistic is disabled")
-    print("Total time: ", time.time() - start_time, "seconds")
-    # stop logging
-    logging.shutdown()
+
+
+@wrapper(entering, exiting)
+def process_snow_melt_month(month):
+    """
+    Calculate the snow at the end of the month and the snow melt for a single month and save both rasters. The snow at
+    the start of the month is the snow of the month plus the snow at the end of the previous month, which is read from
+    snow state saved in the checkpoints of the previous month or, if there is none, from the 'Snow_end_month' results
+    folder (for the first month of the analysis date range, it is only the snow of the month). The months must
+    therefore be calculated in order. The results are the same as with process_snow_melt().
+    :param month: DATETIME of month to calculate
+    """
+    # Get the input snow and snow cover rasters for the given month
+    snow_mm_path = file_management.get_month_file(file_management.snow_raster_path, month, "snow")
+    snow_cover_path = file_management.get_month_file(file_management.snow_cover_path, month, "snow cover")
+    compare_date(snow_mm_path, snow_cover_path)
+
+    # Create result folder if it does not already exist
+    snow_end_folder = os.path.join(config_input.results_path, 'Snow_end_month')
+    file_management.create_folder(snow_end_folder)
+    file_management.create_folder(os.path.join(config_input.results_path, 'Snowmelt'))
+
+    # Read input arrays and check input data
+    datatype, snow_mm, geotransform = gu.raster2array(snow_mm_path)
+    datatype2, snow_cover, geotransform2 = gu.raster2array(snow_cover_path)
+    check_data(snow_mm, snow_cover, snow_mm_path, snow_cover_path, [snow_mm_path], [snow_cover_path])
+
+    # Snow at the start of the month: add snow at the end of the previous month (if it is not the first month)
+    if (month.year, month.month) > (config_input.start_date.year, config_input.start_date.month):
+        previous_date = month.replace(day=1) - datetime.timedelta(days=1)
+        previous_month = previous_date.strftime('%Y%m')
+        previous_path = os.path.join(snow_end_folder, f'snow_end_month_{previous_month}.tif')
+        # Snow state saved in the checkpoints (same precision as the snow melt recursion in process_snow_melt)
+        snow_end_previous = checkpoints.load_snow_state(previous_date)
+        if snow_end_previous is None:
+            if not os.path.exists(previous_path):
+                message = "There is no snow at the end of the month raster for {}, which is needed to calculate the " \
+                          "snow melt for {}. Calculate the previous months first.".format(previous_month,
+                                                                                        month.strftime('%Y%m'))
+                sys.exit(message)
+            datatype3, snow_end_previous, geotransform3 = gu.raster2array(previous_path)
+        snow_start = snow_mm + snow_end_previous
+    else:
+        snow_start = snow_mm
+
+    # Calculations
+    snow_end_array, snowmelt_array, snow_start_array = snowdepth(snow_start, snow_mm, snow_cover)
+
+    # Saving arrays as raster
+    gt, proj = DataManagement(path=config_input.results_path, filename=snow_mm_path).get_proj_data()
+    month_year = month.strftime('%Y%m')
+    DataManagement.save_raster(os.path.join(snow_end_folder, f'snow_end_month_{month_year}.tif'),
+                               snow_end_array, gt, proj)
+    DataManagement.save_raster(os.path.join(config_input.results_path, 'Snowmelt', f'snowmelt_{month_year}.tif'),
+                               snowmelt_array, gt, proj)
+
+    # Checkpoint: save the snow carried over to the next month and the month's completion marker
+    checkpoints.save_snow_state(month, snow_end_array)
+    checkpoints.mark_complete("snow_melt", month)
 
 
 if __name__ == '__main__':
+    # Log to the logfile when the snow melt is run on its own
+    configure_log_file()
     main()
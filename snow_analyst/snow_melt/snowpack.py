@@ -0,0 +1,243 @@
+"""
+Snow balance of the monthly snow melt model (snow_melt_main.py) for all months at once: the snow rasters and the binary
+snow cover rasters of all months are read into two stacks (months, rows, columns) and the snow at the end of each
+month and the snow melt of each month are calculated in one loop over the months, into preallocated stacks:
+    snow at the start of month k:   start_k = snow_k + end_(k-1)            (start_0 = snow_0)
+    snow at the end of month k:     end_k = start_k * snow cover_k
+    snow melt of month k:           melt_k = start_k - end_k
+Each month is calculated for all cells at once with in-place numpy operations, with no temporary arrays, so the results
+are the same as with 'snowcalc_over_list' (fun.snowdepth), which creates one ArrayCalculations object per month.
+
+If 'snow_melt_memmap' in config_input is True, the stacks are memory-mapped .npy files in the 'snowpack_stacks' folder
+in the results folder (deleted at the end of the calculation), so only the month that is being calculated has to fit
+in memory.
+
+If 'snow_melt_tile_size' in config_input is set, the rasters are instead calculated tile by tile (see 'process_tiled'):
+each tile is read for all months, so memory use depends on the tile size and the number of months, not on the raster
+size, and the tiles can be calculated in parallel processes ('snow_melt_tile_workers').
+"""
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import config_input
+import raster_calculations as rc
+from log import *
+from package_handling import *
+
+
+def stack_folder():
+    """
+    Get the folder of the memory-mapped stacks (and create it, if it does not exist).
+    :return: STR of the folder path
+    """
+    folder = os.path.join(config_input.results_path, 'snowpack_stacks')
+    if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def empty_stack(shape, name=None):
+    """
+    Allocate an (uninitialized) float32 stack: in memory or, if 'snow_melt_memmap' in config_input is True, as a
+    memory-mapped .npy file in the stack folder.
+    :param shape: TUPLE (months, rows, columns)
+    :param name: STR with the name of the .npy file (without extension), only used for memory-mapped stacks
+    :return: ARRAY (months, rows, columns) of float32
+    """
+    if config_input.snow_melt_memmap and name is not None:
+        return np.lib.format.open_memmap(os.path.join(stack_folder(), name + '.npy'), mode='w+', dtype=np.float32,
+                                         shape=shape)
+    return np.empty(shape, dtype=np.float32)
+
+
+def remove_stacks():
+    """
+    Delete the memory-mapped stacks (and their folder) from the results folder.
+    """
+    folder = os.path.join(config_input.results_path, 'snowpack_stacks')
+    if os.path.exists(folder):
+        for file in glob.glob(os.path.join(folder, '*.npy')):
+            os.remove(file)
+        os.rmdir(folder)
+
+
+@wrapper(entering, exiting)
+def read_stack(raster_paths, name=None):
+    """
+    Read a raster per month into a stack, one raster after the other into the preallocated stack, with np.nan in the
+    no data cells (see raster_calculations.band_to_nan_array).
+    :param raster_paths: LIST of paths to the raster files, sorted by date (all with the same size)
+    :param name: STR with the name of the stack file, if the stack is memory-mapped (see 'empty_stack')
+    :return: ARRAY (months, rows, columns) of float32
+    """
+    raster = gdal.Open(raster_paths[0])
+    stack = empty_stack((len(raster_paths), raster.RasterYSize, raster.RasterXSize), name)
+    raster = None
+    for i, path in enumerate(raster_paths):
+        raster = gdal.Open(path)
+        if (raster.RasterYSize, raster.RasterXSize) != stack.shape[1:]:
+            message = "The raster {} has {} rows x {} columns, but {} has {} rows x {} columns. Check input " \
+                      "rasters.".format(path, raster.RasterYSize, raster.RasterXSize, raster_paths[0], stack.shape[1],
+                                        stack.shape[2])
+            sys.exit(message)
+        rc.band_to_nan_array(raster.GetRasterBand(1), out=stack[i])
+        raster = None
+    return stack
+
+
+@wrapper(entering, exiting)
+def snowpack_sweep(snow, snow_cover, initial_snow=None, snow_end=None, snow_melt=None):
+    """
+    Calculate the snow at the end of each month and the snow melt of each month in one loop over the months.
+    :param snow: ARRAY (months, rows, columns) of snow of each month
+    :param snow_cover: ARRAY (months, rows, columns) of snow cover of each month (1 = snow, 0 = no snow)
+    :param initial_snow: ARRAY (rows, columns) of snow at the end of the month before the first month (optional, no
+    snow if None)
+    :param snow_end: ARRAY (months, rows, columns) into which to write the snow at the end of each month (optional,
+    allocated if None)
+    :param snow_melt: ARRAY (months, rows, columns) into which to write the snow melt of each month (optional,
+    allocated if None)
+    :return: [snow_end: ARRAY (months, rows, columns) of snow at the end of each month
+             snow_melt: ARRAY (months, rows, columns) of snow melt of each month]
+    """
+    if snow.shape != snow_cover.shape:
+        message = "The snow stack {} and the snow cover stack {} have different shapes. Check input " \
+                  "rasters.".format(snow.shape, snow_cover.shape)
+        sys.exit(message)
+    if snow_end is None:
+        snow_end = np.empty(snow.shape, dtype=np.result_type(snow, snow_cover))
+    if snow_melt is None:
+        snow_melt = np.empty_like(snow_end)
+
+    # Snow at the start of the month (one month only)
+    snow_start = np.empty(snow.shape[1:], dtype=snow_end.dtype)
+    for k in range(snow.shape[0]):
+        if k > 0:
+            np.add(snow[k], snow_end[k - 1], out=snow_start)
+        elif initial_snow is not None:
+            np.add(snow[0], initial_snow, out=snow_start)
+        else:
+            snow_start[...] = snow[0]
+        np.multiply(snow_start, snow_cover[k], out=snow_end[k])
+        np.subtract(snow_start, snow_end[k], out=snow_melt[k])
+    return snow_end, snow_melt
+
+
+def read_tile(raster_paths, window):
+    """
+    Read the same window of a raster per month into a (months, rows, columns) stack.
+    :param raster_paths: LIST of paths to the raster files, sorted by date (all with the same size)
+    :param window: TUPLE (x offset, y offset, number of columns, number of rows) of the window
+    :return: ARRAY (months, window rows, window columns) of float32
+    """
+    stack = np.empty((len(raster_paths), window[3], window[2]), dtype=np.float32)
+    for i, path in enumerate(raster_paths):
+        raster = gdal.Open(path)
+        rc.band_to_nan_array(raster.GetRasterBand(1), window, out=stack[i])
+        raster = None
+    return stack
+
+
+def sweep_tile(window, snow_paths, snow_cover_paths):
+    """
+    Calculate the snow at the end of each month and the snow melt of each month for one tile (window) of the rasters,
+    over all months. Runs in a worker process in 'process_tiled' (it only reads the input rasters).
+    :param window: TUPLE (x offset, y offset, number of columns, number of rows) of the tile
+    :param snow_paths: LIST of paths to the snow rasters, sorted by date
+    :param snow_cover_paths: LIST of paths to the snow cover rasters, sorted by date
+    :return: [window: TUPLE of the tile
+             snow_end: ARRAY (months, tile rows, tile columns) of snow at the end of each month
+             snow_melt: ARRAY (months, tile rows, tile columns) of snow melt of each month]
+    """
+    snow_end, snow_melt = snowpack_sweep(read_tile(snow_paths, window), read_tile(snow_cover_paths, window))
+    return window, snow_end, snow_melt
+
+
+def create_output(path, x_size, y_size, gt, proj):
+    """
+    Create an empty float32 raster (np.nan as no data value), into which the tiles are then written.
+    :param path: STR of path and result filename
+    :param x_size: INT with the number of columns
+    :param y_size: INT with the number of rows
+    :param gt: TUPLE defining a gdal.DataSet.GetGeoTransform object
+    :param proj: STR defining a gdal.DataSet.GetProjection object
+    """
+    driver = gdal.GetDriverByName("GTiff")
+    outrs = driver.Create(path, xsize=x_size, ysize=y_size, bands=1, eType=gdal.GDT_Float32)
+    outrs.SetGeoTransform(gt)
+    outrs.SetProjection(proj)
+    outrs.GetRasterBand(1).SetNoDataValue(np.nan)
+    outrs = None
+
+
+def write_tile(paths, window, stack):
+    """
+    Write a tile of each month into the corresponding (existing) output raster.
+    :param paths: LIST of paths to the output rasters, one per month
+    :param window: TUPLE (x offset, y offset, number of columns, number of rows) of the tile
+    :param stack: ARRAY (months, tile rows, tile columns) with the tile of each month
+    """
+    for i, path in enumerate(paths):
+        outrs = gdal.Open(path, gdal.GA_Update)
+        outrs.GetRasterBand(1).WriteArray(stack[i], window[0], window[1])
+        outrs = None
+
+
+@wrapper(entering, exiting)
+def process_tiled(snow_paths, snow_cover_paths, snow_end_paths, snow_melt_paths, gt, proj, tile_size, workers=1):
+    """
+    Calculate and save the snow at the end of each month and the snow melt of each month tile by tile: each tile of
+    about tile_size x tile_size cells is read for all months, calculated with 'snowpack_sweep' and written into the
+    output rasters of all months. The snow balance of each cell does not depend on the other cells, so the results are
+    the same as with 'snowpack_sweep' for the complete rasters, but only about 4 x months x tile_size x tile_size
+    float32 values per process are in memory at a time. With more than 1 worker, the tiles are calculated in parallel
+    in a process pool (at most 2 tiles per worker at a time), and the main process writes the tiles into the output
+    rasters.
+    :param snow_paths: LIST of paths to the snow rasters, sorted by date
+    :param snow_cover_paths: LIST of paths to the snow cover rasters, sorted by date
+    :param snow_end_paths: LIST of paths of the snow at the end of month rasters to save, one per month
+    :param snow_melt_paths: LIST of paths of the snow melt rasters to save, one per month
+    :param gt: TUPLE defining a gdal.DataSet.GetGeoTransform object
+    :param proj: STR defining a gdal.DataSet.GetProjection object
+    :param tile_size: INT with the approximate number of rows and columns of each tile
+    :param workers: INT with the number of processes with which to calculate the tiles
+    """
+    raster = gdal.Open(snow_paths[0])
+    x_size, y_size = raster.RasterXSize, raster.RasterYSize
+    raster = None
+    for path in snow_end_paths + snow_melt_paths:
+        create_output(path, x_size, y_size, gt, proj)
+
+    windows = rc.block_windows(snow_paths[0], tile_size)
+    if workers > 1:
+        # Only 2 tiles per worker are submitted at a time, and each tile is dropped as soon as it is written, so the
+        # results of at most 2 x workers tiles are in the main process
+        pending = iter(windows)
+        running = set()
+        with ProcessPoolExecutor(max_workers=workers) as executor, \
+                tqdm(total=len(windows), desc="Snow melt tiles") as progress:
+            while True:
+                for window in pending:
+                    running.add(executor.submit(sweep_tile, window, snow_paths, snow_cover_paths))
+                    if len(running) >= 2 * workers:
+                        break
+                if not running:
+                    break
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    window, snow_end, snow_melt = future.result()
+                    write_tile(snow_end_paths, window, snow_end)
+                    write_tile(snow_melt_paths, window, snow_melt)
+                    progress.update(1)
+                finished = None
+    else:
+        for window in tqdm(windows, desc="Snow melt tiles"):
+            window, snow_end, snow_melt = sweep_tile(window, snow_paths, snow_cover_paths)
+            write_tile(snow_end_paths, window, snow_end)
+            write_tile(snow_melt_paths, window, snow_melt)
+
+    # Compute standard raster statistics of the complete output rasters
+    for path in snow_end_paths + snow_melt_paths:
+        outrs = gdal.Open(path, gdal.GA_Update)
+        outrs.GetRasterBand(1).ComputeStatistics(0)
+        outrs = None
@@ -0,0 +1,221 @@
+"""
+Time-series output: the monthly result rasters of each product (one single band .tif file per month) are stacked into
+one multi-band GeoTIFF per product and year, with one band per month (band description and 'DATE' metadata item:
+YYYYMM), in the 'time_series' folder in the results folder:
+    Snow_YYYY.tif, Rain_YYYY.tif, SnowCover_YYYY.tif, snowmelt_YYYY.tif, RFactor_REM_db_YYYY.tif, RFactor_total_YYYY.tif
+
+The GeoTIFFs are tiled ('time_series_block_size' x 'time_series_block_size' cells) and pixel interleaved, so each tile
+of the file holds all months of its cells: a map (one band) is read tile by tile, as from a single band file, and the
+time series of a cell (all bands) is read from a single tile, instead of opening one file per month.
+
+The yearly files are written tile by tile (reading the same window of all monthly rasters of the year), so only one
+tile of each month is in memory. The monthly rasters are not deleted, since the other modules read them.
+"""
+
+import config_input
+import file_management
+import raster_calculations as rc
+from package_handling import *
+
+# Products: name of the time series file, name of the folder path variable in file_management and prefix of the monthly
+# raster files (files in the same folder with other names, e.g. 'OriginalSnow_YYYYMM.tif', are not included)
+products = {"Snow": ("snow_raster_path", "Snow_"),
+            "Rain": ("rain_raster_path", "Rain_"),
+            "SnowCover": ("snow_cover_path", "SnowCover_"),
+            "snowmelt": ("snow_melt_path", "snowmelt_"),
+            "RFactor_REM_db": ("r_factor_path", "RFactor_REM_db_"),
+            "RFactor_total": ("total_factor_path", "RFactor_total_")}
+
+
+def time_series_folder():
+    """
+    Gets the folder of the time series files (and creates it, if it does not exist).
+
+    :return: folder path
+    """
+    folder = os.path.join(config_input.results_path, "time_series")
+    file_management.create_folder(folder)
+    return folder
+
+
+def time_series_path(product, year):
+    """
+    Gets the path of the time series file of a product and year.
+
+    :param product: string with the product name (key of 'products')
+    :param year: int, year
+    :return: path of the .tif file
+    """
+    return os.path.join(time_series_folder(), "{}_{}.tif".format(product, year))
+
+
+def product_files(product, date1, date2):
+    """
+    Gets the monthly rasters of a product whose dates are in between 2 dates (both included).
+
+    :param product: string with the product name (key of 'products')
+    :param date1: start date (in datetime format)
+    :param date2: end date (in datetime format)
+    :return: list with a (date, path) tuple for each month with a raster, sorted by date
+    """
+    folder_variable, prefix = products[product]
+    folder = getattr(file_management, folder_variable, None)
+    if not folder or not os.path.isdir(folder):
+        return []
+    pattern = re.compile(re.escape(prefix) + r"\d{4,6}\.tif$", re.IGNORECASE)
+    files = []
+    for path in file_management.get_catalog(folder).range_files(date1, date2):
+        if not pattern.match(os.path.basename(path)):
+            continue
+        date = file_management.get_date(path)
+        if files and files[-1][0].strftime('%Y%m') == date.strftime('%Y%m'):
+            message = "ERROR: There is more than one {} raster file for {} in '{}'. Check input.".format(
+                product, date.strftime('%Y%m'), folder)
+            sys.exit(message)
+        files.append((date, path))
+    return files
+
+
+def year_files(product, year):
+    """
+    Gets the monthly rasters of a product for all months of a year which are in the analysis date range.
+
+    :param product: string with the product name (key of 'products')
+    :param year: int, year
+    :return: list with a (date, path) tuple for each month with a raster, sorted by date
+    """
+    date1 = max(datetime.datetime(year, 1, 1), config_input.start_date.replace(day=1))
+    date2 = min(datetime.datetime(year, 12, 31, 23, 59, 59), config_input.end_date)
+    return product_files(product, date1, date2)
+
+
+def create_time_series(path, dates, x_size, y_size, gt, proj):
+    """
+    Creates an empty, tiled and pixel interleaved float32 GeoTIFF with one band per month (np.nan as no data value),
+    into which the monthly rasters are then written tile by tile.
+
+    :param path: file name (with path and extension) of the time series file
+    :param dates: list with the date (in datetime format) of each band
+    :param x_size: int, number of columns
+    :param y_size: int, number of rows
+    :param gt: geotransform of the rasters
+    :param proj: projection of the rasters
+    :return: gdal dataset of the created file
+    """
+    # GeoTIFF tiles must be a multiple of 16 cells
+    block = max(16, int(config_input.time_series_block_size) // 16 * 16)
+    options = ["TILED=YES", "BLOCKXSIZE={}".format(block), "BLOCKYSIZE={}".format(block), "INTERLEAVE=PIXEL",
+               "BIGTIFF=IF_SAFER"]
+    if config_input.time_series_compress:
+        options += ["COMPRESS={}".format(config_input.time_series_compress), "PREDICTOR=3"]
+
+    driver = gdal.GetDriverByName("GTiff")
+    outrs = driver.Create(path, xsize=x_size, ysize=y_size, bands=len(dates), eType=gdal.GDT_Float32, options=options)
+    outrs.SetGeoTransform(gt)
+    outrs.SetProjection(proj)
+    outrs.SetMetadataItem("TIME_AXIS", "band")
+    outrs.SetMetadataItem("DATES", ",".join(d.strftime('%Y%m') for d in dates))
+    for i, date in enumerate(dates):
+        band = outrs.GetRasterBand(i + 1)
+        band.SetNoDataValue(np.nan)
+        band.SetDescription(date.strftime('%Y%m'))
+        band.SetMetadataItem("DATE", date.strftime('%Y%m'))
+    return outrs
+
+
+def write_time_series(files, path):
+    """
+    Writes the monthly rasters of a product and year into a time series file, tile by tile: the same window of all
+    monthly rasters is read into a (months, rows, columns) array and written into all bands of the tile.
+
+    :param files: list with a (date, path) tuple for each month, sorted by date (all rasters with the same size)
+    :param path: file name (with path and extension) of the time series file
+    :return: ---
+    """
+    dates = [date for date, raster_path in files]
+    rasters = [gdal.Open(raster_path) for date, raster_path in files]
+    x_size, y_size = rasters[0].RasterXSize, rasters[0].RasterYSize
+    for (date, raster_path), raster in zip(files, rasters):
+        if (raster.RasterXSize, raster.RasterYSize) != (x_size, y_size):
+            message = "ERROR: The raster {} does not have the same size as {}. Check input rasters.".format(
+                raster_path, files[0][1])
+            sys.exit(message)
+    gt, proj = rc.get_raster_data(files[0][1])
+
+    tmp_path = path + ".tmp.tif"
+    outrs = create_time_series(tmp_path, dates, x_size, y_size, gt, proj)
+    # Windows of one tile of the time series file
+    x_block, y_block = outrs.GetRasterBand(1).GetBlockSize()
+    windows = [(x_off, y_off, min(x_block, x_size - x_off), min(y_block, y_size - y_off))
+               for y_off in range(0, y_size, y_block) for x_off in range(0, x_size, x_block)]
+    stack = None
+    for window in windows:
+        x_off, y_off, cols, rows = window
+        if stack is None or stack.shape[1:] != (rows, cols):
+            stack = np.empty((len(rasters), rows, cols), dtype=np.float32)
+        for i, raster in enumerate(rasters):
+            rc.band_to_nan_array(raster.GetRasterBand(1), window, out=stack[i])
+        for i in range(len(rasters)):
+            outrs.GetRasterBand(i + 1).WriteArray(stack[i], x_off, y_off)
+
+    for i in range(len(rasters)):
+        outrs.GetRasterBand(i + 1).ComputeStatistics(0)
+    outrs.FlushCache()
+    outrs = None
+    rasters = None
+    # The complete file replaces the previous file of the year at once, so an interrupted run leaves no partial file
+    os.replace(tmp_path, path)
+    print("Saved time series: ", os.path.basename(path))
+
+
+def save_time_series(date_list):
+    """
+    Writes the time series files of the products in 'time_series_products' (config_input) for all years of the months
+    in date_list. The file of each year contains all months of the year with a raster (in the analysis date range),
+    so it is written again when a month of the year is recalculated.
+
+    :param date_list: list with analysis dates (in datetime format)
+    :return: ---
+    """
+    years = sorted({d.year for d in date_list})
+    for product in config_input.time_series_products:
+        if product not in products:
+            message = "ERROR: '{}' in 'time_series_products' is not a product. Valid products: {}.".format(
+                product, ", ".join(products))
+            sys.exit(message)
+        for year in years:
+            files = year_files(product, year)
+            if not files:
+                continue
+            write_time_series(files, time_series_path(product, year))
+
+
+def read_time_series(product, year, window=None):
+    """
+    Reads a window of the time series file of a product and year (all months).
+
+    :param product: string with the product name (key of 'products')
+    :param year: int, year
+    :param window: tuple with (x offset, y offset, number of columns, number of rows) of the window to read (optional).
+    If None, the complete rasters are read.
+    :return: [list with the month (YYYYMM) of each band, np.float32 array (months, rows, columns) with np.nan in all no
+    data cells]
+    """
+    path = time_series_path(product, year)
+    if not os.path.exists(path):
+        message = "ERROR: There is no {} time series file for {} ('{}').".format(product, year, path)
+        sys.exit(message)
+    raster = gdal.Open(path)
+    if window is None:
+        window = (0, 0, raster.RasterXSize, raster.RasterYSize)
+    stack = np.empty((raster.RasterCount, window[3], window[2]), dtype=np.float32)
+    months = []
+    for i in range(raster.RasterCount):
+        band = raster.GetRasterBand(i + 1)
+        months.append(band.GetDescription())
+        rc.band_to_nan_array(band, window, out=stack[i])
+    return months, stack
+
+
+if __name__ == '__main__':
+    save_time_series(file_management.get_date_list(config_input.start_date, config_input.end_date))
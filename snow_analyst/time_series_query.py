@@ -0,0 +1,186 @@
+"""
+Time-series query: extracts the monthly values of the result products (see 'products' in time_series_output.py) at a
+list of points (e.g. gauge locations), for a date range, into a DataFrame with one row per point and month and one
+column per product.
+
+The point coordinates (in the coordinate system of the rasters) are converted to cell offsets all at once (vectorized
+geo_utils.dataset_mgmt.coords2offset), and the points are grouped by the internal block (tile or strip) of the raster
+in which they are located, so each block with points is read only once, and blocks without points are not read.
+If the yearly time series file of a product (time_series_output.py) exists, all months of the year are read from it
+(one read per block for all months); the months without a time series file are read from the monthly rasters.
+
+Usage: python time_series_query.py points.csv output.csv [--products RFactor_total snowmelt] [--start 2015-01]
+[--end 2020-12], where points.csv has the columns 'x' and 'y' (and, optionally, 'name').
+"""
+
+import argparse
+
+import config_input
+import file_management
+import raster_calculations as rc
+import time_series_output
+from package_handling import *
+
+
+def point_offsets(gt, x_size, y_size, x, y):
+    """
+    Gets the cell offsets of the points in a raster, and which points are in the raster.
+
+    :param gt: geotransform of the raster
+    :param x_size: int, number of columns of the raster
+    :param y_size: int, number of rows of the raster
+    :param x: np.array with the x coordinates of the points
+    :param y: np.array with the y coordinates of the points
+    :return: [np.array with the column of each point, np.array with the row of each point, boolean np.array, True for
+    the points in the raster]
+    """
+    cols, rows = gu.coords2offset(gt, x, y)
+    # Offsets are truncated towards zero, so points less than one cell before the origin would get offset 0
+    inside = ((x - gt[0]) / gt[1] >= 0) & ((y - gt[3]) / gt[5] >= 0) & (cols < x_size) & (rows < y_size)
+    return cols, rows, inside
+
+
+def sample_dataset(dataset, x, y, bands=None):
+    """
+    Reads the values of a raster (all or some of its bands) at the points. The points are grouped by the internal
+    block of the raster in which they are located, and each block with points is read once (for all bands).
+
+    :param dataset: gdal dataset of the raster
+    :param x: np.array with the x coordinates of the points
+    :param y: np.array with the y coordinates of the points
+    :param bands: list with the numbers (from 1) of the bands to read (optional). If None, all bands are read.
+    :return: np.float32 array (bands, points) with the values, with np.nan in no data cells and in the points outside
+    of the raster
+    """
+    if bands is None:
+        bands = list(range(1, dataset.RasterCount + 1))
+    x_size, y_size = dataset.RasterXSize, dataset.RasterYSize
+    values = np.full((len(bands), x.shape[0]), np.nan, dtype=np.float32)
+    cols, rows, inside = point_offsets(dataset.GetGeoTransform(), x_size, y_size, x, y)
+    if not np.any(inside):
+        return values
+
+    # Group the points by block: points sorted by block number, then split where the block number changes
+    x_block, y_block = dataset.GetRasterBand(bands[0]).GetBlockSize()
+    points = np.nonzero(inside)[0]
+    block_col = cols[points] // x_block
+    block_row = rows[points] // y_block
+    block_number = block_row * ((x_size + x_block - 1) // x_block) + block_col
+    order = np.argsort(block_number, kind="stable")
+    points, block_col, block_row, block_number = points[order], block_col[order], block_row[order], block_number[order]
+    starts = np.concatenate(([0], np.nonzero(np.diff(block_number))[0] + 1))
+    ends = np.concatenate((starts[1:], [points.shape[0]]))
+
+    for start, end in zip(starts, ends):
+        x_off = int(block_col[start]) * x_block
+        y_off = int(block_row[start]) * y_block
+        window = (x_off, y_off, min(x_block, x_size - x_off), min(y_block, y_size - y_off))
+        block_points = points[start:end]
+        for i, band in enumerate(bands):
+            block = rc.band_to_nan_array(dataset.GetRasterBand(band), window)
+            values[i, block_points] = block[rows[block_points] - y_off, cols[block_points] - x_off]
+    return values
+
+
+def time_series_bands(path, months):
+    """
+    Gets the bands of a yearly time series file for the input months.
+
+    :param path: path of the time series file
+    :param months: list with the months (YYYYMM) to read
+    :return: dictionary {month (YYYYMM): band number} for the months in the file
+    """
+    dataset = gdal.Open(path)
+    file_months = {dataset.GetRasterBand(i).GetDescription(): i for i in range(1, dataset.RasterCount + 1)}
+    return {month: file_months[month] for month in months if month in file_months}
+
+
+def query_product(product, x, y, dates):
+    """
+    Reads the monthly values of a product at the points.
+
+    :param product: string with the product name (key of 'products' in time_series_output.py)
+    :param x: np.array with the x coordinates of the points
+    :param y: np.array with the y coordinates of the points
+    :param dates: list with the months (in datetime format) to read, sorted by date
+    :return: np.float32 array (months, points) with the values (np.nan for months without raster)
+    """
+    months = [d.strftime('%Y%m') for d in dates]
+    position = {month: i for i, month in enumerate(months)}
+    values = np.full((len(months), x.shape[0]), np.nan, dtype=np.float32)
+
+    # 1. Yearly time series files (all months of the year with one read per block)
+    pending = set(months)
+    for year in sorted({d.year for d in dates}):
+        path = os.path.join(config_input.results_path, "time_series", "{}_{}.tif".format(product, year))
+        if not os.path.exists(path):
+            continue
+        bands = time_series_bands(path, [month for month in months if month[:4] == str(year)])
+        if not bands:
+            continue
+        year_values = sample_dataset(gdal.Open(path), x, y, list(bands.values()))
+        for i, month in enumerate(bands):
+            values[position[month]] = year_values[i]
+            pending.discard(month)
+
+    # 2. Monthly rasters (months without a time series file)
+    if pending:
+        for date, path in time_series_output.product_files(product, dates[0], dates[-1] + pd.offsets.MonthEnd(1)):
+            month = date.strftime('%Y%m')
+            if month in pending:
+                values[position[month]] = sample_dataset(gdal.Open(path), x, y)[0]
+    return values
+
+
+def query_points(points, products=None, date1=None, date2=None):
+    """
+    Extracts the monthly values of the products at the points for all months between 2 dates.
+
+    :param points: pd.DataFrame with the columns 'x' and 'y' (coordinates in the coordinate system of the rasters) and,
+    optionally, 'name'
+    :param products: list with the product names (keys of 'products' in time_series_output.py) (optional). If None, all
+    products.
+    :param date1: start date (in datetime format) (optional, default: start date in config_input)
+    :param date2: end date (in datetime format) (optional, default: end date in config_input)
+    :return: pd.DataFrame with the columns 'name' (or point number), 'x', 'y', 'date' and one column per product, with
+    one row per point and month (np.nan for no data)
+    """
+    if products is None:
+        products = list(time_series_output.products)
+    for product in products:
+        if product not in time_series_output.products:
+            message = "ERROR: '{}' is not a product. Valid products: {}.".format(
+                product, ", ".join(time_series_output.products))
+            sys.exit(message)
+    if not {"x", "y"}.issubset(points.columns):
+        sys.exit("ERROR: The points must have the columns 'x' and 'y'.")
+    date1 = (date1 if date1 is not None else config_input.start_date).replace(day=1)
+    date2 = date2 if date2 is not None else config_input.end_date
+    dates = list(file_management.get_date_list(date1, date2))
+
+    x = points["x"].to_numpy(dtype=np.float64)
+    y = points["y"].to_numpy(dtype=np.float64)
+    names = points["name"].to_numpy() if "name" in points.columns else np.arange(x.shape[0])
+
+    # One row per point and month (points first, then months)
+    result = pd.DataFrame({"name": np.repeat(names, len(dates)), "x": np.repeat(x, len(dates)),
+                           "y": np.repeat(y, len(dates)), "date": np.tile(np.array(dates), x.shape[0])})
+    for product in products:
+        print("Reading {} values at {} points".format(product, x.shape[0]))
+        result[product] = query_product(product, x, y, dates).T.ravel()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Extracts the monthly results at a list of points.")
+    parser.add_argument("points", help=".csv file with the columns 'x', 'y' and (optional) 'name'")
+    parser.add_argument("output", help=".csv file in which to save the values")
+    parser.add_argument("--products", nargs="+", default=None, help="products to read (default: all)")
+    parser.add_argument("--start", default=None, help="start month (YYYY-MM, default: start_date in config_input)")
+    parser.add_argument("--end", default=None, help="end month (YYYY-MM, default: end_date in config_input)")
+    args = parser.parse_args()
+
+    start = datetime.datetime.strptime(args.start, "%Y-%m") if args.start else None
+    end = file_management.get_date(args.end.replace("-", ""), end=True) if args.end else None
+    query_points(pd.read_csv(args.points), args.products, start, end).to_csv(args.output, index=False)
+    print("Saved time series: ", os.path.basename(args.output))
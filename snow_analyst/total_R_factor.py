@@ -6,25 +6,60 @@ total R factor as the sum of the R factors due to snow melt and precipitation. L
 the R factor values for each cell, for each month being analyzed.
 """
 
+import checkpoints
+import climatology
 import config_input
 import file_management
+import instrumentation
 import raster_calculations
 from package_handling import *
 
 
-def calculate_tot_R():
+def total_factor(s_array, r_array, snow_factor, out=None):
+    """
+    Calculates the total R factor as the sum of the R factor due to precipitation and the snow melt factor (snow melt
+    values multiplied by the snow factor). No data cells must be np.nan in both input arrays, and are np.nan in the
+    result.
+
+    :param s_array: np.array with snow melt values
+    :param r_array: np.array with R factor values (precipitation)
+    :param snow_factor: float, factor with which to multiply the snow melt values to get the snow melt factor
+    :param out: np.array in which to save the result (optional). It can be 's_array' itself to do the calculation in
+    place. If None, a new array is created.
+
+    :return: np.array with the total R factor values
+    """
+    out = np.multiply(s_array, snow_factor, out=out)
+    np.add(out, r_array, out=out)
+    return out
+
+
+def calculate_tot_R(date_list=None):
+    """
+    Calculates the monthly total R factor rasters from the R factor (precipitation) and snow melt rasters. Each month is
+    recorded in the run report (see instrumentation.py) and gets its completion marker (see checkpoints.py) when it is
+    saved.
+
+    :param date_list: (optional) list with the months (in datetime format) to calculate. If None, the total R factor is
+    calculated for all months in the analysis date range.
+
+    :return: ---
+    """
     print("Calculating total R factor")
-    # 1. Get lists with Rfactor and snow melt rasters
-    filenames_r_factor = sorted(glob.glob(file_management.r_factor_path + "/*.tif"))
-    filenames_snow_melt = sorted(glob.glob(file_management.snow_melt_path + "/*.tif"))
-
-    # 2. Filter precipitation raster list to only include rasters corresponding to the analysis date range
-    filenames_r_factor = file_management.filter_raster_lists(filenames_r_factor, config_input.start_date,
-                                                             config_input.end_date,
-                                                             "R factor")
-    filenames_snow_melt = file_management.filter_raster_lists(filenames_snow_melt, config_input.start_date,
-                                                              config_input.end_date,
-                                                              "snow melt")
+    # 1-2. Get lists with the Rfactor and snow melt rasters corresponding to the analysis date range or, if the input
+    # months are given, to each input month (in a parallel run, the rasters of the later months may not exist yet)
+    if date_list is None:
+        filenames_r_factor = file_management.filter_raster_lists(file_management.r_factor_path,
+                                                                 config_input.start_date, config_input.end_date,
+                                                                 "R factor")
+        filenames_snow_melt = file_management.filter_raster_lists(file_management.snow_melt_path,
+                                                                  config_input.start_date, config_input.end_date,
+                                                                  "snow melt")
+    else:
+        filenames_r_factor = [file_management.get_month_file(file_management.r_factor_path, d, "R factor")
+                              for d in date_list]
+        filenames_snow_melt = [file_management.get_month_file(file_management.snow_melt_path, d, "snow melt")
+                               for d in date_list]
 
     # 3. Check that files are in order and correspond to the same dates:
     file_management.compare_dates(filenames_r_factor, filenames_snow_melt, "R factor", "snow melt")
@@ -35,28 +70,35 @@ def calculate_tot_R():
     # 5. Get raster data (GEOtransform and projection from any raster:
     gt, proj = raster_calculations.get_raster_data(filenames_r_factor[0])
 
-    # 6. Loop through each file (date) in each raster list:
+    # 6. Loop through each file (date) in each raster list. The arrays are allocated in the first iteration and reused
+    # for the following ones
+    s_array = None
+    r_array = None
     for R, S in zip(filenames_r_factor, filenames_snow_melt):
         date = file_management.get_date(R)
 
-        # 6.1 Extract data from snow melt into masked array:
-        s_array = raster_calculations.raster_to_array(S, mask=True)
-
-        # 6.2 Extract data from R factor raster
-        r_array = raster_calculations.raster_to_array(R, mask=True)
+        with instrumentation.stage("total_factor", date):
+            # 6.1 Extract data from snow melt into an array (np.nan in no data cells):
+            s_array = raster_calculations.raster_to_nan_array(S, out=s_array)
 
-        # 6.3 Multiply snow melt raster by the snow multiplication factor to get snow melt factor
-        s_array = np.multiply(s_array, config_input.snow_factor)
+            # 6.2 Extract data from R factor raster
+            r_array = raster_calculations.raster_to_nan_array(R, out=r_array)
 
-        # 6.4 Add the R factor and S factor values:
-        total_factor = np.add(s_array, r_array)
+            # 6.3 Multiply snow melt raster by the snow multiplication factor to get snow melt factor and add the R
+            # factor values (in place, in the snow melt array). No data cells remain np.nan.
+            total = total_factor(s_array, r_array, config_input.snow_factor, out=s_array)
 
-        # 6.5 Unmask arrays: convert masked cells to np.nan
-        total_factor = np.where(total_factor.mask, np.nan, total_factor)
+            # 6.4 Save rasters:
+            output_name = os.path.join(file_management.total_factor_path,
+                                       f"RFactor_total_{str(date.strftime('%Y%m'))}.tif")
+            raster_calculations.save_raster(total, output_name, gt, proj, no_data=np.nan)
 
-        # 6.6 Save rasters:
-        output_name = os.path.join(file_management.total_factor_path, f"RFactor_total_{str(date.strftime('%Y%m'))}.tif")
-        raster_calculations.save_raster(total_factor, output_name, gt, proj, no_data=np.nan)
+            # 6.5 Add the month to the running climatology statistics (in a parallel run, the months are added at the
+            # end, see climatology.save_climatology, so the worker processes do not update the statistics at the same
+            # time)
+            if config_input.run_climatology and config_input.parallel_workers <= 1:
+                climatology.add_month(date, total)
+        checkpoints.mark_complete("total_factor", date)
 
 
 if __name__ == '__main__':
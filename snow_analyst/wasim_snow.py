@@ -2,45 +2,323 @@
 processes
 1. load snow storage rasters
 2. resample and snap snow storage rasters
+3. generate binary snow cover rasters (1: snow storage > 10 mm, 0: otherwise)
+
+If 'wasim_in_memory' in config_input is True, each snow storage raster is read once and resampled in memory, with the
+same interpolation as resampling.py (inverse distance to a power with nearest neighbors: power 2, max. 12 points within
+5000 m) and the same clipping to the shape: the nearest neighbors and weights of the output cells only depend on the
+WaSim grid and the snap raster grid, so they are calculated once (with a scipy cKDTree) and reused for all months. The
+resampled snow storage and the binary snow cover rasters are generated from the same array, and the months are
+processed in 'wasim_workers' processes. The values are interpolated directly at the snap raster cell centers (instead
+of on a gdal_grid raster which is then clipped), so they are close to, but not the same as, the values of
+resampling.main. Otherwise (default), each raster is resampled with resampling.main (gdal_grid and gdalwarp, through
+.csv, .vrt and .tif files).
 """
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
 import config_input
 import file_management
+import raster_calculations as rc
+import raster_metadata
 import resampling
 from package_handling import *
 
+# Interpolation parameters (same as the gdal_grid call in resampling.interpolate_points)
+idw_power = 2.
+idw_max_points = 12
+idw_radius = 5000.
+# Snow storage (mm) above which a cell is snow covered
+snow_threshold = 10
+# No data value of the resampled snow storage rasters (same as resampling.main)
+no_data = -9999.
+
+# Output grid after clipping to the shape: [gt, proj, BOOLEAN mask of the cells in the shape] (see 'clip_grid')
+_clip_grid = None
+# Nearest neighbors and weights of the output cells, for each WaSim grid (see 'get_interpolator')
+_interpolators = {}
+
+
+def process_wasim_month(snow_storage_path):
+    """Resamples one WaSim snow storage raster (.txt) to the snap raster and generates the corresponding binary snow
+    cover raster (1: snow storage > 10 mm, 0: otherwise).
+
+    :param snow_storage_path: path of the WaSim snow storage raster, with the date in the file name
+    :return: ---
+    """
+    # 1 Extract date from raster files
+    date = file_management.get_date(snow_storage_path)
+
+    # 2 Resample raster to sample resolution and save with the correct date (make function)
+    original_snow_storage_name = os.path.join(config_input.snow_wasim_path, snow_storage_path)
+    resampled_snow_storage = os.path.join(config_input.results_path, f'wasim',
+                                          f"Snow_WaSim_{str(date.strftime('%Y%m'))}.tif")
+    resampling.main(original_snow_storage_name, config_input.snapraster_path, config_input.shape_path,
+                    resampled_snow_storage)
+
+    # 3 create binary rasters to detect snow cover similar to satellite imagery
+    # 3.1 extract information
+    dataset, array, geotransform = gu.raster2array(
+        os.path.join(config_input.results_path, f'wasim', f"Snow_WaSim_{str(date.strftime('%Y%m'))}.tif"))
+
+    # 3.2 create binary raster using 10 mm threshold as snow cover
+    snowcover = np.where(array > 10, 1, 0)
+    binary_wasim = os.path.join(file_management.snow_cover_path,
+                                f"Snow_WaSim_binary_{str(date.strftime('%Y%m'))}.tif")
+    gu.create_raster(binary_wasim, snowcover, epsg=32634, nan_val=-9999, rdtype=gdal.GDT_UInt32,
+                     geo_info=geotransform)
+
+
+def clip_grid():
+    """Gets the grid of the resampled rasters: the snap raster grid clipped to the shape (as resampling.main does with
+    gdalwarp -crop_to_cutline), and the cells inside the shape. Calculated once per process.
+
+    :return: [gt, proj, np.array of booleans with True in the cells inside the shape]
+    """
+    global _clip_grid
+    if _clip_grid is None:
+        snap = raster_metadata.get_metadata(config_input.snapraster_path)
+        ones = gdal.GetDriverByName("MEM").Create("", snap.x_size, snap.y_size, 1, gdal.GDT_Float32)
+        ones.SetGeoTransform(snap.gt)
+        ones.SetProjection(snap.proj)
+        ones.GetRasterBand(1).Fill(1)
+        gdal.SetConfigOption("GDALWARP_IGNORE_BAD_CUTLINE", "YES")
+        clipped = gdal.Warp("", ones, format="MEM", cutlineDSName=config_input.shape_path, cropToCutline=True,
+                            dstNodata=no_data)
+        mask = clipped.GetRasterBand(1).ReadAsArray() == 1
+        _clip_grid = [clipped.GetGeoTransform(), clipped.GetProjection(), mask]
+        ones = clipped = None
+    return _clip_grid
+
+
+def get_interpolator(gt, valid, grid_gt, mask):
+    """Gets the nearest neighbors (max. idw_max_points within idw_radius) of each output cell among the WaSim cells with
+    data, and their inverse distance weights. They are calculated once per WaSim grid and set of cells with data, and
+    reused for all months.
+
+    :param gt: geotransform of the WaSim raster
+    :param valid: np.array of booleans with True in the WaSim cells with data
+    :param grid_gt: geotransform of the output grid
+    :param mask: np.array of booleans with True in the output cells to interpolate
+    :return: [np.array (output cells, neighbors) with the index of each neighbor among the WaSim cells with data,
+    np.array (output cells, neighbors) with the normalized weight of each neighbor (0 if there is no neighbor, so output
+    cells without WaSim cells within idw_radius get 0, as with gdal_grid)]
+    """
+    key = (tuple(gt), valid.shape, hashlib.sha1(np.packbits(valid).tobytes()).hexdigest())
+    if key in _interpolators:
+        return _interpolators[key]
+
+    # Coordinates of the centers of the WaSim cells with data and of the output cells
+    rows, cols = np.nonzero(valid)
+    source = np.column_stack((gt[0] + (cols + 0.5) * gt[1], gt[3] + (rows + 0.5) * gt[5]))
+    rows, cols = np.nonzero(mask)
+    target = np.column_stack((grid_gt[0] + (cols + 0.5) * grid_gt[1], grid_gt[3] + (rows + 0.5) * grid_gt[5]))
+
+    k = min(idw_max_points, source.shape[0])
+    distance, index = scipy.spatial.cKDTree(source).query(target, k=k, distance_upper_bound=idw_radius)
+    distance = distance.reshape(target.shape[0], k)
+    index = index.reshape(target.shape[0], k)
+
+    # Inverse distance weights (0 for missing neighbors). A cell on a WaSim cell center gets the value of that cell
+    found = np.isfinite(distance)
+    index[~found] = 0
+    with np.errstate(divide="ignore"):
+        weights = np.where(found, 1. / np.power(distance, idw_power), 0.)
+    exact = distance == 0
+    exact_rows = exact.any(axis=1)
+    weights[exact_rows] = exact[exact_rows]
+    total = weights.sum(axis=1, keepdims=True)
+    # Rows without neighbors keep weight 0 (value 0), as the cells without points within the radius of gdal_grid
+    np.divide(weights, total, out=weights, where=total > 0)
+
+    _interpolators[key] = [index, weights]
+    return _interpolators[key]
+
+
+def resample_in_memory(array, gt):
+    """Resamples a WaSim snow storage array to the snap raster grid, clipped to the shape, in memory (see
+    'get_interpolator').
+
+    :param array: np.array with the WaSim snow storage (np.nan in no data cells)
+    :param gt: geotransform of the WaSim raster
+    :return: [np.array with the resampled snow storage (np.nan outside the shape, 0 in cells without neighbors),
+    geotransform, projection]
+    """
+    valid = ~np.isnan(array)
+    grid_gt, proj, mask = clip_grid()
+
+    index, weights = get_interpolator(gt, valid, grid_gt, mask)
+    resampled = np.full(mask.shape, np.nan, dtype=np.float32)
+    resampled[mask] = np.einsum("ij,ij->i", weights, array[valid][index])
+    return resampled, grid_gt, proj
+
 
-def process_wasim_results():
-    # 1. Get all file paths into a list: All raster files must be .txt format
-    snow_raster_wasim_paths = sorted(glob.glob(config_input.snow_wasim_path + "/*.txt"))
+def resample_array(array, gt, save_path):
+    """Resamples a WaSim array (e.g. the mean snow storage of a month) to the snap raster grid, clipped to the shape,
+    and saves it: in memory if 'wasim_in_memory' in config_input is True, otherwise with resampling.main (the array is
+    first saved as a raster with the WaSim grid).
 
-    # 2. Filter raster list to only include rasters corresponding to the analysis date range
-    snow_raster_wasim_paths = file_management.filter_raster_lists(snow_raster_wasim_paths, config_input.start_date,
+    :param array: np.array with the WaSim grid values (np.nan in no data cells)
+    :param gt: geotransform of the WaSim raster
+    :param save_path: path of the resampled raster
+    :return: [np.array with the resampled values (np.nan in no data cells), geotransform of the resampled raster]
+    """
+    if config_input.wasim_in_memory:
+        resampled, grid_gt, proj = resample_in_memory(array, gt)
+        rc.save_raster(np.where(np.isnan(resampled), no_data, resampled), save_path, grid_gt, proj, no_data)
+        return resampled, grid_gt
+
+    original_path = os.path.join(os.path.dirname(save_path), "Original_" + os.path.basename(save_path))
+    gt_snap, proj = rc.get_raster_data(config_input.snapraster_path)
+    rc.save_raster(np.where(np.isnan(array), no_data, array), original_path, gt, proj, no_data)
+    resampling.main(original_path, config_input.snapraster_path, config_input.shape_path, save_path)
+    if os.path.exists(original_path):
+        os.remove(original_path)
+    dataset, resampled, grid_gt = gu.raster2array(save_path)
+    return resampled, grid_gt
+
+
+def save_binary(resampled, gt, date):
+    """Generates and saves the binary snow cover raster of a month (1: snow storage > 10 mm, 0: otherwise).
+
+    :param resampled: np.array with the resampled snow storage at the end of the month
+    :param gt: geotransform of the resampled raster
+    :param date: date (in datetime format) of the month
+    :return: ---
+    """
+    snowcover = np.where(resampled > snow_threshold, 1, 0)
+    binary_wasim = os.path.join(file_management.snow_cover_path,
+                                f"Snow_WaSim_binary_{str(date.strftime('%Y%m'))}.tif")
+    gu.create_raster(binary_wasim, snowcover, epsg=32634, nan_val=-9999, rdtype=gdal.GDT_UInt32, geo_info=gt)
+
+
+def process_wasim_month_in_memory(snow_storage_path):
+    """Same as 'process_wasim_month', but the snow storage raster is resampled in memory (see 'resample_in_memory') and
+    the binary snow cover raster is generated from the resampled array.
+
+    :param snow_storage_path: path of the WaSim snow storage raster, with the date in the file name
+    :return: ---
+    """
+    date = file_management.get_date(snow_storage_path)
+    path = os.path.join(config_input.snow_wasim_path, snow_storage_path)
+    resampled, gt = resample_array(rc.raster_to_nan_array(path), raster_metadata.get_metadata(path).gt, os.path.join(
+        config_input.results_path, f'wasim', f"Snow_WaSim_{str(date.strftime('%Y%m'))}.tif"))
+    save_binary(resampled, gt, date)
+
+
+def aggregate_month(snow_storage_paths):
+    """Reduces the daily (or hourly) WaSim snow storage rasters of a month to monthly values, reading one raster at a
+    time (in time order) into the same buffer and updating the accumulators of the month:
+        end: snow storage of the last raster of the month (snow storage at the end of the month)
+        mean: mean snow storage of all rasters of the month
+        max: maximum snow storage of all rasters of the month
+        snow_days: number of days with a snow storage above the snow threshold (10 mm), each raster counting as the
+        number of days of the month divided by the number of rasters in the month (e.g. 1/24 days for hourly rasters)
+
+    :param snow_storage_paths: list with the paths of the WaSim snow storage rasters of a month, sorted by date
+    :return: [dictionary with an np.array (WaSim grid, np.nan in no data cells) for 'end', 'mean', 'max' and
+    'snow_days', geotransform of the WaSim rasters]
+    """
+    date = file_management.get_date(snow_storage_paths[0])
+    step_days = calendar.monthrange(date.year, date.month)[1] / len(snow_storage_paths)
+    reference = raster_metadata.get_metadata(snow_storage_paths[0])
+    gt = reference.gt
+
+    buffer = None
+    for path in snow_storage_paths:
+        metadata = raster_metadata.get_metadata(path)
+        if (metadata.gt, metadata.x_size, metadata.y_size) != (gt, reference.x_size, reference.y_size):
+            sys.exit("The WaSim raster {} does not have the same grid as {}. Check input rasters.".format(
+                path, snow_storage_paths[0]))
+        buffer = rc.raster_to_nan_array(path, out=buffer)
+        if path == snow_storage_paths[0]:
+            total = np.zeros(buffer.shape, dtype=np.float64)
+            count = np.zeros(buffer.shape, dtype=np.int32)
+            maximum = np.full(buffer.shape, np.nan, dtype=np.float32)
+            snow_days = np.zeros(buffer.shape, dtype=np.float32)
+        valid = ~np.isnan(buffer)
+        total[valid] += buffer[valid]
+        count += valid
+        np.fmax(maximum, buffer, out=maximum)
+        snow_days[buffer > snow_threshold] += step_days
+
+    no_values = count == 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (total / count).astype(np.float32)
+    mean[no_values] = np.nan
+    snow_days[no_values] = np.nan
+    return {"end": buffer.copy(), "mean": mean, "max": maximum, "snow_days": snow_days}, gt
+
+
+def aggregate_outputs(date):
+    """Gets the paths of the monthly rasters generated from the daily (or hourly) WaSim rasters of a month.
+
+    :param date: date (in datetime format) of the month
+    :return: dictionary with the path of the raster of each value of 'aggregate_month'
+    """
+    month = date.strftime('%Y%m')
+    folder = os.path.join(config_input.results_path, 'wasim')
+    return {"end": os.path.join(folder, f"Snow_WaSim_{month}.tif"),
+            "mean": os.path.join(folder, f"Snow_WaSim_mean_{month}.tif"),
+            "max": os.path.join(folder, f"Snow_WaSim_max_{month}.tif"),
+            "snow_days": os.path.join(folder, f"Snow_WaSim_snow_days_{month}.tif")}
+
+
+def process_wasim_month_files(snow_storage_paths):
+    """Processes the WaSim snow storage rasters of one month: with a single (monthly) raster, the raster is resampled
+    and the binary snow cover raster generated ('process_wasim_month' or 'process_wasim_month_in_memory'). With daily
+    or hourly rasters, the rasters are first reduced to monthly values ('aggregate_month'): the snow storage at the end
+    of the month is used as the monthly snow storage (and for the binary snow cover raster), and the mean, maximum and
+    days with snow are also saved in the 'wasim' results folder.
+
+    :param snow_storage_paths: list with the paths of the WaSim snow storage rasters of a month, sorted by date
+    :return: ---
+    """
+    if len(snow_storage_paths) == 1:
+        if config_input.wasim_in_memory:
+            process_wasim_month_in_memory(snow_storage_paths[0])
+        else:
+            process_wasim_month(snow_storage_paths[0])
+        return
+
+    date = file_management.get_date(snow_storage_paths[0])
+    values, gt = aggregate_month([os.path.join(config_input.snow_wasim_path, p) for p in snow_storage_paths])
+    outputs = aggregate_outputs(date)
+    for name in ["mean", "max", "snow_days"]:
+        resample_array(values[name], gt, outputs[name])
+    resampled, grid_gt = resample_array(values["end"], gt, outputs["end"])
+    save_binary(resampled, grid_gt, date)
+
+
+def process_wasim_results(date_list=None):
+    """Resamples the WaSim snow storage rasters and generates the binary snow cover rasters for each month in the
+    analysis date range. The WaSim rasters can be monthly, daily or hourly (see 'process_wasim_month_files').
+
+    :param date_list: (optional) list with the months (in datetime format) to process. If None, all months in the
+    analysis date range are processed.
+    :return: ---
+    """
+    # 1-2. Get the rasters corresponding to the analysis date range: All raster files must be .txt format
+    snow_raster_wasim_paths = file_management.filter_raster_lists(config_input.snow_wasim_path, config_input.start_date,
                                                                   config_input.end_date,
-                                                                  "WaSim snow raster")
-
-    # 3. loop trough list and resample snow storage rasters
-    for i in snow_raster_wasim_paths:
-        # 3.1 Extract date from raster files
-        date = file_management.get_date(i)
-
-        # 3.2 Resample raster to sample resolution and save with the correct date (make function)
-        original_snow_storage_name = os.path.join(config_input.snow_wasim_path, i)
-        resampled_snow_storage = os.path.join(config_input.results_path, f'wasim',
-                                              f"Snow_WaSim_{str(date.strftime('%Y%m'))}.tif")
-        resampling.main(original_snow_storage_name, config_input.snapraster_path, config_input.shape_path,
-                        resampled_snow_storage)
-
-        # 3.3 create binary rasters to detect snow cover similar to satellite imagery
-        # 3.3.1 extract information
-        dataset, array, geotransform = gu.raster2array(
-            os.path.join(config_input.results_path, f'wasim', f"Snow_WaSim_{str(date.strftime('%Y%m'))}.tif"))
-
-        # 3.3.2 create binary raster using 10 mm threshold as snow cover
-        snowcover = np.where(array > 10, 1, 0)
-        binary_wasim = os.path.join(file_management.snow_cover_path,
-                                    f"Snow_WaSim_binary_{str(date.strftime('%Y%m'))}.tif")
-        gu.create_raster(binary_wasim, snowcover, epsg=32634, nan_val=-9999, rdtype=gdal.GDT_UInt32,
-                         geo_info=geotransform)
+                                                                  "WaSim snow raster", ext=".txt")
+    if date_list is not None:
+        months = [d.strftime('%Y%m') for d in date_list]
+        snow_raster_wasim_paths = [f for f in snow_raster_wasim_paths
+                                   if file_management.get_date(f).strftime('%Y%m') in months]
+
+    # Group the rasters (sorted by date) by month
+    month_paths = [list(paths) for month, paths in itertools.groupby(
+        snow_raster_wasim_paths, key=lambda f: file_management.get_date(f).strftime('%Y%m'))]
+
+    # 3. loop trough the months and resample snow storage rasters
+    if config_input.wasim_in_memory and config_input.wasim_workers > 1 and len(month_paths) > 1:
+        with ProcessPoolExecutor(max_workers=config_input.wasim_workers) as executor:
+            list(tqdm(executor.map(process_wasim_month_files, month_paths), total=len(month_paths),
+                      desc="WaSim snow storage"))
+    else:
+        for paths in tqdm(month_paths, desc="WaSim snow storage"):
+            process_wasim_month_files(paths)
 
 
 if __name__ == '__main__':